@@ -0,0 +1,117 @@
+"""
+Mingxin Zhang
+Network ablation on cached per-network log-Grams
+
+G = sum_i w_i G_i is summed once; the Gram of a subset is that total minus
+the Grams of the dropped networks (or the sum of the kept ones, whichever
+touches fewer networks), and its top eigenvectors are found by a few power
+iterations started from the eigenvectors of the full G.
+"""
+import time
+from functools import partial
+
+import numpy as np
+import torch
+
+from gemini.func import gram_key, load_gram, solver_tol
+from gemini.gram import GramAccumulator
+from gemini.lowrank import randomized_eigh
+from gemini.mashup import (add_networks, eig_residual, load_and_rwr,
+                           pick_eig_solver, top_eigh)
+
+
+def fill_gram_cache(network_files, ngene, num_thread=5, torch_thread=4,
+                    gram_dtype='float32', alpha=0.5, rwr_solver='torch',
+                    rwr_tol=1e-6, truncation=None, kernel='rwr', heat_t=1.0,
+                    push_eps=1e-4):
+    """
+    make sure every network has its log-Gram in the cache, see
+    mashup.add_networks
+    returns the (key, params) of every network
+    """
+    rwr_tol = solver_tol(rwr_solver, rwr_tol, push_eps)
+    keys = [gram_key(network_file, ngene, gram_dtype, alpha, rwr_solver,
+                     rwr_tol, truncation, kernel, heat_t)
+            for network_file in network_files]
+    f = partial(load_and_rwr, ngene, torch_thread, alpha=alpha,
+                solver=rwr_solver, truncation=truncation, tol=rwr_tol,
+                kernel=kernel, t=heat_t, dense=False, gram=True)
+    add_networks(None, f, network_files, range(len(network_files)), None,
+                 ngene, num_thread, gram_dtype, alpha, rwr_solver, rwr_tol,
+                 truncation, kernel, heat_t)
+    return keys
+
+
+def sum_grams(keys, ngene, weights, acc=None):
+    """
+    add w_i G_i of the networks in keys into acc (a new cpu accumulator by
+    default) and return it, still half filled, see GramAccumulator
+    """
+    acc = GramAccumulator(ngene, 'cpu') if acc is None else acc
+    for (key, _), w in zip(keys, weights):
+        packed, scale = load_gram(key)
+        acc.add_packed(packed, w, scale)
+        del(packed)
+    return acc
+
+
+def warm_eigh(G, ndim, V0=None, n_iter=4, tol=1e-2, seed=1):
+    """
+    top ndim eigenpairs of the torch matrix G by power iterations started
+    from V0, with a full top_eigh when the residual stays above tol
+    returns d, V, the max relative residual and the solver used
+    """
+    ngene = G.shape[0]
+    if V0 is not None:
+        d, V, res = randomized_eigh(G.mm, ngene, ndim, ndim // 4 + 10,
+                                    n_iter, seed=seed, X0=V0)
+        d, V = d.numpy(), V.numpy()
+        if res <= tol:
+            return d, V, res, 'warm'
+    solver = pick_eig_solver(ndim, ngene)
+    d, V = top_eigh(G, ndim, solver, seed=seed)
+    return d, V, eig_residual(G, d, V), solver
+
+
+def ablation_embeddings(keys, ngene, ndim, subsets, weights=None,
+                        n_iter=4, tol=1e-2, torch_thread=20):
+    """
+    yield (name, x, info) for the full collection ('all') and then for
+    every subset, a dict name -> indices of the networks kept; x is
+    diag(d^{1/4}) V^T as network_svd returns it
+    info: networks kept, networks added or subtracted, eigen residual,
+    solver and seconds
+    """
+    torch.set_num_threads(torch_thread)
+    num_nets = len(keys)
+    weights = np.ones(num_nets) if weights is None else np.asarray(weights)
+
+    s = time.time()
+    total = sum_grams(keys, ngene, weights).numpy()
+    d, V, res, solver = warm_eigh(torch.from_numpy(total), ndim)
+    V_all = V
+    yield 'all', np.diag(np.sqrt(np.sqrt(d))).dot(V.T), {
+        'networks': num_nets, 'touched': num_nets, 'residual': res,
+        'solver': solver, 'seconds': time.time() - s}
+
+    acc = GramAccumulator(ngene, 'cpu')
+    for name, keep in subsets.items():
+        s = time.time()
+        keep = np.unique(np.asarray(keep, dtype=int))
+        drop = np.setdiff1d(np.arange(num_nets), keep)
+        acc.RR_sum.zero_()
+        acc.half = False
+        if len(drop) <= len(keep):
+            acc.RR_sum.numpy()[...] = total
+            sum_grams([keys[i] for i in drop], ngene, -weights[drop], acc)
+            touched = len(drop)
+        else:
+            sum_grams([keys[i] for i in keep], ngene, weights[keep], acc)
+            touched = len(keep)
+        G = acc.result()
+        d, V, res, solver = warm_eigh(G, ndim, V_all, n_iter, tol)
+        x = np.diag(np.sqrt(np.sqrt(d))).dot(V.T)
+        yield name, x, {
+            'networks': len(keep), 'touched': touched, 'residual': res,
+            'solver': solver, 'seconds': time.time() - s}
+        del(d, V, x)
@@ -2,6 +2,7 @@
 Mingxin Zhang
 Help functions
 """
+import hashlib
 import os
 import sys
 
@@ -10,8 +11,18 @@ from config import GEMINI_DIR
 import numpy as np
 import pandas as pd
 import json
-from gemini.rwr_func import rwr, rwr_torch
-from scipy.sparse import csr_matrix, load_npz, save_npz
+from gemini.gram import network_gram, pack_gram
+from gemini.net_store import (collection_store, is_store_network,
+                              network_csr, open_store)
+from gemini.net_io import load_edges, write_edges
+from gemini.rwr_cache import (cache_key, load_entry, read_manifest,
+                              rwr_params, save_entry)
+from gemini.rwr_func import (FactoredRWR, RestrictedRWR, RWREig, factor_rwr,
+                              heat_kernel, padded_size, parse_truncation,
+                              rwr_batched, rwr_blocks, rwr_push_blocks,
+                              rwr_restricted, rwr_solve, rwr_woodbury,
+                              sparsify_rwr, trivial_nodes)
+from scipy.sparse import csr_matrix, diags, issparse, load_npz
 from scipy.stats import moment
 
 
@@ -96,6 +107,26 @@ def out_string_nets(net, org):
     return string_nets
 
 
+def out_network_files(net, org):
+    """
+    network paths of a collection, pointing into the packed store written by
+    process_data for the networks it holds and at the adjacency text files
+    otherwise; the `*_ex` collections share one store, and the human store
+    is only written for human_match
+    """
+    string_nets = out_string_nets(net, org)
+    store_dir = GEMINI_DIR + collection_store(org, net)
+    text_dir = GEMINI_DIR + f'data/networks/{org}'
+    stored = set()
+    if os.path.exists(store_dir + '/meta.json'):
+        stored = set(open_store(store_dir).names)
+    files = []
+    for n in string_nets:
+        name = f'{org}_string_{n}_adjacency.txt'
+        files.append(f'{store_dir if name in stored else text_dir}/{name}')
+    return files
+
+
 def textread(filename, astype=str):
     output = []
     with open(filename, 'r') as f:
@@ -162,40 +193,32 @@ def load_IntAct(genes):
     return anno
 
 
-def load_network(network_file=None, ngene=None, sym=True):
+def load_network(network_file=None, ngene=None, sym=True, sparse=False,
+                 degree=False):
     """
-    load network matrix from text file
+    load network matrix from text file or packed store, see net_store
+    sparse: return the row normalized adjacency as a csr_matrix, without ever
+    allocating a dense ngene x ngene array
+    degree: also return the weighted degrees the rows were divided by
     """
-
-    # sparse_network_file = network_file.replace('.txt', '_A.npz')
-    # if not os.path.exists(sparse_network_file):
-    A = np.zeros((ngene, ngene), dtype='float32')
-    with open(network_file, 'r') as f:
-        for line in f.readlines():
-            x, y, n = line.split()
-            x, y, n = int(x), int(y), np.abs(float(n))
-            A[x, y] = n
+    A = network_csr(network_file, ngene)
 
     if sym:
-        if (A == np.transpose(A)).sum() != ngene**2:
-            A = A + np.transpose(A)
+        if (A != A.T).nnz > 0:
+            A = A + A.T
 
-    # np.fill_diagonal(A, 1)
-    # A = A - diag(diag(A)
     # if only 0 in one line, assign 1 to diag
-
-    A = A + np.diag(sum(A) == 0)
-    adjma = A
-    adjma = adjma / (np.expand_dims(np.sum(adjma, axis=1), axis=1) + 0)
-    # adjma_sparse = csr_matrix(adjma)
-    # save_npz(sparse_network_file, adjma_sparse)
-    # del(adjma_sparse)
+    A = A + diags((np.asarray(A.sum(axis=0)).ravel() == 0).astype('float32'))
+    deg = np.asarray(A.sum(axis=1), dtype='float32').ravel()
+    with np.errstate(divide='ignore'):
+        inv_deg = 1 / deg
+    adjma = csr_matrix(diags(inv_deg).dot(A), dtype='float32')
     del(A)
-    # else:
-    #     adjma_sparse = load_npz(sparse_network_file)
-    #     adjma = adjma_sparse.todense()
-    #     del(adjma_sparse)
 
+    if not sparse:
+        adjma = adjma.toarray()
+    if degree:
+        return adjma, deg
     return adjma
 
 
@@ -211,37 +234,500 @@ def min_max(x):
 
 
 
-def out_moment_emb(data, idx, use_torch=True):
-    network_files, average_type, ngene = data
-    network_file = network_files[idx]
+def solver_tol(solver, tol=1e-6, push_eps=1e-4):
+    """
+    tol argument of get_rwr for solver: push_eps for 'push', whose Q drops
+    the entries below it, so 1e-4 keeps it sparse; tol, the accuracy of the
+    iterative solvers and of the heat series, otherwise
+    """
+    return push_eps if solver == 'push' else tol
+
 
-    sparse_network_file = network_file.replace('txt', 'npz')
-    dense_network_file = network_file.replace('txt', 'npy')
-    # print('init', time.time()-s)
-    if os.path.exists(sparse_network_file) or \
-            os.path.exists(dense_network_file):
-        # print(time.time()-s)
-        if os.path.exists(dense_network_file):
-            # print('load', dense_network_file)
-            Q = np.load(dense_network_file)
-            # print('loaded', dense_network_file)
+def rwr_key(network_file, ngene, alpha=0.5, solver='torch', dtype='float32',
+            tol=1e-6, max_iter=100, truncation=None):
+    """
+    cache key and parameters of an RWR result, tol and max_iter only take
+    part for the iterative 'sparse' solver, tol alone for 'push'
+    """
+    if solver == 'sparse':
+        params = rwr_params(ngene, alpha, solver, dtype, truncation,
+                            tol=tol, max_iter=max_iter)
+    elif solver == 'push':
+        params = rwr_params(ngene, alpha, solver, dtype, truncation, tol=tol)
+    else:
+        params = rwr_params(ngene, alpha, solver, dtype, truncation)
+    return cache_key(network_file, params), params
+
+
+def read_rwr(entry, ngene, dtype='float32', dense=True):
+    """
+    Q of a cache entry: a dense array, or with dense=False a csr_matrix for
+    truncated, a RestrictedRWR for restricted and a FactoredRWR for low-rank
+    entries
+    """
+    if 'indptr' in entry:
+        Q = csr_matrix((entry['data'], entry['indices'], entry['indptr']),
+                       shape=(ngene, ngene))
+        return Q.toarray() if dense else Q
+    if 'idx' not in entry:
+        return entry['Q']
+    if 'U' in entry:
+        Q = FactoredRWR(entry['idx'], entry['U'], entry['s'], entry['Vt'],
+                        ngene)
+    else:
+        Q = RestrictedRWR(entry['idx'], entry['block'], ngene)
+    return Q.todense(dtype) if dense else Q
+
+
+def store_rwr(key, Q, network_file, params, dtype='float32', dense=True,
+              truncation=None, meta=None):
+    """
+    cache a freshly solved Q (array, RestrictedRWR or the csr_matrix of
+    the push solver), sparsified or factored first when truncation is set,
+    and return it as read_rwr would; a lowrank truncation that would not
+    shrink the entry keeps the exact Q
+    meta: extra manifest metadata, e.g. the lineage of an update_rwr entry
+    """
+    meta = {} if meta is None else meta
+    restrict = isinstance(Q, RestrictedRWR)
+    ngene = Q.shape[0]
+    if restrict:
+        Q.block = Q.block.astype(dtype, copy=False)
+    else:
+        Q = Q.astype(dtype, copy=False)
+    if truncation is not None and truncation.startswith('lowrank'):
+        if issparse(Q):
+            raise ValueError('a lowrank truncation needs a dense or '
+                             'restricted Q, not the sparse push Q')
+        F, stats = factor_rwr(Q, parse_truncation(truncation)[1])
+        if stats['compression'] > 1:
+            save_entry(key, {'idx': F.idx, 'U': F.U, 's': F.s, 'Vt': F.Vt},
+                       network_file, params, meta={**stats, **meta})
+            return F.todense(dtype) if dense else F
+        # the factors would not be smaller, keep the exact matrix
+        del(F)
+        meta = {**stats, 'factored': False, **meta}
+        truncation = None
+    if truncation is not None or issparse(Q):
+        if restrict:
+            Q, stats = Q.tosparse(truncation)
+        elif truncation is not None:
+            Q, stats = sparsify_rwr(Q, truncation)
         else:
-            # print('load', sparse_network_file)
-            Q_sparse = load_npz(sparse_network_file)
-            # print(time.time()-s)
-            Q = Q_sparse.todense()
-            del(Q_sparse)
+            stats = {'nnz': int(Q.nnz), 'density': Q.nnz / ngene**2}
+        save_entry(key, {'indptr': Q.indptr, 'indices': Q.indices,
+                         'data': Q.data}, network_file, params,
+                   meta={**(stats or {}), **meta})
+        return Q.toarray() if dense else Q
+    if restrict:
+        save_entry(key, {'idx': Q.idx, 'block': Q.block}, network_file,
+                   params, meta={'covered': len(Q.idx), **meta})
+        return Q.todense(dtype) if dense else Q
+    save_entry(key, {'Q': Q}, network_file, params, meta=meta or None)
+    return Q
+
+
+def get_rwr(network_file, ngene, alpha=0.5, solver='torch', dtype='float32',
+            mmap_mode=None, tol=1e-6, max_iter=100, restrict=True,
+            dense=True, truncation=None):
+    """
+    RWR matrix Q of a network, read from or added to the RWR cache
+    mmap_mode: memory-map a cached dense Q instead of reading it
+    tol, max_iter: convergence control of the iterative 'sparse' solver
+    restrict: solve only the covered nodes, component by component, and
+    cache the non-trivial block with its index map, see rwr_restricted
+    dense: return Q as an array, otherwise a cached restricted entry is
+    returned as a RestrictedRWR and a truncated one as a csr_matrix
+    truncation: cache a sparsified Q, 'topk:k', 'mass:f' or 'eps:v', see
+    sparsify_rwr; dropped entries become 0 in the dense Q, so
+    log(Q + 1/ngene) puts them at the log(1/ngene) floor, the kept ones are
+    never renormalized
+    solver='eig' goes through get_rwr_alphas, solver='push' is never
+    restricted, its Q is sparse with entries under-estimated by at most tol,
+    see rwr_push, and is returned as a csr_matrix when dense is False
+    """
+    if solver == 'eig':
+        return get_rwr_alphas(network_file, ngene, [alpha], dtype, restrict,
+                              dense, truncation)[alpha]
+    key, params = rwr_key(network_file, ngene, alpha, solver, dtype, tol,
+                          max_iter, truncation)
+    entry = load_entry(key, mmap_mode=mmap_mode)
+    if entry is not None:
+        return read_rwr(entry, ngene, dtype, dense)
+    print(f'{network_file} not cached')
+    A = load_network(network_file, ngene, sparse=True)
+    if restrict and solver != 'push':
+        Q = rwr_restricted(A, alpha, solver, tol, max_iter)
     else:
-        print(f'{sparse_network_file} not exists')
-        A = load_network(network_file, ngene)
-        if use_torch:
-            Q = rwr_torch(A, 0.5)
+        Q = rwr_solve(A, alpha, solver, tol, max_iter)
+    del(A)
+    return store_rwr(key, Q, network_file, params, dtype, dense, truncation)
+
+
+def legacy_rwr_file(network_file):
+    """
+    .npy or .npz Q that the RWR stage wrote next to a text network before
+    the RWR cache (torch or numpy solver, alpha 0.5), None when missing
+    """
+    for ext in ['npy', 'npz']:
+        path = network_file.replace('txt', ext)
+        if path != network_file and os.path.exists(path):
+            return path
+    return None
+
+
+def read_legacy_rwr(path):
+    if path.endswith('.npy'):
+        return np.load(path)
+    return load_npz(path).toarray()
+
+
+def migrate_legacy_rwr(network_file, ngene, dtype='float32', tol=1e-4):
+    """
+    copy the legacy Q next to network_file into the RWR cache under the
+    key of get_rwr(solver='torch', alpha=0.5), only when it still is the
+    RWR of the current network: written after the network file, of size
+    ngene and with max |Q - alpha I - (1 - alpha) Q A^T| at most tol
+    returns the cache key, None when nothing was migrated
+    """
+    legacy = legacy_rwr_file(network_file)
+    if legacy is None:
+        return None
+    key, params = rwr_key(network_file, ngene)
+    if load_entry(key) is not None:
+        return key
+    if os.path.getmtime(legacy) < os.path.getmtime(network_file):
+        print(f'{legacy} is older than {network_file}, skipped')
+        return None
+    Q = read_legacy_rwr(legacy).astype('float64')
+    if Q.shape != (ngene, ngene):
+        print(f'{legacy} is {Q.shape[0]} x {Q.shape[1]}, not ngene, skipped')
+        return None
+    A = load_network(network_file, ngene, sparse=True)
+    res = np.abs(Q - 0.5 * A.dot(Q.T).T - 0.5 * np.eye(ngene)).max()
+    if res > tol:
+        print(f'{legacy} does not solve the RWR of {network_file} '
+              f'(residual {res:.1e}), skipped')
+        return None
+    idx = np.flatnonzero(~trivial_nodes(A))
+    del(A)
+    Q = RestrictedRWR(idx, Q[np.ix_(idx, idx)], ngene)
+    store_rwr(key, Q, network_file, params, dtype,
+              meta={'migrated': legacy, 'residual': float(res)})
+    return key
+
+
+def network_ngene(network_file):
+    """
+    ngene of a store network, or of the legacy Q next to a text network
+    """
+    if is_store_network(network_file):
+        return open_store(os.path.dirname(network_file)).ngene
+    legacy = legacy_rwr_file(network_file)
+    if legacy is None:
+        raise ValueError(f'ngene of {network_file} is unknown, pass it')
+    if legacy.endswith('.npy'):
+        return np.load(legacy, mmap_mode='r').shape[0]
+    return load_npz(legacy).shape[0]
+
+
+def apply_edge_delta(network_file, out_file, added=None, removed=None):
+    """
+    write network_file with an edge delta applied as the edge list out_file
+    added: (row, col, weight) arrays, a new weight replaces an existing one
+    removed: (row, col) arrays
+    """
+    row, col, weight = load_edges(network_file, absolute=False)
+    if removed is not None:
+        gone = np.isin(edge_ids(row, col), edge_ids(*removed))
+        row, col, weight = row[~gone], col[~gone], weight[~gone]
+    if added is not None:
+        a_row, a_col, a_weight = [np.asarray(x) for x in added]
+        keep = ~np.isin(edge_ids(row, col), edge_ids(a_row, a_col))
+        row = np.concatenate([row[keep], a_row])
+        col = np.concatenate([col[keep], a_col])
+        weight = np.concatenate([weight[keep], a_weight])
+    write_edges(out_file, row, col, weight)
+
+
+def edge_ids(row, col):
+    return (np.asarray(row, dtype=np.int64) << 32) + np.asarray(col)
+
+
+def update_rwr(parent_file, network_file, ngene, alpha=0.5, dtype='float32',
+               max_rank=None, max_depth=8, max_cond=1e4, dense=True):
+    """
+    Q of network_file from the cached Q of parent_file, an earlier release
+    of the same network: the rows of the normalized adjacency that the edge
+    delta changes are folded in with a Woodbury update, see rwr_woodbury,
+    so the cost grows with the change instead of the network
+    the network is solved again, as get_rwr would, when the parent is not
+    cached, when more than max_rank rows changed (default a tenth of the
+    covered nodes), after max_depth chained updates, or when the update is
+    ill-conditioned (max_cond)
+    the manifest meta of the entry records its lineage: parent key, delta
+    hash, changed rows, depth and whether it was updated or recomputed
+    """
+    key, params = rwr_key(network_file, ngene, alpha, 'torch', dtype)
+    entry = load_entry(key)
+    if entry is not None:
+        return read_rwr(entry, ngene, dtype, dense)
+    parent_key, _ = rwr_key(parent_file, ngene, alpha, 'torch', dtype)
+    A = load_network(network_file, ngene, sparse=True)
+    A_old = load_network(parent_file, ngene, sparse=True)
+    dA = csr_matrix(A - A_old)
+    dA.eliminate_zeros()
+    # every node a delta can touch lies in one of the covered sets, the
+    # rest keep their e_i rows
+    idx = np.union1d(np.flatnonzero(~trivial_nodes(A)),
+                     np.flatnonzero(~trivial_nodes(A_old)))
+    rank = len(np.flatnonzero(np.diff(dA.indptr)))
+    lineage = {'parent': parent_key, 'delta_rows': rank,
+               'delta_hash': hashlib.sha1(
+                   dA.indptr.tobytes() + dA.indices.tobytes() +
+                   dA.data.tobytes()).hexdigest()}
+    max_rank = max(1, len(idx) // 10) if max_rank is None else max_rank
+    parent = load_entry(parent_key)
+    depth = 0
+    if parent is not None:
+        meta = read_manifest().get(parent_key, {}).get('meta', {})
+        depth = meta.get('depth', 0) + 1
+
+    Q = None
+    if parent is not None and rank <= max_rank and depth <= max_depth:
+        Q_old = read_rwr(parent, ngene, dtype, dense=False)
+        if isinstance(Q_old, RestrictedRWR):
+            # the old Q on idx, from its block without a dense ngene x ngene
+            pos = np.searchsorted(idx, Q_old.idx)
+            Q = np.eye(len(idx), dtype=dtype)
+            Q[np.ix_(pos, pos)] = Q_old.block
         else:
-            Q = rwr(A, 0.5)
-        Q_sparse = csr_matrix(Q)
-        save_npz(sparse_network_file, Q_sparse)
+            Q = np.asarray(Q_old)[np.ix_(idx, idx)]
+        del(Q_old)
+        Q, cond = rwr_woodbury(Q, dA[idx][:, idx], alpha)
+        if cond > max_cond:
+            print(f'{network_file}: Woodbury update conditioned at '
+                  f'{cond:.1e}, solving again')
+            Q = None
+    if Q is None:
+        print(f'{network_file}: solving, {rank} rows changed')
+        del(A_old)
+        Q = rwr_restricted(A, alpha)
+        return store_rwr(key, Q, network_file, params, dtype, dense,
+                         meta={**lineage, 'depth': 0, 'update': 'recompute'})
+    covered = np.flatnonzero(~trivial_nodes(A))
+    pos = np.searchsorted(idx, covered)
+    Q = RestrictedRWR(covered, Q[np.ix_(pos, pos)], ngene)
+    return store_rwr(key, Q, network_file, params, dtype, dense,
+                     meta={**lineage, 'depth': depth, 'update': 'woodbury'})
+
+
+def get_rwr_alphas(network_file, ngene, alphas, dtype='float32',
+                   restrict=True, dense=True, truncation=None):
+    """
+    Q of a network for every restart probability in alphas, each cached
+    under its own key (solver 'eig'); the network is factored once, see
+    RWREig, and only when some alpha is missing from the cache
+    returns a dict alpha -> Q
+    """
+    Qs = {}
+    factor = None
+    for alpha in alphas:
+        key, params = rwr_key(network_file, ngene, alpha, 'eig', dtype,
+                              truncation=truncation)
+        entry = load_entry(key)
+        if entry is not None:
+            Qs[alpha] = read_rwr(entry, ngene, dtype, dense)
+            continue
+        if factor is None:
+            print(f'{network_file} not cached, factoring')
+            A, deg = load_network(network_file, ngene, sparse=True,
+                                  degree=True)
+            factor = RWREig(A, deg, restrict)
+            del(A, deg)
+        Qs[alpha] = store_rwr(key, factor.rwr(alpha), network_file, params,
+                              dtype, dense, truncation)
+    return Qs
+
+
+def heat_key(network_file, ngene, t=1.0, dtype='float32', tol=1e-6,
+             truncation=None):
+    """
+    cache key and parameters of a heat kernel, see get_heat
+    """
+    params = rwr_params(ngene, None, 'heat', dtype, truncation, t=t,
+                        tol=tol)
+    return cache_key(network_file, params), params
+
+
+def gram_key(network_file, ngene, gram_dtype='float32', alpha=0.5,
+             solver='torch', tol=1e-6, truncation=None, kernel='rwr',
+             t=1.0):
+    """
+    cache key and parameters of the log-Gram R^T R of a network: those of
+    its Q plus the dtype of the packed triangle
+    """
+    if kernel == 'heat':
+        _, params = heat_key(network_file, ngene, t, tol=tol,
+                             truncation=truncation)
+    else:
+        _, params = rwr_key(network_file, ngene, alpha, solver, tol=tol,
+                            truncation=truncation)
+    params = {**params, 'gram': gram_dtype}
+    return cache_key(network_file, params), params
+
+
+def load_gram(key):
+    """
+    (packed, scale) of a cached log-Gram, None when missing
+    """
+    entry = load_entry(key)
+    if entry is None:
+        return None
+    return entry['packed'], float(entry['scale'])
+
+
+def store_gram(key, Q, ngene, network_file, params, gram_dtype='float32'):
+    """
+    compute, pack and cache the log-Gram of Q (overwritten), see
+    gram.pack_gram; returns (packed, scale)
+    """
+    packed, scale = pack_gram(network_gram(Q, ngene, 'cpu'), gram_dtype)
+    save_entry(key, {'packed': packed, 'scale': np.array(scale)},
+               network_file, params)
+    return packed, scale
+
+
+def get_heat(network_file, ngene, t=1.0, dtype='float32', tol=1e-6,
+             dense=True, truncation=None):
+    """
+    heat kernel H of a network, the diffusion counterpart of get_rwr, read
+    from or added to the RWR cache under its own parameters (t, tol)
+    only the covered nodes are diffused, the others keep e_i rows as in
+    rwr_restricted, see heat_blocks
+    """
+    key, params = heat_key(network_file, ngene, t, dtype, tol, truncation)
+    entry = load_entry(key)
+    if entry is not None:
+        return read_rwr(entry, ngene, dtype, dense)
+    print(f'{network_file} not cached')
+    A = load_network(network_file, ngene, sparse=True)
+    idx = np.flatnonzero(~trivial_nodes(A))
+    H = RestrictedRWR(idx, heat_kernel(A[idx][:, idx], t, tol), ngene)
+    del(A)
+    return store_rwr(key, H, network_file, params, dtype, dense, truncation)
+
+
+def get_rwr_batched(network_files, ngene, alpha=0.5, dtype='float32',
+                    truncation=None, small=512, max_bytes=2**28,
+                    dense=True):
+    """
+    yield (i, Q) for network_files[i], solving the uncached networks with at
+    most small covered nodes together: they are grouped by padded size, see
+    padded_size, and each group of at most max_bytes of systems goes through
+    one rwr_batched call before its Qs are cached one entry per network,
+    under the same key as get_rwr(solver='torch')
+    Q is None for an uncached network above small, left to get_rwr
+    """
+    groups = {}
+
+    def flush(size):
+        group = groups.pop(size)
+        Qs = rwr_batched([sub for _, _, _, _, sub in group], alpha, size)
+        for (i, key, params, idx, _), block in zip(group, Qs):
+            Q = RestrictedRWR(idx, block, ngene)
+            yield i, store_rwr(key, Q, network_files[i], params, dtype,
+                               dense, truncation)
+        del(Qs)
+
+    for i, network_file in enumerate(network_files):
+        key, params = rwr_key(network_file, ngene, alpha, 'torch', dtype,
+                              truncation=truncation)
+        entry = load_entry(key)
+        if entry is not None:
+            yield i, read_rwr(entry, ngene, dtype, dense)
+            continue
+        A = load_network(network_file, ngene, sparse=True)
+        idx = np.flatnonzero(~trivial_nodes(A))
+        if len(idx) > small:
+            yield i, None
+            continue
+        size = padded_size(len(idx))
+        groups.setdefault(size, []).append(
+            (i, key, params, idx, A[idx][:, idx]))
         del(A)
+        # the system, right-hand side and solution of every member
+        if len(groups[size]) * 3 * size * size * 4 >= max_bytes:
+            yield from flush(size)
+    for size in sorted(groups):
+        yield from flush(size)
+
 
+def rwr_row_blocks(network_file, ngene, alpha=0.5, solver='torch',
+                   dtype='float32', block=1024, tol=1e-6, max_iter=100,
+                   truncation=None):
+    """
+    yield (start, end, Q[start:end]) of a network without holding its whole
+    Q: sliced from the RWR cache when get_rwr has an entry for the same
+    parameters, solved block by block otherwise, see rwr_blocks (use
+    solver='sparse' to avoid the dense factorization as well); a low-rank
+    entry is rebuilt block by block from its factors, an uncached network
+    under a lowrank truncation yields the exact rows
+    """
+    key, _ = rwr_key(network_file, ngene, alpha, solver, dtype, tol,
+                     max_iter, truncation)
+    entry = load_entry(key, mmap_mode='r')
+    if entry is None:
+        A = load_network(network_file, ngene, sparse=True)
+        if solver == 'push':
+            blocks = ((start, end, Qb.toarray()) for start, end, Qb in
+                      rwr_push_blocks(A, alpha, tol, block))
+        else:
+            blocks = rwr_blocks(A, alpha, block, solver, tol, max_iter)
+        for start, end, Qb in blocks:
+            if truncation is not None and \
+                    not truncation.startswith('lowrank'):
+                Qb = sparsify_rwr(Qb, truncation)[0].toarray()
+            yield start, end, Qb.astype(dtype, copy=False)
+        return
+    if 'indptr' in entry or 'idx' in entry:
+        Q = read_rwr(entry, ngene, dtype, dense=False)
+    else:
+        Q = entry['Q']
+    for start in range(0, ngene, block):
+        end = min(start + block, ngene)
+        if 'indptr' in entry:
+            Qb = Q[start:end].toarray()
+        elif 'idx' in entry:
+            Qb = Q.rows(start, end, dtype)
+        else:
+            Qb = np.array(Q[start:end])
+        yield start, end, Qb
+
+
+def out_moment_emb(data, idx, use_torch=True, block=None, alpha=0.5,
+                   truncation=None):
+    network_files, average_type, ngene = data
+    network_file = network_files[idx]
+    solver = 'torch' if use_torch else 'numpy'
+
+    if block is not None:
+        # row moments only need the rows, so Q is streamed in row blocks
+        parts = []
+        for _, _, Qb in rwr_row_blocks(network_file, ngene, alpha, solver,
+                                       block=block, truncation=truncation):
+            parts.append(out_moments(Qb))
+            del(Qb)
+        return [np.concatenate(p) for p in zip(*parts)]
+
+    Q = get_rwr(network_file, ngene, alpha, solver, truncation=truncation)
+    return out_moments(Q)
+
+
+def out_moments(Q):
+    """
+    per row standardized and raw central moments of order 1 to 4
+    """
     output = []
     for R in [Q]:
         # for R in [G, N]:
@@ -0,0 +1,305 @@
+"""
+Mingxin Zhang
+Streaming accumulation of the Gram matrix sum_i w_i R_i^T R_i, R_i =
+log(Q_i + 1/ngene), with at most a fixed number of RWR matrices in memory
+"""
+import resource
+import threading
+from queue import Queue
+
+import numpy as np
+import torch
+from scipy.linalg import blas
+from scipy.sparse import issparse
+
+
+class GramAccumulator:
+    """
+    running ngene x ngene sum on device
+    transform: 'log' adds w log(Q + 1/ngene)^T log(Q + 1/ngene), None adds w Q
+    the log is taken in place on Q, so pass a matrix that can be overwritten
+    Q may also be a whole matrix or row blocks of it, a RestrictedRWR or
+    FactoredRWR, a RestrictedGram, or an object with rows(start, end)
+
+    On the cpu the product is a symmetric rank-k update (BLAS ssyrk) that
+    writes only the lower triangle of RR_sum, with the weight as alpha and
+    beta = 1; result() mirrors it into the upper triangle once. On other
+    devices it is a single in-place addmm_ with alpha = w.
+
+    A restricted Q only adds its covered block, see add_restricted; the
+    terms it shares with every other restricted network (a multiple of
+    1 1^T, of the identity and a rank-two 1 b^T + b 1^T) are summed as a
+    scalar and a vector and added once, by result().
+    """
+
+    def __init__(self, ngene, device=None, transform='log'):
+        if device is None:
+            device = torch.device(
+                'cuda' if torch.cuda.is_available() else 'cpu')
+        self.ngene = ngene
+        self.device = torch.device(device)
+        self.transform = transform
+        self.RR_sum = torch.zeros((ngene, ngene), dtype=torch.float32,
+                                  device=self.device)
+        self.half = False
+        # deferred k 1 1^T + 1 b^T + b 1^T + diag I of restricted networks
+        self.k = 0.
+        self.diag = 0.
+        self.b = None
+
+    def add(self, Q, w=1, block=1024):
+        if isinstance(Q, RestrictedGram) or (
+                hasattr(Q, 'idx') and hasattr(Q, 'block')):
+            self.add_restricted(Q, w)
+            return
+        if hasattr(Q, 'rows'):
+            # any other row-wise Q, rebuilt one row block at a time
+            for start in range(0, self.ngene, block):
+                self.add(Q.rows(start, min(start + block, self.ngene)), w)
+            return
+        if issparse(Q):
+            Q = Q.toarray()
+        if not torch.is_tensor(Q):
+            Q = np.asarray(Q)
+            if Q.dtype != np.float32 or not Q.flags.writeable:
+                Q = Q.astype('float32')
+            Q = torch.from_numpy(Q)
+        Q = Q.to(self.device, torch.float32)
+        if self.transform == 'log':
+            R = Q.add_(1 / self.ngene).log_()
+            if self.device.type == 'cpu':
+                self._syrk(R.contiguous(), float(w))
+            else:
+                self.RR_sum.addmm_(R.T, R, alpha=float(w))
+        else:
+            self.RR_sum.add_(Q, alpha=float(w))
+        del(Q)
+
+    def add_restricted(self, Q, w=1):
+        """
+        add a RestrictedRWR / FactoredRWR Q, or the RestrictedGram of one,
+        in O(|S|^2) for its covered nodes S; with the log transform a
+        RestrictedRWR is reduced here, see restricted_gram
+        """
+        w = float(w)
+        if self.b is None:
+            self.b = torch.zeros(self.ngene, dtype=torch.float32,
+                                 device=self.device)
+        if self.transform == 'log':
+            if not isinstance(Q, RestrictedGram):
+                Q = restricted_gram(Q, self.ngene)
+            c, delta = log_floor(self.ngene)
+            idx = torch.from_numpy(np.asarray(Q.idx, dtype=np.int64)).to(
+                self.device)
+            block = torch.from_numpy(np.array(
+                Q.gram, dtype='float32')).to(self.device)
+            block.diagonal().sub_(delta**2)
+            self.k += w * (self.ngene * c**2 + 2 * c * delta)
+            self.diag += w * delta**2
+            self.b.index_add_(0, idx, torch.from_numpy(
+                Q.colsum - delta).to(self.device), alpha=w * c)
+        else:
+            # Q = I + P_S (B - I) P_S^T
+            idx = torch.from_numpy(np.asarray(Q.idx, dtype=np.int64)).to(
+                self.device)
+            block = torch.from_numpy(np.array(
+                Q.block, dtype='float32')).to(self.device)
+            block.diagonal().sub_(1)
+            self.diag += w
+        # the block is symmetric for the log-Gram and written whole, so the
+        # lower triangle stays right when the rest of RR_sum is half filled
+        self.RR_sum[idx[:, None], idx] += w * block
+        del(block)
+
+    def add_packed(self, packed, w=1, scale=1.):
+        """
+        add w scale G for a symmetric G given as its packed triangle, see
+        pack_gram; on the cpu only the lower triangle is touched
+        """
+        w = float(w) * float(scale)
+        if self.device.type == 'cpu':
+            A = self.RR_sum.numpy()
+            for i, start in enumerate(packed_offsets(self.ngene)):
+                A[i, :i + 1] += w * packed[start:start + i + 1].astype(
+                    'float32')
+            self.half = True
+        else:
+            self.RR_sum.add_(torch.from_numpy(unpack_gram(
+                packed, self.ngene)).to(self.device), alpha=w)
+
+    def _syrk(self, R, w):
+        # R.T of a C ordered R is the Fortran ordered matrix BLAS expects,
+        # and RR_sum.T is updated in place as a Fortran ordered C, its
+        # upper triangle being the lower triangle of RR_sum
+        C = self.RR_sum.numpy().T
+        out = blas.ssyrk(w, R.numpy().T, beta=1.0, c=C, trans=0, lower=0,
+                         overwrite_c=1)
+        if not np.shares_memory(out, C):
+            C[...] = out
+        self.half = True
+
+    def symmetrize(self, block=1024):
+        """
+        copy the lower triangle of RR_sum into the upper one, block by
+        block so no ngene x ngene temporary is needed
+        """
+        if not self.half:
+            return
+        A = self.RR_sum.numpy()
+        for start in range(0, self.ngene, block):
+            end = min(start + block, self.ngene)
+            A[start:end, end:] = A[end:, start:end].T
+            diag = A[start:end, start:end]
+            diag[...] = np.tril(diag) + np.tril(diag, -1).T
+        self.half = False
+
+    def result(self):
+        self.symmetrize()
+        if self.b is not None:
+            self.RR_sum.add_(self.k)
+            self.RR_sum.add_(self.b[None, :]).add_(self.b[:, None])
+            self.RR_sum.diagonal().add_(self.diag)
+            self.k, self.diag, self.b = 0., 0., None
+        return self.RR_sum
+
+    def numpy(self):
+        return self.result().cpu().numpy()
+
+
+class RestrictedGram:
+    """
+    log-Gram of a restricted Q reduced to its covered nodes S = idx:
+    gram = E^T E and colsum = 1^T E for E = log(1 + ngene B) the covered
+    block of R - log(1/ngene), see add_restricted
+    """
+
+    def __init__(self, idx, gram, colsum):
+        self.idx = idx
+        self.gram = gram
+        self.colsum = colsum
+
+
+def log_floor(ngene):
+    """
+    c = log(1/ngene), the entries of R = log(Q + 1/ngene) where Q is 0, and
+    delta = log(1 + ngene), those of R - c where Q is 1
+    """
+    return float(np.log(1 / ngene)), float(np.log1p(ngene))
+
+
+def restricted_gram(Q, ngene):
+    """
+    RestrictedGram of a RestrictedRWR or FactoredRWR Q, O(|S|^3)
+    with S the covered nodes and c, delta of log_floor, R = c 1 1^T + E
+    where E is log(1 + ngene B) on S x S, delta on the other diagonal
+    entries and 0 elsewhere, so with a = E^T 1
+    R^T R = ngene c^2 1 1^T + c (1 a^T + a 1^T) + E^T E
+    and E^T E is E_S^T E_S on S x S and delta^2 on the rest of the diagonal
+    """
+    E = torch.from_numpy(np.array(Q.block, dtype='float32'))
+    E.mul_(ngene).log1p_()
+    gram = torch.mm(E.T, E).numpy()
+    colsum = E.sum(dim=0).numpy()
+    del(E)
+    return RestrictedGram(np.asarray(Q.idx), gram, colsum)
+
+
+def network_gram(Q, ngene, device=None):
+    """
+    log-Gram R^T R, R = log(Q + 1/ngene), of one network as a full
+    ngene x ngene float32 array; Q is overwritten as in GramAccumulator.add
+    """
+    acc = GramAccumulator(ngene, device)
+    acc.add(Q)
+    return acc.numpy()
+
+
+def packed_offsets(n):
+    """
+    start of row i of the packed triangle, i (i + 1) / 2
+    """
+    i = np.arange(n, dtype=np.int64)
+    return i * (i + 1) // 2
+
+
+def pack_gram(G, dtype='float32'):
+    """
+    packed triangle of a symmetric G: rows G[i, :i + 1] one after the
+    other, the LAPACK 'U' packed layout of the upper triangle, n (n + 1) / 2
+    entries; float16 stores G / max|G| and returns that scale, as a Gram
+    of thousands of genes is far outside the float16 range
+    returns (packed, scale)
+    """
+    n = len(G)
+    scale = 1.
+    if dtype == 'float16':
+        scale = float(np.abs(G).max()) or 1.
+    packed = np.empty(n * (n + 1) // 2, dtype=dtype)
+    for i, start in enumerate(packed_offsets(n)):
+        packed[start:start + i + 1] = G[i, :i + 1] / scale
+    return packed, scale
+
+
+def unpack_gram(packed, n, scale=1.):
+    """
+    full float32 symmetric matrix of a packed triangle, see pack_gram
+    """
+    G = np.zeros((n, n), dtype='float32')
+    for i, start in enumerate(packed_offsets(n)):
+        G[i, :i + 1] = packed[start:start + i + 1]
+    G += np.tril(G, -1).T
+    if scale != 1.:
+        G *= scale
+    return G
+
+
+def prefetch(f, items, inflight=2):
+    """
+    yield f(item) for items in order, computing the next ones on a
+    background thread while the caller works on the current one
+    inflight: results alive at once, the one being used included
+    """
+    inflight = max(inflight, 1)
+    slots = threading.Semaphore(inflight)
+    done = Queue()
+    stop = threading.Event()
+
+    def worker():
+        for item in items:
+            slots.acquire()
+            if stop.is_set():
+                return
+            try:
+                done.put((True, f(item)))
+            except BaseException as e:
+                done.put((False, e))
+                return
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    try:
+        for _ in range(len(items)):
+            ok, out = done.get()
+            if not ok:
+                raise out
+            yield out
+            del(out)
+            slots.release()
+    finally:
+        stop.set()
+        slots.release()
+        thread.join()
+
+
+def gram_memory(ngene, inflight, itemsize=4):
+    """
+    bytes held by the accumulator plus inflight ngene x ngene matrices
+    """
+    return (1 + inflight) * ngene * ngene * itemsize
+
+
+def report_memory(ngene, inflight):
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**20
+    print(f'Gram accumulation: RR_sum + {inflight} matrices = '
+          f'{gram_memory(ngene, inflight) / 2**30:.2f} GB expected, '
+          f'{peak:.2f} GB peak resident')
@@ -0,0 +1,183 @@
+"""
+Mingxin Zhang
+Incremental embedding of a growing network collection
+
+The state of a collection is its Gram G = sum_i w_i G_i (a packed
+triangle), the top eigenpairs (d, V) of G and the networks and weights in
+it. An update only touches the networks that changed: appended ones are
+solved and added, removed or edited ones subtract their cached log-Gram,
+reweighted ones add the weight difference. (d, V) are then refreshed by a
+few block power iterations started from the previous V, see
+ablation.warm_eigh, with a full eigensolver only when the residual stays
+above tol.
+"""
+import json
+import os
+import time
+from functools import partial
+
+import numpy as np
+import torch
+
+from gemini.ablation import warm_eigh
+from gemini.func import gram_key, load_gram, solver_tol
+from gemini.gram import GramAccumulator, pack_gram
+from gemini.lowrank import embedding_alignment
+from gemini.mashup import (add_networks, load_and_rwr, pick_eig_solver,
+                           top_eigh)
+from gemini.rwr_cache import network_hash
+
+
+def load_state(state_dir):
+    """
+    (meta, packed G, d, V) of a saved collection, None when missing
+    """
+    if not os.path.exists(os.path.join(state_dir, 'state.json')):
+        return None
+    with open(os.path.join(state_dir, 'state.json'), 'r') as f:
+        meta = json.load(f)
+    packed = np.load(os.path.join(state_dir, 'gram.npy'), mmap_mode='r')
+    with np.load(os.path.join(state_dir, 'eig.npz')) as data:
+        d, V = data['d'], data['V']
+    return meta, packed, d, V
+
+
+def save_state(state_dir, meta, G, d, V):
+    """
+    write the state of a collection, state.json last so that an
+    interrupted save leaves the previous state readable
+    """
+    if not os.path.exists(state_dir):
+        os.makedirs(state_dir)
+    for name, save in [('gram.npy', lambda f: np.save(f, pack_gram(G)[0])),
+                       ('eig.npz', lambda f: np.savez(f, d=d, V=V))]:
+        tmp = os.path.join(state_dir, f'.{name}.tmp')
+        with open(tmp, 'wb') as f:
+            save(f)
+        os.replace(tmp, os.path.join(state_dir, name))
+    tmp = os.path.join(state_dir, '.state.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(meta, f, indent=1)
+    os.replace(tmp, os.path.join(state_dir, 'state.json'))
+
+
+def subspace_drift(V0, V):
+    """
+    sine of the largest principal angle between span(V0) and span(V)
+    """
+    s = np.linalg.svd(np.asarray(V0, dtype='float64').T.dot(V),
+                      compute_uv=False)
+    return float(np.sqrt(max(0., 1 - s.min()**2)))
+
+
+def incremental_embedding(state_dir, network_files, ngene, ndim,
+                          weights=None, num_thread=5, torch_thread=4,
+                          gram_cache=None, alpha=0.5, rwr_solver='torch',
+                          rwr_tol=1e-6, truncation=None, kernel='rwr',
+                          heat_t=1.0, n_iter=4, tol=1e-2, check=False,
+                          push_eps=1e-4):
+    """
+    x = diag(d^{1/4}) V^T of the collection network_files (weights), as
+    load_multi returns it, updated from the state in state_dir and saved
+    back; the first call, or one with other RWR parameters, builds it
+    removing or editing a network needs its cached log-Gram (gram_cache),
+    otherwise the state is rebuilt
+    check: also run the full eigensolver and report the drift of x from it
+    returns x and info: networks added, removed and reweighted, eigen
+    residual, solver, subspace drift from the previous V and seconds
+    """
+    s = time.time()
+    torch.set_num_threads(num_thread*torch_thread)
+    rwr_tol = solver_tol(rwr_solver, rwr_tol, push_eps)
+    weights = np.ones(len(network_files)) if weights is None else \
+        np.asarray(weights, dtype=float)
+    _, settings = gram_key(network_files[0], ngene, None, alpha, rwr_solver,
+                           rwr_tol, truncation, kernel, heat_t)
+    del(settings['gram'])
+    current = {network_file: {'hash': network_hash(network_file),
+                              'weight': float(w), 'gram': None}
+               for network_file, w in zip(network_files, weights)}
+    if gram_cache is not None:
+        for network_file, entry in current.items():
+            entry['gram'] = gram_key(network_file, ngene, gram_cache, alpha,
+                                     rwr_solver, rwr_tol, truncation,
+                                     kernel, heat_t)[0]
+
+    state = load_state(state_dir)
+    if state is not None and state[0]['settings'] != settings:
+        print('RWR parameters changed, rebuilding the collection state')
+        state = None
+    removed = []
+    added = []
+    delta = {}
+    if state is not None:
+        old = state[0]['networks']
+        for network_file, entry in old.items():
+            new = current.get(network_file)
+            if (new is None or new['hash'] != entry['hash']) and \
+                    entry['weight'] != 0:
+                removed.append(entry)
+        for idx, network_file in enumerate(network_files):
+            entry = old.get(network_file)
+            if entry is None or entry['hash'] != \
+                    current[network_file]['hash']:
+                added.append(idx)
+                delta[idx] = weights[idx]
+            elif weights[idx] != entry['weight']:
+                delta[idx] = weights[idx] - entry['weight']
+        if any(entry['gram'] is None or load_gram(entry['gram']) is None
+               for entry in removed):
+            print('no cached log-Gram of a removed network, rebuilding the '
+                  'collection state')
+            state = None
+    if state is None:
+        removed = []
+        added = list(range(len(network_files)))
+        delta = dict(enumerate(weights))
+
+    acc = GramAccumulator(ngene, 'cpu')
+    V0 = None
+    if state is not None:
+        _, packed, d0, V0 = state
+        acc.add_packed(packed, 1)
+        del(packed)
+        for entry in removed:
+            packed, scale = load_gram(entry['gram'])
+            acc.add_packed(packed, -entry['weight'], scale)
+            del(packed)
+        V0 = V0[:, :ndim] if V0.shape[1] >= ndim else None
+    f = partial(load_and_rwr, ngene, torch_thread, alpha=alpha,
+                solver=rwr_solver, truncation=truncation, tol=rwr_tol,
+                kernel=kernel, t=heat_t, dense=False, gram=True)
+    idxs = sorted(delta)
+    add_networks(acc, f, network_files, idxs,
+                 {idx: delta[idx] for idx in idxs}, ngene, num_thread,
+                 gram_cache=gram_cache, alpha=alpha, rwr_solver=rwr_solver,
+                 rwr_tol=rwr_tol, truncation=truncation, kernel=kernel,
+                 heat_t=heat_t)
+
+    G = acc.result()
+    if V0 is not None and len(removed) == 0 and len(idxs) == 0:
+        d, V, res, solver = d0[:ndim], V0, 0., 'unchanged'
+    else:
+        d, V, res, solver = warm_eigh(G, ndim, V0, n_iter, tol)
+    x = np.diag(np.sqrt(np.sqrt(d))).dot(V.T)
+    info = {'networks': len(network_files), 'added': len(added),
+            'removed': len(removed), 'reweighted': len(idxs) - len(added),
+            'residual': res, 'solver': solver,
+            'drift': None if V0 is None else
+            0. if solver == 'unchanged' else subspace_drift(V0, V)}
+    info['seconds'] = time.time() - s
+    if check:
+        d_full, V_full = top_eigh(G, ndim, pick_eig_solver(ndim, ngene))
+        info['full drift'] = float(embedding_alignment(
+            x, np.diag(np.sqrt(np.sqrt(d_full))).dot(V_full.T)))
+        info['eigenvalue drift'] = float(np.max(
+            np.abs(d - d_full) / np.abs(d_full).clip(min=1e-30)))
+
+    history = [] if state is None else state[0]['history']
+    save_state(state_dir, {'settings': settings, 'networks': current,
+                           'ndim': ndim, 'history': history + [info]},
+               G.numpy(), d, V)
+    del(acc, G)
+    return x, info
@@ -0,0 +1,179 @@
+"""
+Mingxin Zhang
+Randomized embedding engine: the top ndim eigenpairs of
+G = sum_i w_i R_i^T R_i, R_i = log(Q_i + 1/ngene), without forming G
+
+G is only applied to ngene x (ndim + oversample) blocks, one network at a
+time, G X = sum_i w_i R_i^T (R_i X), so memory is one or two RWR matrices
+plus a few thin blocks instead of the ngene x ngene Gram matrix. Each
+application streams every network once; the engine makes n_iter + 2 passes,
+plus one for every extra power iteration until the residual is within tol.
+A sparse Q (push solver, truncated cache) is never densified, see
+sparse_gram_apply, so neither Q nor G needs ngene x ngene memory; a
+restricted or low-rank Q is rebuilt one row block at a time.
+"""
+import time
+from functools import partial
+
+import numpy as np
+import torch
+from scipy.sparse import csr_matrix, issparse
+
+from gemini.gram import prefetch
+
+
+def gram_apply(load, items, ngene, X, weights=None, inflight=2):
+    """
+    sum_i w_i R_i^T (R_i X) for the networks load(items[i]), X a torch
+    ngene x k block on the device the products should run on
+    """
+    Y = torch.zeros_like(X)
+    for i, Q in enumerate(prefetch(load, items, inflight)):
+        w = 1 if weights is None else float(weights[i])
+        if issparse(Q):
+            Y.add_(sparse_gram_apply(Q, ngene, X), alpha=w)
+            del(Q)
+            continue
+        if hasattr(Q, 'rows'):
+            Y.add_(blocked_gram_apply(Q, ngene, X), alpha=w)
+            del(Q)
+            continue
+        Q = np.asarray(Q)
+        if Q.dtype != np.float32 or not Q.flags.writeable:
+            Q = Q.astype('float32')
+        R = torch.from_numpy(Q).to(X.device).add_(1 / ngene).log_()
+        Y.addmm_(R.T, torch.mm(R, X), alpha=w)
+        del(Q, R)
+    return Y
+
+
+def sparse_gram_apply(Q, ngene, X):
+    """
+    R^T (R X) for a sparse Q without the dense R = log(Q + 1/ngene):
+    R = f 1 1^T + L with the floor f = log(1/ngene) and L = log(1 + ngene Q)
+    on the entries of Q only, so both products cost O(nnz(Q) k)
+    """
+    floor = np.log(1 / ngene)
+    L = csr_matrix(Q, dtype='float32', copy=True)
+    L.data = np.log1p(ngene * L.data)
+    Xn = X.cpu().numpy()
+    RX = floor * Xn.sum(axis=0, keepdims=True) + L.dot(Xn)
+    Y = floor * RX.sum(axis=0, keepdims=True) + L.T.dot(RX)
+    del(L, RX)
+    return torch.from_numpy(np.asarray(Y, dtype=Xn.dtype)).to(X.device)
+
+
+def blocked_gram_apply(Q, ngene, X, block=1024):
+    """
+    R^T (R X) for a RestrictedRWR or FactoredRWR Q, whose dense rows are
+    rebuilt block by block, R^T R X = sum_b R_b^T (R_b X)
+    """
+    Y = torch.zeros_like(X)
+    for start in range(0, ngene, block):
+        end = min(start + block, ngene)
+        R = torch.from_numpy(Q.rows(start, end)).to(X.device)
+        R.add_(1 / ngene).log_()
+        Y.addmm_(R.T, torch.mm(R, X))
+        del(R)
+    return Y
+
+
+def randomized_eigh(apply, ngene, ndim, oversample=10, n_iter=4,
+                    device=None, seed=1, X0=None, tol=None, max_iter=None):
+    """
+    top ndim eigenpairs (d, V) of a symmetric positive semi-definite
+    operator given by apply(X) = G X, through a randomized range finder with
+    n_iter power iterations and a Rayleigh-Ritz step (n_iter + 2 calls)
+    X0: ngene x m start block, e.g. the eigenvectors of a nearby G, filled
+    up with oversample random columns; a close X0 needs fewer iterations
+    tol: go on with one more power iteration and Rayleigh-Ritz step (one
+    call each) while the residual is above tol, up to max_iter iterations
+    returns d, V as torch tensors and max_j ||G v_j - d_j v_j|| / d_j
+    """
+    gen = torch.Generator().manual_seed(seed)
+    if X0 is None:
+        k = min(ndim + oversample, ngene)
+        X = torch.randn(ngene, k, generator=gen).to(device)
+    else:
+        X0 = torch.as_tensor(np.ascontiguousarray(X0), dtype=torch.float32)
+        k = min(X0.shape[1] + oversample, ngene)
+        X = torch.cat([X0, torch.randn(ngene, k - X0.shape[1],
+                                       generator=gen)], dim=1).to(device)
+
+    max_iter = n_iter if max_iter is None else max(max_iter, n_iter)
+    Y = apply(X)
+    for _ in range(n_iter):
+        X, _ = torch.linalg.qr(Y)
+        Y = apply(X)
+    while True:
+        X, _ = torch.linalg.qr(Y)
+        Y = apply(X)
+        # Rayleigh-Ritz on span(X): B = X^T G X
+        B = torch.mm(X.T, Y)
+        B = (B + B.T) / 2
+        d, U = torch.linalg.eigh(B.double())
+        d = d.flip(0)[:ndim].clamp(min=0).to(X.dtype)
+        U = U.flip(1)[:, :ndim].to(X.dtype)
+        V = torch.mm(X, U)
+        # G V = Y U exactly, so the Ritz residuals cost no extra call
+        res = float(((torch.mm(Y, U) - V * d).norm(dim=0) /
+                     d.clamp(min=1e-30)).max())
+        if tol is None or res <= tol or n_iter >= max_iter:
+            break
+        # Y = G X is the next power iteration already
+        n_iter += 1
+    del(X, Y, B, U)
+    return d, V, res
+
+
+def randomized_embedding(load, items, ngene, ndim, weights=None,
+                         oversample=10, n_iter=4, tol=1e-2, torch_thread=4,
+                         device=None, inflight=2, seed=1, verbose=1,
+                         max_iter=None):
+    """
+    x = diag(d^{1/4}) V^T of the top ndim eigenpairs (d, V) of G, as
+    network_svd returns for the materialized G, see randomized_eigh
+    load: item -> ngene x ngene RWR matrix, e.g. partial(load_and_rwr, ...),
+    dense, sparse or row-wise, see sparse_gram_apply and blocked_gram_apply
+    tol: bound on max_j ||G v_j - d_j v_j|| / d_j; the power iterations go
+    on past n_iter, one pass over the networks each, until it holds, and
+    a ValueError is raised when it still does not after max_iter (default
+    4 n_iter); within it x matches network_svd up to rotation, see
+    embedding_alignment
+    """
+    s = time.time()
+    torch.set_num_threads(torch_thread)
+    if device is None:
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    elif type(device) == str:
+        device = torch.device(device)
+    if verbose == 1:
+        print('Learning vectors via randomized range finder...\n')
+    max_iter = 4 * n_iter if max_iter is None else max_iter
+    apply = partial(gram_apply, load, items, ngene, weights=weights,
+                    inflight=inflight)
+    d, V, res = randomized_eigh(apply, ngene, ndim, oversample, n_iter,
+                                device, seed, tol=tol, max_iter=max_iter)
+    if res > tol:
+        raise ValueError(f'randomized engine: max relative eigen residual '
+                         f'{res:.2e} above tol={tol} after {max_iter} power '
+                         f'iterations, raise n_iter or oversample')
+    x = torch.diag(d.sqrt().sqrt()).mm(V.T).cpu().numpy()
+    del(d, V)
+
+    if verbose == 1:
+        print(time.time()-s)
+        print(f'max relative eigen residual {res:.2e}')
+        print('Mashup features obtained.\n')
+    return x
+
+
+def embedding_alignment(x, x_ref):
+    """
+    relative residual of the best orthogonal map of x onto x_ref,
+    min_W ||W x - x_ref|| / ||x_ref||, zero when the embeddings agree up to
+    rotation (sign flips and mixing inside repeated eigenvalues included)
+    """
+    U, _, Vt = np.linalg.svd(x_ref.dot(x.T))
+    W = U.dot(Vt)
+    return np.linalg.norm(W.dot(x) - x_ref) / np.linalg.norm(x_ref)
@@ -0,0 +1,155 @@
+"""
+Mingxin Zhang
+Network ablation: embeddings (and optionally function prediction scores)
+for many network subsets in one run, from cached per-network Grams
+"""
+
+import argparse
+import json
+import os
+import random
+
+import numpy as np
+import torch
+
+import sys
+sys.path.append(os.path.join(sys.path[0], '../'))
+from config import GEMINI_DIR
+from gemini.ablation import ablation_embeddings, fill_gram_cache
+from gemini.func import out_network_files, textread
+from gemini.load_anno_vali import load_anno_and_cross_validation
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--org', type=str, default='yeast')
+    parser.add_argument('--net', type=str, default='GeneMANIA_ex')
+    parser.add_argument('--ndim', type=int, default=800)
+    parser.add_argument('--num_thread', type=int, default=4)
+    parser.add_argument('--torch_thread', type=int, default=5)
+    parser.add_argument('--mode', type=str, default='loo',
+                        help='loo: leave each network out, cluster: leave '
+                        'each cluster of main_gemini_cluster out, source: '
+                        'keep or drop the networks named like --sources, '
+                        'subsets: name -> kept networks from --subsets')
+    parser.add_argument('--sources', type=str, default='',
+                        help='comma separated substrings of network names')
+    parser.add_argument('--subsets', type=str, default='',
+                        help='json file, subset name -> kept network names')
+    parser.add_argument('--cluster_method', type=str, default='ap')
+    parser.add_argument('--level', type=str, default='network')
+    parser.add_argument('--embed_type', type=str, default='Qsm4')
+    parser.add_argument('--axis', type=int, default=1)
+    parser.add_argument('--gram_cache', type=str, default='float32',
+                        help='float32 or float16 per-network Grams')
+    parser.add_argument('--alpha', type=float, default=0.5)
+    parser.add_argument('--n_iter', type=int, default=4,
+                        help='power iterations from the full solution')
+    parser.add_argument('--eig_tol', type=float, default=1e-2)
+    parser.add_argument('--eval', type=int, default=0,
+                        help='1: run function prediction on every subset')
+    parser.add_argument('--best_epoch', type=int, default=None)
+    parser.add_argument('--ratio', type=float, default=0.2)
+    parser.add_argument('--device', type=str, default='')
+    parser.add_argument('--num-nets', type=int,
+                        help='Number of networks to use.')
+    return parser.parse_args()
+
+
+args = get_args()
+
+
+def network_name(network_file):
+    return os.path.basename(network_file).replace('_adjacency.txt', '')
+
+
+def read_auprc(experiment_name, best_epoch):
+    with open(GEMINI_DIR + f'data/results/{experiment_name}' +
+              f'_{best_epoch}_result.txt', 'r') as f:
+        for line in f:
+            if line.startswith('AUPRC'):
+                return float(line.split()[1])
+
+
+def make_subsets(network_files, org, net):
+    """
+    subset name -> indices of the networks it keeps, for args.mode
+    """
+    names = [network_name(network_file) for network_file in network_files]
+    everything = np.arange(len(names))
+    subsets = {}
+    if args.mode == 'loo':
+        for i, name in enumerate(names):
+            subsets[f'-{name}'] = np.delete(everything, i)
+    elif args.mode == 'cluster':
+        separate = np.load(
+            GEMINI_DIR + f'data/separate/{net}_{org}_type0_' +
+            f'{args.embed_type}{args.axis}_{args.cluster_method}_' +
+            f'{args.level}.npy')[:len(names)]
+        for label in np.unique(separate):
+            subsets[f'-cluster{label}'] = everything[separate != label]
+    elif args.mode == 'source':
+        for source in args.sources.split(','):
+            hit = np.array([source in name for name in names])
+            subsets[f'only_{source}'] = everything[hit]
+            subsets[f'-{source}'] = everything[~hit]
+    elif args.mode == 'subsets':
+        with open(args.subsets, 'r') as f:
+            spec = json.load(f)
+        pos = {name: i for i, name in enumerate(names)}
+        for subset, kept in spec.items():
+            subsets[subset] = [pos[network_name(n)] for n in kept]
+    else:
+        raise ValueError(f'unknown ablation mode {args.mode}')
+    return subsets
+
+
+def main():
+    torch.manual_seed(1)
+    random.seed(1)
+    np.random.seed(1)
+    org, net, ndim = args.org, args.net, args.ndim
+
+    network_files = out_network_files(net, org)[:args.num_nets]
+    gene_file = GEMINI_DIR + f'data/networks/{org}/{org}_{net}_genes.txt'
+    ngene = len(textread(gene_file))
+    device = None if args.device == '' else args.device
+    subsets = make_subsets(network_files, org, net)
+    print(f'{len(subsets)} subsets of {len(network_files)} networks')
+
+    keys = fill_gram_cache(network_files, ngene, args.num_thread,
+                           args.torch_thread, args.gram_cache, args.alpha)
+
+    if not os.path.exists(GEMINI_DIR + 'data/embed'):
+        os.mkdir(GEMINI_DIR + 'data/embed')
+    if not os.path.exists(GEMINI_DIR + 'data/results'):
+        os.mkdir(GEMINI_DIR + 'data/results')
+    prefix = f'ablation_{org}_{net}_{ndim}'
+    rows = []
+    for name, x, info in ablation_embeddings(
+            keys, ngene, ndim, subsets, n_iter=args.n_iter, tol=args.eig_tol,
+            torch_thread=args.num_thread*args.torch_thread):
+        print(name, info)
+        np.save(GEMINI_DIR + f'data/embed/{prefix}_{name}', x)
+        if args.eval == 1:
+            experiment_name = f'{prefix}_{name}'
+            load_anno_and_cross_validation('NN', org, net, experiment_name,
+                                           x, args.ratio, args.best_epoch,
+                                           device=device)
+            info['AUPRC'] = read_auprc(experiment_name, args.best_epoch)
+        rows.append((name, info))
+
+    columns = ['networks', 'touched', 'residual', 'solver', 'seconds']
+    if args.eval == 1:
+        columns.append('AUPRC')
+    table = GEMINI_DIR + f'data/results/{prefix}_{args.mode}.txt'
+    with open(table, 'w') as f:
+        f.write('\t'.join(['subset'] + columns) + '\n')
+        for name, info in rows:
+            f.write('\t'.join([name] + [str(info[c]) for c in columns]) +
+                    '\n')
+    print(table)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,7 +11,7 @@ import json
 
 import numpy as np
 import torch
-from func import out_string_nets, textread
+from func import out_network_files, textread
 from mashup import load_multi, mashup, mashup_multi
 import sys
 
@@ -40,8 +40,87 @@ def get_args():
     parser.add_argument('--npz_exist', type=int, default=1)
     parser.add_argument('--ori_seed', type=int, default=0)
     parser.add_argument('--rwr', type=str, default='rwr')
+    parser.add_argument('--engine', type=str, default='gram',
+                        help='gram: eigh of the materialized Gram matrix, '
+                        'randomized: randomized range finder without it')
+    parser.add_argument('--eig_solver', type=str, default='auto',
+                        help='eigh, eigsh, randomized or auto')
+    parser.add_argument('--eig_tol', type=float, default=None,
+                        help='eigensolver tolerance, max relative residual '
+                        'of randomized (default 1e-2); without it auto '
+                        'always uses the exact eigh')
+    parser.add_argument('--n_iter', type=int, default=4,
+                        help='power iterations of --engine randomized, up '
+                        'to 4 times as many until --eig_tol is met')
+    parser.add_argument('--oversample', type=int, default=10,
+                        help='extra columns of --engine randomized')
+    parser.add_argument('--rwr_solver', type=str, default='torch',
+                        help='torch or numpy: dense solve, '
+                        'sparse: iterative sparse solver, eig: one '
+                        'eigendecomposition per network, push: sparse '
+                        'approximate Q by local push (with --engine '
+                        'randomized nothing ngene x ngene is allocated)')
+    parser.add_argument('--rwr_tol', type=float, default=1e-6,
+                        help='tolerance of the sparse solver, '
+                        'series cut of the heat kernel')
+    parser.add_argument('--push_eps', type=float, default=1e-4,
+                        help='eps of rwr_solver push, entries of Q below it '
+                        'are dropped')
+    parser.add_argument('--kernel', type=str, default='rwr',
+                        help='rwr or heat: heat kernel exp(-t (I - A))')
+    parser.add_argument('--heat_t', type=float, default=1.0,
+                        help='diffusion time of the heat kernel')
+    parser.add_argument('--truncation', type=str, default=None,
+                        help='sparsified RWR cache, topk:k, mass:f or eps:v')
+    parser.add_argument('--alpha', type=float, default=0.5,
+                        help='RWR restart probability, rwr_solver eig '
+                        'factors each network once for all of them')
+    parser.add_argument('--batch_small', type=int, default=None,
+                        help='solve networks with at most this many covered '
+                        'nodes together in batched solves')
+    parser.add_argument('--gram_cache', type=str, default=None,
+                        help='float32 or float16: cache the log-Gram of '
+                        'every network so reweighting is only a re-sum')
+    parser.add_argument('--block', type=int, default=None,
+                        help='stream each RWR matrix in row blocks of this '
+                        'size instead of holding it whole')
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    check_args(parser, args)
+    return args
+
+
+def check_args(parser, args):
+    """
+    reject options that the branch main() dispatches to would ignore,
+    before they name the output: engine, gram_cache, block and batch_small
+    only exist in load_multi, the heat kernel is not applied to mixup pairs
+    or to the averaged adjacency, block only streams RWR rows of the gram
+    engine and batch_small only batches dense RWR solves of single networks
+    """
+    separate = args.weight == 0 and args.separate != '0'
+    load_multi = args.num_thread > 1 and not separate and args.mixup >= 0
+    if args.engine != 'gram' and not load_multi:
+        parser.error('--engine needs --num_thread > 1, --mixup >= 0 and '
+                     'no --separate')
+    if args.engine != 'gram' and args.eig_solver != 'auto':
+        parser.error('--eig_solver only applies to --engine gram')
+    if args.gram_cache is not None and not (load_multi and args.mixup == 0):
+        parser.error('--gram_cache needs --num_thread > 1, --mixup 0 and '
+                     'no --separate')
+    if args.kernel != 'rwr' and args.mixup != 0:
+        parser.error('--kernel heat needs --mixup 0')
+    if args.block is not None and (not load_multi or args.engine != 'gram'
+                                   or args.kernel != 'rwr'):
+        parser.error('--block needs --num_thread > 1, --mixup >= 0, no '
+                     '--separate, --engine gram and --kernel rwr')
+    if args.batch_small is not None and not (
+            load_multi and args.mixup == 0 and args.engine == 'gram' and
+            args.block is None and args.rwr_solver == 'torch' and
+            args.kernel == 'rwr'):
+        parser.error('--batch_small needs --num_thread > 1, --mixup 0, no '
+                     '--separate, --engine gram, no --block, --rwr_solver '
+                     'torch and --kernel rwr')
 
 
 args = get_args()
@@ -63,11 +142,7 @@ def main():
 
     ndim = args.ndim
 
-    string_nets = out_string_nets(net, org)
-
-    network_files = []
-    for i in range(len(string_nets)):
-        network_files.append(GEMINI_DIR + f'data/networks/{org}/{org}_string_{string_nets[i]}_adjacency.txt')
+    network_files = out_network_files(net, org)
 
     # Load gene list
     gene_file = GEMINI_DIR + f'data/networks/{org}/{org}_{net}_genes.txt'
@@ -165,6 +240,20 @@ def main():
     else:
         rwr = 'rwr'
 
+    if args.engine != 'gram':
+        embd_name += f'_{args.engine}'
+    if args.eig_solver != 'auto' or args.eig_tol is not None:
+        embd_name += f'_{args.eig_solver}{args.eig_tol or ""}'
+    if args.truncation is not None:
+        embd_name += f'_{args.truncation}'
+    if args.gram_cache == 'float16':
+        embd_name += '_gram16'
+    if args.kernel == 'heat':
+        embd_name += f'_heat{args.heat_t}'
+    if args.rwr_solver == 'push':
+        embd_name += f'_push{args.push_eps}'
+    if args.alpha != 0.5:
+        embd_name += f'_alpha{args.alpha}'
     print(embd_name)
     npz_exist = False if mixup == 'average' else True
     xs = []
@@ -174,7 +263,14 @@ def main():
             # num_thread == 1:
             if args.separate is None:
                 x = mashup(network_files, ngene, ndim,
-                           mixup, torch_thread, weights)
+                           mixup, torch_thread, weights,
+                           eig_solver=args.eig_solver,
+                           eig_tol=args.eig_tol,
+                           rwr_solver=args.rwr_solver,
+                           truncation=args.truncation,
+                           alpha=args.alpha, rwr_tol=args.rwr_tol,
+                           push_eps=args.push_eps,
+                           kernel=args.kernel, heat_t=args.heat_t)
             else:
                 xs = []
                 ndim = ndim//len(set(args.separate))
@@ -182,7 +278,14 @@ def main():
                     filt = args.separate == sep
                     curr_net = np.array(network_files)[filt]
                     x = mashup(curr_net, ngene, ndim,
-                               mixup, torch_thread, weights)
+                               mixup, torch_thread, weights,
+                               eig_solver=args.eig_solver,
+                               eig_tol=args.eig_tol,
+                               rwr_solver=args.rwr_solver,
+                               truncation=args.truncation,
+                               alpha=args.alpha, rwr_tol=args.rwr_tol,
+                               push_eps=args.push_eps,
+                               kernel=args.kernel, heat_t=args.heat_t)
                     xs.append(x)
         else:
             # multi thread
@@ -196,7 +299,22 @@ def main():
                                        mixup, num_thread, torch_thread,
                                        weights,
                                        node_weights=node_weights,
-                                       gamma=args.gamma)
+                                       gamma=args.gamma,
+                                       engine=args.engine,
+                                       eig_solver=args.eig_solver,
+                                       eig_tol=args.eig_tol,
+                                       rwr_solver=args.rwr_solver,
+                                       truncation=args.truncation,
+                                       block=args.block,
+                                       alpha=args.alpha,
+                                       batch_small=args.batch_small,
+                                       rwr_tol=args.rwr_tol,
+                                       push_eps=args.push_eps,
+                                       kernel=args.kernel,
+                                       heat_t=args.heat_t,
+                                       gram_cache=args.gram_cache,
+                                       n_iter=args.n_iter,
+                                       oversample=args.oversample)
                     else:
                         print('Using multiply time mixup to form embeding')
                         xs = []
@@ -206,14 +324,33 @@ def main():
                                                  torch_thread,
                                                  weights,
                                                  node_weights=node_weights,
-                                                 gamma=args.gamma))
+                                                 gamma=args.gamma,
+                                                 engine=args.engine,
+                                                 eig_solver=args.eig_solver,
+                                                 eig_tol=args.eig_tol,
+                                                 rwr_solver=args.rwr_solver,
+                                                 truncation=args.truncation,
+                                                 block=args.block,
+                                                 alpha=args.alpha,
+                                                 rwr_tol=args.rwr_tol,
+                                                 push_eps=args.push_eps,
+                                                 n_iter=args.n_iter,
+                                                 oversample=args.oversample))
 
                 else:
                     x = mashup_multi(network_files, ngene, ndim,
                                      mixup, num_thread, torch_thread,
                                      weights,
                                      node_weights=node_weights,
-                                     rwr=rwr)
+                                     rwr=rwr, eig_solver=args.eig_solver,
+                                     eig_tol=args.eig_tol,
+                                     rwr_solver=args.rwr_solver,
+                                     truncation=args.truncation,
+                                     alpha=args.alpha,
+                                     rwr_tol=args.rwr_tol,
+                                     push_eps=args.push_eps,
+                                     kernel=args.kernel,
+                                     heat_t=args.heat_t)
 
             else:
                 # weighted on nodes
@@ -224,7 +361,16 @@ def main():
                     curr_net = np.array(network_files)[filt]
                     x = mashup_multi(curr_net, ngene, ndim,
                                      mixup, num_thread, torch_thread,
-                                     weights, node_weights=node_weights)
+                                     weights, node_weights=node_weights,
+                                     eig_solver=args.eig_solver,
+                                     eig_tol=args.eig_tol,
+                                     rwr_solver=args.rwr_solver,
+                                     truncation=args.truncation,
+                                     alpha=args.alpha,
+                                     rwr_tol=args.rwr_tol,
+                                     push_eps=args.push_eps,
+                                     kernel=args.kernel,
+                                     heat_t=args.heat_t)
                     xs.append(x)
 
         if len(xs) > 0:
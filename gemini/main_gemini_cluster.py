@@ -17,8 +17,10 @@ import json
 import sys
 sys.path.append(os.path.join(sys.path[0], '../'))
 from config import GEMINI_DIR
-from gemini.func import out_moment_emb, out_string_nets, textread
-from gemini.mashup import mashup_multi
+from gemini.func import out_moment_emb, out_network_files, textread
+from gemini.net_store import network_nodes
+from gemini.mashup import largest_first, mashup_multi
+from gemini.shm_slots import imap_results
 
 
 def get_args():
@@ -35,6 +37,9 @@ def get_args():
     parser.add_argument('--level', type=str, default='network')
     parser.add_argument('--embed_type', type=str, default='Qsm4')
     parser.add_argument('--axis', type=int, default=1)
+    parser.add_argument('--block', type=int, default=None,
+                        help='stream each RWR matrix in row blocks of this '
+                        'size instead of holding it whole')
     return parser.parse_args()
 
 
@@ -57,15 +62,10 @@ def main():
 
     ndim = args.ndim
 
-    string_nets = out_string_nets(net, org)
-
     # Load gene list
     gene_file = GEMINI_DIR +  f'data/networks/{org}/{org}_{net}_genes.txt'
     genes = textread(gene_file)
-    network_files = []
-    for i in range(len(string_nets)):
-        network_files.append(
-            GEMINI_DIR +  f'data/networks/{org}/{org}_string_{string_nets[i]}_adjacency.txt')
+    network_files = out_network_files(net, org)
     ngene = len(genes)
 
     num_net = len(network_files)
@@ -94,29 +94,20 @@ def main():
 
         if args.level == 'network':
             data = network_files, average_type, ngene
-            f = partial(out_moment_emb, data)
+            f = partial(out_moment_emb, data, block=args.block)
             max_len = num_net
         elif args.level == 'node':
             data = network_files, average_type, ngene
             # f = partial(out_var_emb_node, data)
             max_len = ngene
 
-        max_idx = max_len//num_thread
-        max_idx = max_idx+1 if max_len % num_thread > 0 else max_idx
-        for i in tqdm(range(max_idx)):
-            start_idx = num_thread*(i)
-            end_idx = num_thread*(i+1)
-            end_idx = end_idx if end_idx <= max_len else max_len
-            idxs = np.arange(num_net)[start_idx:end_idx]
-            use_pool = True
-            if not use_pool:
-                embed_part = []
-                for idx in idxs:
-                    embed_part.append(f(idx))
-            else:
-                with Pool(processes=num_thread) as pl:
-                    embed_part = pl.map(f, idxs)
-            embeds.extend(embed_part)
+        # one pool for all networks, largest first
+        order = largest_first(network_files)
+        embeds = [None] * num_net
+        for idx, embed in tqdm(imap_results(f, list(range(num_net)),
+                                            num_thread, order=order),
+                               total=num_net):
+            embeds[idx] = embed
 
         i_ = -1
         for od in [1, 2, 3, 4]:
@@ -176,14 +167,7 @@ def main():
         from sklearn.metrics.pairwise import euclidean_distances
         net_seq = []
         for network_file in tqdm(np.array(network_files)):
-            seq1, seq2 = [], []
-            with open(network_file, 'r') as f:
-                for line in f.readlines():
-                    x, y, n = line.split()
-                    x, y, n = int(x), int(y), np.abs(float(n))
-                    seq1.append(x)
-                    seq2.append(y)
-            net_seq.append(set(seq1+seq1))
+            net_seq.append(set(network_nodes(network_file).tolist()))
         N_graphs = len(net_seq)
         kurt_dist = np.zeros((N_graphs, N_graphs))
         for g1 in tqdm(range(N_graphs)):
@@ -208,14 +192,7 @@ def main():
         from sklearn.metrics.pairwise import euclidean_distances
         net_seq = []
         for network_file in tqdm(np.array(network_files)):
-            seq1, seq2 = [], []
-            with open(network_file, 'r') as f:
-                for line in f.readlines():
-                    x, y, n = line.split()
-                    x, y, n = int(x), int(y), np.abs(float(n))
-                    seq1.append(x)
-                    seq2.append(y)
-            net_seq.append(set(seq1+seq1))
+            net_seq.append(set(network_nodes(network_file).tolist()))
         N_graphs = len(net_seq)
         kurt_dist = np.zeros((N_graphs, N_graphs))
         for g1 in tqdm(range(N_graphs)):
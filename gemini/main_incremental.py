@@ -0,0 +1,80 @@
+"""
+Mingxin Zhang
+Incremental Gemini embedding: update the saved collection state with the
+networks that were appended, removed or changed since the last run
+"""
+
+import argparse
+import os
+import random
+
+import numpy as np
+import torch
+
+import sys
+sys.path.append(os.path.join(sys.path[0], '../'))
+from config import GEMINI_DIR
+from gemini.func import out_network_files, textread
+from gemini.incremental import incremental_embedding
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--org', type=str, default='yeast')
+    parser.add_argument('--net', type=str, default='GeneMANIA_ex')
+    parser.add_argument('--ndim', type=int, default=800)
+    parser.add_argument('--num_thread', type=int, default=4)
+    parser.add_argument('--torch_thread', type=int, default=5)
+    parser.add_argument('--state', type=str, default=None,
+                        help='collection state directory, '
+                        'data/incremental/{org}_{net} by default')
+    parser.add_argument('--gram_cache', type=str, default=None,
+                        help='float32 or float16: cache per-network Grams, '
+                        'needed to remove or edit networks without a rebuild')
+    parser.add_argument('--alpha', type=float, default=0.5)
+    parser.add_argument('--n_iter', type=int, default=4,
+                        help='power iterations from the previous solution')
+    parser.add_argument('--eig_tol', type=float, default=1e-2)
+    parser.add_argument('--check', type=int, default=0,
+                        help='1: report the drift from a full eigensolver')
+    parser.add_argument('--num-nets', type=int,
+                        help='Number of networks to use.')
+    return parser.parse_args()
+
+
+args = get_args()
+
+
+def main():
+    torch.manual_seed(1)
+    random.seed(1)
+    np.random.seed(1)
+    org, net, ndim = args.org, args.net, args.ndim
+
+    network_files = out_network_files(net, org)[:args.num_nets]
+    gene_file = GEMINI_DIR + f'data/networks/{org}/{org}_{net}_genes.txt'
+    ngene = len(textread(gene_file))
+    state_dir = GEMINI_DIR + f'data/incremental/{org}_{net}' \
+        if args.state is None else args.state
+
+    x, info = incremental_embedding(
+        state_dir, network_files, ngene, ndim,
+        num_thread=args.num_thread, torch_thread=args.torch_thread,
+        gram_cache=args.gram_cache, alpha=args.alpha, n_iter=args.n_iter,
+        tol=args.eig_tol, check=args.check == 1)
+    print('_______________________________________________________________')
+    for k, v in info.items():
+        print(f'\t{k}: {v}')
+    print('_______________________________________________________________')
+
+    if not os.path.exists(GEMINI_DIR + 'data/embed'):
+        os.mkdir(GEMINI_DIR + 'data/embed')
+    embd_name = GEMINI_DIR + f'data/embed/incremental_{org}_{net}_{ndim}'
+    if args.alpha != 0.5:
+        embd_name += f'_alpha{args.alpha}'
+    np.save(embd_name, x)
+    print(embd_name)
+
+
+if __name__ == '__main__':
+    main()
@@ -16,12 +16,19 @@ import torch
 
 sys.path.append(os.path.join(sys.path[0], '../'))
 from gemini.cross_validation_nn import validation_nn_output
-from gemini.func import load_network
+from gemini.func import (get_heat, get_rwr, get_rwr_batched, gram_key,
+                         load_gram, load_network, network_ngene,
+                         rwr_row_blocks, solver_tol, store_gram)
+from gemini.gram import (GramAccumulator, prefetch, report_memory,
+                         restricted_gram)
+from gemini.net_store import network_size
 from joblib import Parallel, delayed
 from gemini.load_anno_vali import load_anno
-from gemini.rwr_func import rwr, rwr_torch
-from scipy.sparse import csr_matrix, load_npz, save_npz
-from scipy.sparse.linalg import eigsh, svds
+from gemini.lowrank import randomized_eigh, randomized_embedding
+from gemini.rwr_func import DENSE_SOLVERS, RestrictedRWR, rwr, rwr_torch
+from gemini.shm_slots import SharedSlots, imap_results
+from scipy.sparse import issparse
+from scipy.sparse.linalg import LinearOperator, eigsh, svds
 from sklearn.decomposition import PCA
 from tqdm import tqdm
 
@@ -30,90 +37,137 @@ torch.manual_seed(1)
 np.random.seed(1)
 
 
-def network_svd(ndim, torch_thread, RR_sum, verbose=1):
+EIG_SOLVERS = ['eigh', 'eigsh', 'randomized']
+
+
+def pick_eig_solver(ndim, ngene, tol=None):
+    """
+    solver for the top ndim eigenpairs of an ngene x ngene Gram matrix:
+    a full eigh unless a tol allows a truncated solver, then still eigh for
+    small matrices or when a large share of the spectrum is kept, Lanczos
+    for very few vectors and randomized subspace iteration in between
+    """
+    ratio = ndim / ngene
+    if tol is None or ngene <= 2000 or ratio > 0.2:
+        return 'eigh'
+    elif ratio < 0.01:
+        return 'eigsh'
+    return 'randomized'
+
+
+def top_eigh(G, ndim, solver='eigh', tol=None, seed=1, n_iter=4,
+             max_iter=16):
+    """
+    top ndim eigenpairs (d descending, V) of a symmetric torch matrix G
+    tol: convergence tolerance of eigsh; bound on the relative eigen
+    residual of randomized (default 1e-2), which runs n_iter power
+    iterations and more up to max_iter, and raises when tol is missed
+    """
+    ngene = G.shape[0]
+    if solver == 'eigh':
+        try:
+            d, V = torch.linalg.eigh(G)
+            V = V.numpy()[:, ::-1][:, :ndim]
+            d = d.numpy()[::-1][:ndim]
+            return d, V
+        except Exception:
+            solver = 'eigsh'
+    if solver == 'eigsh':
+        # matvecs through torch so torch_thread applies
+        op = LinearOperator(
+            G.shape, dtype=np.float32,
+            matvec=lambda v: G.mv(torch.from_numpy(
+                np.asarray(v, dtype='float32').ravel())).numpy(),
+            matmat=lambda X: G.mm(torch.from_numpy(
+                np.ascontiguousarray(X, dtype='float32'))).numpy())
+        d, V = eigsh(op, k=ndim, which='LA',
+                     tol=0 if tol is None else tol,
+                     v0=np.random.RandomState(seed).rand(ngene))
+    elif solver == 'randomized':
+        tol = 1e-2 if tol is None else tol
+        d, V, res = randomized_eigh(G.mm, ngene, ndim, ndim, n_iter,
+                                    seed=seed, tol=tol, max_iter=max_iter)
+        if res > tol:
+            raise ValueError(f'randomized eigen solver: max relative eigen '
+                             f'residual {res:.2e} above tol={tol} after '
+                             f'{max_iter} power iterations, use eigh')
+        d, V = d.numpy(), V.numpy()
+    else:
+        raise ValueError(f'unknown eigen solver {solver}, '
+                         f'use one of {EIG_SOLVERS} or auto')
+    order = np.argsort(-d, kind='stable')
+    return d[order], V[:, order]
+
+
+def eig_residual(G, d, V):
+    """
+    max_j ||G v_j - d_j v_j|| / |d_j|
+    """
+    V = torch.from_numpy(np.ascontiguousarray(V, dtype='float32'))
+    d = torch.from_numpy(np.ascontiguousarray(d, dtype='float32'))
+    res = (G.mm(V) - V * d).norm(dim=0) / d.abs().clamp(min=1e-30)
+    return float(res.max())
+
+
+def network_svd(ndim, torch_thread, RR_sum, verbose=1, solver='auto',
+                tol=None):
+    """
+    x = diag(d^{1/4}) V^T of the top ndim eigenpairs of RR_sum
+    solver: 'eigh', 'eigsh' (Lanczos), 'randomized' or 'auto', see
+    pick_eig_solver; tol: convergence tolerance of eigsh, residual bound
+    of randomized, see top_eigh; 'auto' stays with eigh without a tol
+    """
     s = time.time()
     torch.set_num_threads(torch_thread)
     if verbose == 1:
         print('All networks loaded. Learning vectors via SVD...\n')
     torch.manual_seed(1)
-    try:
-        d, V = torch.linalg.eigh(torch.Tensor(RR_sum))
-        del(RR_sum)
-        V = V.numpy()[:, ::-1][:, :ndim]
-        d = d.numpy()[::-1][:ndim]
-        x = np.diag(np.sqrt(np.sqrt(d))).dot(V.T)
-        del(d, V)
-    except:
-        d, V = eigsh(RR_sum, k=ndim)
-        del(RR_sum)
-        V = V[:, ::-1]
-        d = d[::-1]
-        x = np.diag(np.sqrt(np.sqrt(d))).dot(np.transpose(V))
+    G = torch.from_numpy(np.asarray(RR_sum, dtype='float32'))
+    ngene = G.shape[0]
+    if solver == 'auto':
+        solver = pick_eig_solver(ndim, ngene, tol)
+    d, V = top_eigh(G, ndim, solver, tol)
+    x = np.diag(np.sqrt(np.sqrt(d))).dot(V.T)
 
     if verbose == 1:
         print(time.time()-s)
+        print(f'{solver}: {ndim} of {ngene} eigenpairs, '
+              f'max relative residual {eig_residual(G, d, V):.2e}')
         print('Mashup features obtained.\n')
+    del(G, d, V)
     return x
 
 
-def load_and_rwr(ngene, torch_thread, network_file, alpha=0.5):
+def load_and_rwr(ngene, torch_thread, network_file, alpha=0.5,
+                 solver='torch', dtype='float32', truncation=None, tol=1e-6,
+                 dense=True, kernel='rwr', t=1.0, gram=False):
+    """
+    RWR matrix of network_file through the RWR cache, see func.get_rwr
+    dense: False keeps the sparse Q of solver='push' or of a truncated
+    cache as a csr_matrix, and a restricted or low-rank entry as its
+    RestrictedRWR / FactoredRWR, for the randomized engine
+    kernel: 'heat' diffuses for time t instead, see func.get_heat, with tol
+    as its accuracy target
+    gram: with dense False, reduce a restricted Q to its RestrictedGram
+    here, so a pool worker returns O(|S|^2) numbers, see restricted_gram
+    """
     s = time.time()
-    use_torch = True
     torch.set_num_threads(torch_thread)
     torch.manual_seed(1)
     np.random.seed(1)
     # random.seed(1)
-    sparse_network_file = network_file.replace('txt', 'npz')
-    dense_network_file = network_file.replace('txt', 'npy')
-    # print('init', time.time()-s)
-    if os.path.exists(sparse_network_file) or \
-            os.path.exists(dense_network_file):
-        # print(time.time()-s)
-        if os.path.exists(dense_network_file):
-            # print('load', dense_network_file)
-            # Q = np.load(dense_network_file, mmap_mode='r')
-            Q = np.load(dense_network_file)
-            # print('loaded', dense_network_file)
-        else:
-            # print('load', sparse_network_file)
-            Q_sparse = load_npz(sparse_network_file)
-            if Q_sparse.dtype == 'float64':
-                Q_sparse = Q_sparse.astype('float32')
-                save_npz(sparse_network_file, Q_sparse)
-            # print(time.time()-s)
-            Q = Q_sparse.todense()
-        # print('load Q', time.time()-s)
-        # del(Q_sparse)
-        # device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        # print('devise', time.time()-s)
-        # Q = torch.from_numpy(Q).to(device)
-        # print('to gpu', time.time()-s)
-
+    if kernel == 'heat':
+        Q = get_heat(network_file, ngene, t, dtype, tol, dense, truncation)
     else:
-        print(sparse_network_file)
-        A = load_network(network_file, ngene)
-        if A.dtype == 'float64':
-            A = A.astype('float32')
-        print('load A', time.time()-s)
-        if use_torch:
-            Q = rwr_torch(A, alpha)
-        else:
-            Q = rwr(A, alpha)
-        print('rwr Q', time.time()-s)
-
-        if Q.dtype == 'float64':
-            Q = Q.astype('float32')
-
-        Q_sparse = csr_matrix(Q)
-        save_npz(sparse_network_file, Q_sparse)
-        del(Q_sparse)
-        del(A)
-        # device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        # print('devise', time.time()-s)
-        # Q = torch.from_numpy(Q).to(device)
-        # print('to gpu', time.time()-s)
+        Q = get_rwr(network_file, ngene, alpha, solver, dtype, tol=tol,
+                    dense=dense, truncation=truncation)
+    # print('load Q', time.time()-s)
 
     # print(2)
+    if isinstance(Q, RestrictedRWR) and gram:
+        return restricted_gram(Q, ngene)
+    if issparse(Q) or isinstance(Q, RestrictedRWR):
+        return Q
     Q = np.array(Q)
 
     # R = Q
@@ -134,7 +188,7 @@ def load_and_rwr(ngene, torch_thread, network_file, alpha=0.5):
     return Q
 
 
-def load_and_mixup_rwr(ngene, torch_thread, gamma, network_file):
+def load_and_mixup_rwr(ngene, torch_thread, gamma, network_file, alpha=0.5):
     # s = time.time()
     # torch.set_num_threads(torch_thread)
     # torch.manual_seed(1)
@@ -153,8 +207,8 @@ def load_and_mixup_rwr(ngene, torch_thread, gamma, network_file):
     # s2 = n2.replace('txt', 'npz')
     # Q1 = load_npz(s1)
     # Q2 = load_npz(s2)
-    Q1 = load_and_rwr(ngene, torch_thread, n1)
-    Q2 = load_and_rwr(ngene, torch_thread, n2)
+    Q1 = load_and_rwr(ngene, torch_thread, n1, alpha)
+    Q2 = load_and_rwr(ngene, torch_thread, n2, alpha)
     Q = (gamma*Q1 + (1-gamma)*Q2)
     if type(Q) != np.ndarray:
         Q = Q.todense()
@@ -182,43 +236,82 @@ def load_and_mixup_rwr(ngene, torch_thread, gamma, network_file):
     return Q
 
 
-def rwr_load(network_file):
-    sparse_network_file = network_file.replace('txt', 'npz')
-    # print(time.time()-s)
-    Q_sparse = load_npz(sparse_network_file)
-    # print(time.time()-s)
-    Q = Q_sparse.todense()
-    # print('load Q', time.time()-s)
+def mixup_rwr_blocks(ngene, gamma, network_file, block=1024,
+                     solver='torch', alpha=0.5):
+    """
+    row blocks (start, end, gamma Q1 + (1 - gamma) Q2) of a mixup pair,
+    the blend of load_and_mixup_rwr without either full Q, see
+    func.rwr_row_blocks
+    """
+    n1, w1, n2, w2 = network_file
+    blocks2 = rwr_row_blocks(n2, ngene, alpha, solver=solver, block=block)
+    for (start, end, Q1), (_, _, Q2) in zip(
+            rwr_row_blocks(n1, ngene, alpha, solver=solver, block=block),
+            blocks2):
+        Q1 *= gamma
+        Q1 += (1 - gamma) * Q2
+        yield start, end, Q1
+        del(Q1, Q2)
+
+
+def rwr_load(network_file, ngene=None):
+    """
+    ngene: read from the store, or from the legacy Q next to the network
+    file when omitted, see func.network_ngene
+    """
+    if ngene is None:
+        ngene = network_ngene(network_file)
+    Q = get_rwr(network_file, ngene)
     return Q
 
 
+def largest_first(network_files):
+    """
+    order of network_files (or mixup pairs) by decreasing size, so the
+    slowest networks start first and the pool never waits on a straggler
+    """
+    sizes = []
+    for item in network_files:
+        if isinstance(item, str):
+            sizes.append(network_size(item))
+        else:
+            sizes.append(network_size(item[0]) + network_size(item[2]))
+    return np.argsort(-np.array(sizes), kind='stable')
+
+
 def load_adj(ngene, network_file):
-    A = load_network(network_file, ngene)
-    A = np.array(A)
+    """
+    sparse row normalized adjacency, see add_adj
+    """
+    A = load_network(network_file, ngene, sparse=True)
     return A
 
 
-def load_and_rwr_weight(ngene, torch_thread, node_weights, network_file):
-    use_torch = True
+def add_adj(RR_sum, A):
+    """
+    add a dense or sparse adjacency into the torch accumulator in place
+    """
+    if issparse(A):
+        A = A.tocoo()
+        idx = (torch.from_numpy(A.row.astype(np.int64)).to(RR_sum.device),
+               torch.from_numpy(A.col.astype(np.int64)).to(RR_sum.device))
+        RR_sum.index_put_(
+            idx, torch.from_numpy(A.data.astype('float32')).to(RR_sum.device),
+            accumulate=True)
+    else:
+        RR_sum += torch.from_numpy(np.asarray(A, dtype='float32')).to(
+            RR_sum.device)
+    return RR_sum
+
+
+def load_and_rwr_weight(ngene, torch_thread, node_weights, network_file,
+                        alpha=0.5):
     torch.set_num_threads(torch_thread)
     torch.manual_seed(1)
     np.random.seed(1)
     random.seed(1)
 
-    sparse_network_file = network_file.replace('txt', 'npz')
-    if not os.path.exists(sparse_network_file):
-        A = load_network(network_file, ngene)
-        if use_torch:
-            Q = rwr_torch(A, 0.5)
-        else:
-            Q = rwr(A, 0.5)
-        Q_sparse = csr_matrix(Q)
-        save_npz(sparse_network_file, Q_sparse)
-        del(A)
-    else:
-        Q_sparse = load_npz(sparse_network_file)
-        Q = Q_sparse.todense()
-    del(Q_sparse)
+    Q = get_rwr(network_file, ngene, alpha)
 
     R = np.log(Q + 1 / ngene)
     R *= node_weights
@@ -230,8 +323,12 @@ def load_and_rwr_weight(ngene, torch_thread, node_weights, network_file):
 
 
 def mashup(network_files=None, ngene=None, ndim=None, mixup=None,
-           torch_thread=12, weights=None, separate=None, device=None):
+           torch_thread=12, weights=None, separate=None, device=None,
+           inflight=None, eig_solver='auto', eig_tol=None,
+           rwr_solver='torch', truncation=None, alpha=0.5, rwr_tol=1e-6,
+           kernel='rwr', heat_t=1.0, push_eps=1e-4):
     s = time.time()
+    rwr_tol = solver_tol(rwr_solver, rwr_tol, push_eps)
     torch.manual_seed(1)
     torch.set_num_threads(torch_thread)
     random.seed(1)
@@ -248,38 +345,38 @@ def mashup(network_files=None, ngene=None, ndim=None, mixup=None,
     elif type(device) == str:
         device = torch.device(device)
 
-    if device == torch.device('cuda'):
-        RR_sum = torch.cuda.FloatTensor(ngene, ngene).fill_(0)
-    elif device == torch.device('cpu'):
-        RR_sum = torch.FloatTensor(ngene, ngene).fill_(0)
-#     elif device == torch.device('mps'):
-#         RR_sum = torch.FloatTensor(ngene, ngene).fill_(0).to(device)
     i = 0
     # print('devise', time.time()-s)
     # Q = torch.from_numpy(Q).to(device)
     weights = np.ones(len(network_files)) if weights is None else weights
+    inflight = 2 if inflight is None else inflight
+    f = partial(load_and_rwr, ngene, torch_thread, alpha=alpha,
+                solver=rwr_solver, truncation=truncation, tol=rwr_tol,
+                kernel=kernel, t=heat_t)
 
     if separate is None:
-        for network_file in tqdm(network_files):
-            R = load_and_rwr(ngene, torch_thread, network_file)
-            if weights is None:
-                RR_sum += R
-            else:
-                RR_sum = RR_sum + R * weights[i]
+        # the next network is read from the cache while this one is added
+        acc = GramAccumulator(ngene, device, transform=None)
+        for R in tqdm(prefetch(f, network_files, inflight),
+                      total=len(network_files)):
+            acc.add(R, weights[i])
             i += 1
-        del(R)
+            del(R)
         print(time.time()-s)
+        report_memory(ngene, inflight)
         print()
-        RR_sum = RR_sum.cpu().numpy()
-        x = network_svd(ndim, torch_thread, RR_sum)
+        RR_sum = acc.numpy()
+        del(acc)
+        x = network_svd(ndim, torch_thread, RR_sum, solver=eig_solver,
+                        tol=eig_tol)
     else:
         xs = []
         num_nets = len(network_files)
-        for network_file in tqdm(network_files):
-            R = load_and_rwr(ngene, torch_thread, network_file)
+        for R in tqdm(prefetch(f, network_files, inflight),
+                      total=len(network_files)):
             xs.append(network_svd(ndim//num_nets, torch_thread, R))
             i += 1
-        del(R)
+            del(R)
         print(time.time()-s)
         print()
         x = np.concatenate(xs, axis=0)
@@ -329,7 +426,16 @@ def mashup_vali(org, net, network_files, ngene=None,
 def mashup_multi(network_files=None, ngene=None, ndim=None,
                  mixup=None, num_thread=5, torch_thread=4,
                  weights=None, separate=None, node_weights=None,
-                 rwr='rwr', device=None):
+                 rwr='rwr', device=None, inflight=None, eig_solver='auto',
+                 eig_tol=None, rwr_solver='torch', truncation=None,
+                 alpha=0.5, rwr_tol=1e-6, kernel='rwr', heat_t=1.0,
+                 push_eps=1e-4):
+    """
+    kernel: 'heat' diffuses every network for heat_t, see load_and_rwr;
+    the average path always runs the RWR of the averaged adjacency
+    push_eps: eps of rwr_solver 'push', see func.solver_tol
+    """
+    rwr_tol = solver_tol(rwr_solver, rwr_tol, push_eps)
     weights_ = np.ones(len(network_files)) if weights is None else weights
     if device is None:
 #         if torch.backends.mps.is_available():
@@ -341,73 +447,68 @@ def mashup_multi(network_files=None, ngene=None, ndim=None,
     elif type(device) == str:
         device = torch.device(device)
 
-    if device == torch.device('cuda'):
-        RR_sum = torch.cuda.FloatTensor(ngene, ngene).fill_(0)
-    elif device == torch.device('cpu'):
-        RR_sum = torch.FloatTensor(ngene, ngene).fill_(0)
-    elif device == torch.device('mps'):
-        RR_sum = torch.FloatTensor(ngene, ngene).fill_(0).to(device)
+    inflight = num_thread if inflight is None else inflight
+    acc = GramAccumulator(ngene, device, transform=None)
+    RR_sum = acc.result()
 
     max_len = len(network_files)
-    max_idx = max_len//num_thread
-    max_idx = max_idx+1 if max_len % num_thread > 0 else max_idx
     xs = []
     num_nets = len(network_files)
     f2 = partial(network_svd, ndim//num_nets, torch_thread)
-    for i in tqdm(range(max_idx)):
-        start_idx = num_thread*(i)
-        end_idx = num_thread*(i+1)
-        end_idx = end_idx if end_idx <= max_len else max_len
-        current_networks = network_files[start_idx:end_idx]
-        current_weights = weights_[start_idx:end_idx]
-
-        if node_weights is not None:
-            # print('node_weight')
-            f = partial(load_and_rwr_weight, ngene, torch_thread, node_weights)
-        elif mixup == 'mixup':
-            # print('mixup')
-            f = partial(load_and_mixup_rwr, ngene, torch_thread)
-            weights = None
-        elif mixup == 'average':
-            # print('average')
-            f = partial(load_adj, ngene)
-            weights = None
-        else:
-            # print('network_weight')
-            f = partial(load_and_rwr, ngene, torch_thread)
 
-        use_pool = True
-        if use_pool:
-            with Pool(processes=num_thread) as pl:
-                RR_sums = pl.map(f, current_networks)
-        else:
-            RR_sums = Parallel(n_jobs=num_thread, prefer="threads")(
-                delayed(f)(current_network) for current_network in
-                current_networks)
-
-        if weights is not None:
-            RR_sums = [RR_sums[idx]*current_weights[idx]
-                       for idx in range(len(RR_sums))]
-        # print(len(RR_sums))
-        if separate is None:
-            if mixup == 'average':
-                for idx, Q in enumerate(RR_sums):
-                    Q = torch.from_numpy(Q).to(device)
-                    RR_sum += Q
-            else:
-                for idx, Q in enumerate(RR_sums):
-                    RR_sums[idx] = torch.from_numpy(Q).to(device)
-                RR_sum += torch.stack(RR_sums, dim=0).sum(dim=0)
+    if node_weights is not None:
+        # print('node_weight')
+        f = partial(load_and_rwr_weight, ngene, torch_thread, node_weights,
+                    alpha=alpha)
+    elif mixup == 'mixup':
+        # print('mixup')
+        f = partial(load_and_mixup_rwr, ngene, torch_thread, alpha=alpha)
+        weights = None
+    elif mixup == 'average':
+        # print('average')
+        f = partial(load_adj, ngene)
+        weights = None
+    else:
+        # print('network_weight')
+        # a restricted Q comes back as its covered block, see add_restricted
+        f = partial(load_and_rwr, ngene, torch_thread, alpha=alpha,
+                    solver=rwr_solver, truncation=truncation, tol=rwr_tol,
+                    kernel=kernel, t=heat_t, dense=separate is not None)
+
+    # one pool for all networks, largest first; dense results come back
+    # through shared memory, the sparse adjacencies of the average path are
+    # small enough for the pipe; the parent holds RR_sum plus at most
+    # inflight dense matrices
+    slots = SharedSlots(inflight, (ngene, ngene)) \
+        if mixup != 'average' else None
+    order = largest_first(network_files)
+    RR_sums = []
+    for idx, Q in tqdm(imap_results(f, network_files, num_thread,
+                                    slots, order), total=max_len):
+        w = 1 if weights is None else float(weights_[idx])
+        if separate is not None:
+            RR_sums.append(np.array(Q) * w)
+        elif mixup == 'average':
+            add_adj(RR_sum, Q)
         else:
-            with Pool(processes=num_thread) as pl:
-                xs = pl.map(f2, RR_sums)
-        del(RR_sums)
+            acc.add(Q, w)
+        del(Q)
+    if slots is not None:
+        slots.close()
+        report_memory(ngene, inflight)
+    # adds the deferred identity of restricted networks
+    RR_sum = acc.result()
+    del(acc)
+    if separate is not None:
+        with Pool(processes=num_thread) as pl:
+            xs = pl.map(f2, RR_sums)
+    del(RR_sums)
 
     if mixup == 'average':
         A = RR_sum/max_len
         A = A.cpu().numpy()
         if rwr == 'rwr':
-            Q = rwr_torch(A, 0.5)
+            Q = rwr_torch(A, alpha)
             Q = torch.from_numpy(Q).to(device)
             R = torch.log(Q + 1 / ngene)
         else:
@@ -428,7 +529,8 @@ def mashup_multi(network_files=None, ngene=None, ndim=None,
     if separate is None:
         RR_sum = RR_sum.cpu().numpy()
         if rwr == 'rwr' or 'svd' in rwr:
-            x = network_svd(ndim, num_thread*torch_thread, RR_sum)
+            x = network_svd(ndim, num_thread*torch_thread, RR_sum,
+                            solver=eig_solver, tol=eig_tol)
         elif 'pca' in rwr:
             pca = PCA(n_components=ndim)
             x = pca.fit_transform(RR_sum).T
@@ -441,7 +543,22 @@ def mashup_multi(network_files=None, ngene=None, ndim=None,
 def load_multi(network_files=None, ngene=None, ndim=None,
                mixup=None, num_thread=5, torch_thread=4,
                weights=None, separate=None, node_weights=None, gamma=None,
-                device=None):
+                device=None, inflight=None, engine='gram',
+               eig_solver='auto', eig_tol=None, rwr_solver='torch',
+               truncation=None, block=None, alpha=0.5, batch_small=None,
+               rwr_tol=1e-6, kernel='rwr', heat_t=1.0, gram_cache=None,
+               push_eps=1e-4, n_iter=4, oversample=10):
+    """
+    gram_cache: 'float32' or 'float16' caches the log-Gram of every network
+    as a packed triangle and reads it back on later runs, so new weights
+    only cost a weighted re-sum, see func.gram_key
+    push_eps: eps of rwr_solver 'push', rwr_tol is the tolerance of the
+    other solvers, see func.solver_tol
+    n_iter, oversample: power iterations and extra columns of engine
+    'randomized', which raises when its residual stays above eig_tol
+    (default 1e-2), see lowrank.randomized_embedding
+    """
+    rwr_tol = solver_tol(rwr_solver, rwr_tol, push_eps)
     if device is None:
 #         if torch.backends.mps.is_available():
 #             device = torch.device('mps')
@@ -459,81 +576,87 @@ def load_multi(network_files=None, ngene=None, ndim=None,
     np.random.seed(1)
     random.seed(1)
     weights_ = np.ones(len(network_files)) if weights is None else weights
-    if device == torch.device('cuda'):
-        RR_sum = torch.cuda.FloatTensor(ngene, ngene).fill_(0)
-    elif device == torch.device('cpu'):
-        RR_sum = torch.FloatTensor(ngene, ngene).fill_(0)
-    elif device == torch.device('mps'):
-        RR_sum = torch.FloatTensor(ngene, ngene).fill_(0).to(device)
+    inflight = num_thread if inflight is None else inflight
 
     max_len = len(network_files)
-    max_idx = max_len//num_thread
-    max_idx = max_idx+1 if max_len % num_thread > 0 else max_idx
     xs = []
     num_nets = len(network_files)
     f2 = partial(network_svd, ndim//num_nets, torch_thread)
-    for i in tqdm(range(max_idx)):
-        start_idx = num_thread*(i)
-        end_idx = num_thread*(i+1)
-        end_idx = end_idx if end_idx <= max_len else max_len
-        current_networks = network_files[start_idx:end_idx]
-
-        if node_weights is not None:
-            # print('node_weight')
-            current_weights = weights_[start_idx:end_idx]
-            f = partial(load_and_rwr_weight, ngene, torch_thread, node_weights)
-        elif mixup == 'mixup':
-            f = partial(load_and_mixup_rwr, ngene, torch_thread, gamma)
-            weights = None
-        else:
-            # print('network_weight')
-            current_weights = weights_[start_idx:end_idx]
-            f = partial(load_and_rwr, ngene, torch_thread)
-
-        use_pool = 'p1'
-        if use_pool == 'p1':
-            with Pool(processes=num_thread) as pl:
-                Qs = pl.map(f, current_networks)
-        elif use_pool == 'p2':
-            Qs = Parallel(n_jobs=num_thread, prefer="threads")(
-                delayed(f)(current_network) for current_network in
-                current_networks)
-        elif use_pool == 's':
-            Qs = []
-            for current_network in current_networks:
-                Qs.append(f(current_network))
-
-        # print('devise', time.time()-s)
-        RR_sums = []
-        # s = time.time()
-        for idx, Qcpu in enumerate(Qs):
-            if Qcpu.dtype == 'float64':
-                Qcpu = Qcpu.astype('float32')
-            # del(Q_sparse)
-            Q = torch.from_numpy(Qcpu).to(device)
-            # print(time.time() - s)
-            if mixup == 'average':
-                R = Q
-            else:
-                R = torch.log(Q + 1 / ngene)
-                R = torch.mm(R.T, R)
-            # print(time.time() - s)
-            if weights is not None:
-                RR_sum = R * current_weights[idx]
+
+    if node_weights is not None:
+        # print('node_weight')
+        f = partial(load_and_rwr_weight, ngene, torch_thread, node_weights,
+                    alpha=alpha)
+    elif mixup == 'mixup':
+        f = partial(load_and_mixup_rwr, ngene, torch_thread, gamma,
+                    alpha=alpha)
+        weights = None
+    else:
+        # print('network_weight')
+        f = partial(load_and_rwr, ngene, torch_thread, alpha=alpha,
+                    solver=rwr_solver, truncation=truncation, tol=rwr_tol,
+                    kernel=kernel, t=heat_t)
+
+    if engine == 'randomized' and separate is None and \
+            node_weights is None and mixup != 'average':
+        # RR_sum is never formed, G is applied to thin blocks network by
+        # network in this process; a sparse Q (push solver or truncated
+        # cache) stays sparse, so no ngene x ngene matrix is ever allocated
+        if mixup is None:
+            f = partial(f, dense=False)
+        return randomized_embedding(
+            f, network_files, ngene, ndim,
+            None if weights is None else weights_, oversample, n_iter,
+            1e-2 if eig_tol is None else eig_tol,
+            torch_thread=num_thread*torch_thread, device=device,
+            inflight=min(inflight, 2))
+
+    acc = GramAccumulator(ngene, device,
+                          transform=None if mixup == 'average' else 'log')
+    RR_sums = []
+    if block is not None and node_weights is None and \
+            mixup != 'average' and kernel == 'rwr':
+        # G = sum_i w_i R_i^T R_i is also a sum over the rows of every R_i,
+        # so each Q is streamed in row blocks straight into RR_sum and no
+        # ngene x ngene Q is ever resident
+        torch.set_num_threads(num_thread*torch_thread)
+        for idx, item in enumerate(tqdm(network_files)):
+            if mixup == 'mixup':
+                blocks = mixup_rwr_blocks(ngene, gamma, item, block,
+                                          rwr_solver, alpha)
             else:
-                RR_sum += R
-            # print(time.time() - s)
-        del(Qs)
-        if separate is None:
-            pass
-        else:
-            with Pool(processes=num_thread) as pl:
-                xs = pl.map(f2, RR_sums)
-        del(RR_sums)
+                blocks = rwr_row_blocks(item, ngene, alpha, rwr_solver,
+                                        block=block, tol=rwr_tol,
+                                        truncation=truncation)
+            w = 1 if weights is None else weights_[idx]
+            for _, _, Qb in blocks:
+                acc.add(Qb, w)
+                del(Qb)
+        report_memory(ngene, 0)
+    else:
+        restricted = node_weights is None and mixup is None
+        if restricted:
+            # a restricted Q is reduced to the Gram of its covered block in
+            # the worker and added in O(|S|^2), see add_restricted
+            f = partial(f, dense=False, gram=True)
+        add_networks(acc, f, network_files, range(max_len),
+                     np.ones(max_len) if weights is None else weights_,
+                     ngene, num_thread,
+                     gram_cache if restricted else None, alpha, rwr_solver,
+                     rwr_tol, truncation, kernel, heat_t,
+                     batch_small=batch_small if restricted else None,
+                     inflight=None if restricted else inflight)
+        report_memory(ngene, 0 if restricted else inflight)
+    RR_sum = acc.result()
+    del(acc)
+    if separate is not None:
+        with Pool(processes=num_thread) as pl:
+            xs = pl.map(f2, RR_sums)
+    del(RR_sums)
     if mixup == 'average':
         A = RR_sum/max_len
         A = A.cpu().numpy()
-        Q = rwr_torch(A, 0.5)
+        Q = rwr_torch(A, alpha)
         Q = torch.from_numpy(Q).to(device)
         R = torch.log(Q + 1 / ngene)
         RR_sum = torch.mm(R.T, R)
@@ -542,9 +665,133 @@ def load_multi(network_files=None, ngene=None, ndim=None,
     RR_sum = RR_sum.cpu().numpy()
     print(time.time()-s)
     if separate is None:
-        x = network_svd(ndim, num_thread*torch_thread, RR_sum)
+        x = network_svd(ndim, num_thread*torch_thread, RR_sum,
+                        solver=eig_solver, tol=eig_tol)
         del(RR_sum)
     else:
         x = np.concatenate(xs, axis=0)
         del(xs)
     return x
+
+
+def add_networks(acc, f, network_files, idxs, weights, ngene, num_thread=5,
+                 gram_cache=None, alpha=0.5, rwr_solver='torch',
+                 rwr_tol=1e-6, truncation=None, kernel='rwr', heat_t=1.0,
+                 batch_small=None, inflight=None):
+    """
+    add weights[idx] G_idx of network_files[idx] for idxs into acc, Q from
+    f on one pool, largest first, as soon as each worker finishes
+    gram_cache: read the cached log-Grams instead and cache the missing
+    ones on the way; G is linear in them, so new weights only cost a
+    re-sum, see func.gram_key; with acc None the missing ones are only
+    cached
+    batch_small: with rwr_solver 'torch' and kernel 'rwr', solve the
+    networks with at most batch_small covered nodes here in batches, see
+    func.get_rwr_batched, the larger ones are left to the pool
+    inflight: f returns dense matrices, moved through that many shared
+    slots, so the parent holds RR_sum plus at most inflight of them; by
+    default f is load_and_rwr with dense=False and gram=True, whose
+    RestrictedGrams and sparse Qs come back through the pipe
+    """
+    todo = list(idxs)
+    grams = {}
+    if gram_cache is not None:
+        grams = {idx: gram_key(network_files[idx], ngene, gram_cache, alpha,
+                               rwr_solver, rwr_tol, truncation, kernel,
+                               heat_t) for idx in todo}
+        todo = []
+        for idx in tqdm(grams):
+            cached = load_gram(grams[idx][0])
+            if cached is None:
+                todo.append(idx)
+                continue
+            if acc is not None:
+                acc.add_packed(cached[0], weights[idx], cached[1])
+            del(cached)
+
+    def add(idx, Q):
+        # the weight is the alpha of the rank-k update into RR_sum
+        if idx in grams:
+            key, params = grams[idx]
+            packed, scale = store_gram(key, Q, ngene, network_files[idx],
+                                       params, gram_cache)
+            if acc is not None:
+                acc.add_packed(packed, weights[idx], scale)
+            del(packed)
+        else:
+            acc.add(Q, weights[idx])
+
+    if batch_small is not None and rwr_solver == 'torch' and \
+            kernel == 'rwr':
+        torch_thread = torch.get_num_threads()
+        torch.set_num_threads(num_thread*torch_thread)
+        batched, todo = todo, []
+        for j, Q in tqdm(get_rwr_batched(
+                [network_files[idx] for idx in batched], ngene, alpha,
+                truncation=truncation, small=batch_small, dense=False),
+                total=len(batched)):
+            if Q is None:
+                todo.append(batched[j])
+                continue
+            if isinstance(Q, RestrictedRWR):
+                Q = restricted_gram(Q, ngene)
+            add(batched[j], Q)
+            del(Q)
+        torch.set_num_threads(torch_thread)
+    files = [network_files[idx] for idx in todo]
+    if len(files) == 0:
+        return
+    slots = None if inflight is None else \
+        SharedSlots(inflight, (ngene, ngene))
+    for j, Q in tqdm(imap_results(f, files, num_thread, slots,
+                                  largest_first(files)),
+                     total=len(files)):
+        add(todo[j], Q)
+        del(Q)
+    if slots is not None:
+        slots.close()
+
+
+def prefix_embeddings(network_files, ngene, ndim, checkpoints, num_thread=5,
+                      torch_thread=4, weights=None, device=None,
+                      eig_solver='auto', eig_tol=None,
+                      rwr_solver='torch', truncation=None, alpha=0.5,
+                      rwr_tol=1e-6, kernel='rwr', heat_t=1.0,
+                      gram_cache=None, push_eps=1e-4):
+    """
+    yield (M, x, seconds) for every M in checkpoints, x the load_multi
+    embedding of network_files[:M], from one pass over the networks
+    G of the first M networks is the running RR_sum once they are all in,
+    so each segment between two checkpoints is added on its own pool and
+    the eigensolver runs on RR_sum in place; seconds is the time to reach
+    M plus the eigensolver at M, without the eigensolvers of earlier M
+    """
+    if device is None:
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    torch.set_num_threads(torch_thread)
+    rwr_tol = solver_tol(rwr_solver, rwr_tol, push_eps)
+    weights_ = np.ones(len(network_files)) if weights is None else weights
+    f = partial(load_and_rwr, ngene, torch_thread, alpha=alpha,
+                solver=rwr_solver, truncation=truncation, tol=rwr_tol,
+                kernel=kernel, t=heat_t, dense=False, gram=True)
+    acc = GramAccumulator(ngene, device)
+
+    s = time.time()
+    spent = 0
+    start = 0
+    for M in sorted(set(min(M, len(network_files)) for M in checkpoints)):
+        add_networks(acc, f, network_files, list(range(start, M)), weights_,
+                     ngene, num_thread, gram_cache, alpha,
+                     rwr_solver, rwr_tol, truncation, kernel, heat_t)
+        start = M
+
+        # the lower triangle stays the running sum, result() only mirrors it
+        t = time.time()
+        x = network_svd(ndim, num_thread*torch_thread,
+                        acc.result().cpu().numpy(), solver=eig_solver,
+                        tol=eig_tol)
+        yield M, x, time.time() - s - spent
+        # neither this eigensolver nor the caller counts towards later M
+        spent += time.time() - t
+        del(x)
+    del(acc)
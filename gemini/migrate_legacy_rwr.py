@@ -0,0 +1,39 @@
+"""
+Mingxin Zhang
+One-off migration of the RWR matrices written next to the network files
+before the RWR cache: each one is checked against its current network and
+copied into the cache, see func.migrate_legacy_rwr
+"""
+
+import argparse
+import os
+
+import sys
+sys.path.append(os.path.join(sys.path[0], '../'))
+from config import GEMINI_DIR
+from gemini.func import migrate_legacy_rwr, out_network_files, textread
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--org', type=str, default='yeast')
+    parser.add_argument('--net', type=str, default='GeneMANIA_ex')
+    parser.add_argument('--tol', type=float, default=1e-4,
+                        help='largest RWR residual accepted from a legacy Q')
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    org, net = args.org, args.net
+    gene_file = GEMINI_DIR + f'data/networks/{org}/{org}_{net}_genes.txt'
+    ngene = len(textread(gene_file))
+    migrated = 0
+    for network_file in out_network_files(net, org):
+        if migrate_legacy_rwr(network_file, ngene, tol=args.tol) is not None:
+            migrated += 1
+    print(f'{migrated} legacy RWR matrices in the cache')
+
+
+if __name__ == '__main__':
+    main()
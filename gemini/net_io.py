@@ -0,0 +1,78 @@
+"""
+Mingxin Zhang
+Bulk readers and writers for `x y weight` edge list files
+"""
+import numpy as np
+import pandas as pd
+from pandas.errors import EmptyDataError
+
+EDGE_CHUNKSIZE = 2**20
+
+
+def iter_edges(network_file, chunksize=EDGE_CHUNKSIZE):
+    """
+    stream (row, col, weight) arrays from an edge list file, chunksize edges
+    at a time, using the C parser of pandas
+    """
+    try:
+        reader = pd.read_csv(network_file, sep=r'\s+', header=None,
+                             names=['x', 'y', 'n'], usecols=[0, 1, 2],
+                             dtype={'x': np.int64, 'y': np.int64,
+                                    'n': np.float64},
+                             engine='c', chunksize=chunksize)
+    except EmptyDataError:
+        return
+    with reader:
+        for chunk in reader:
+            yield chunk['x'].to_numpy(), chunk['y'].to_numpy(), \
+                chunk['n'].to_numpy()
+
+
+def load_edges(network_file, chunksize=EDGE_CHUNKSIZE, absolute=True):
+    """
+    load an edge list file as (row, col, weight) arrays
+    absolute: take the absolute value of the weights as load_network does
+    """
+    rows, cols, weights = [], [], []
+    for row, col, weight in iter_edges(network_file, chunksize):
+        rows.append(row)
+        cols.append(col)
+        weights.append(np.abs(weight) if absolute else weight)
+    if len(rows) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), \
+            np.zeros(0, dtype=np.float64)
+    return np.concatenate(rows), np.concatenate(cols), \
+        np.concatenate(weights)
+
+
+def load_nodes(network_file, chunksize=EDGE_CHUNKSIZE):
+    """
+    sorted unique source nodes of an edge list file
+    """
+    nodes = [np.unique(row) for row, _, _ in
+             iter_edges(network_file, chunksize)]
+    if len(nodes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.unique(np.concatenate(nodes))
+
+
+def write_edges(path, row, col, weight):
+    """
+    write (row, col, weight) arrays as a `x y weight` edge list file
+    """
+    pd.DataFrame({'x': row, 'y': col, 'n': weight}).to_csv(
+        path, sep=' ', header=False, index=False)
+
+
+def gene_indices(genes, gene2idx, source):
+    """
+    indices of a column of gene names, gene2idx a dict gene -> index; a
+    gene missing from it raises instead of turning into NaN
+    """
+    idx = pd.Series(genes).map(gene2idx)
+    missing = idx.isna().to_numpy()
+    if missing.any():
+        raise ValueError(f'{source}: {missing.sum()} edges name genes '
+                         f'outside the gene list, e.g. '
+                         f'{np.asarray(genes)[missing][0]}')
+    return idx.to_numpy(dtype=np.int64)
@@ -0,0 +1,174 @@
+"""
+Mingxin Zhang
+Packed network collections: every network of an organism/collection in one
+directory of memory-mappable CSR arrays
+
+    meta.json     ngene, network names, offsets and per-network statistics
+    genes.txt     gene list of the collection
+    indptr.bin    int32, ngene + 1 entries per network, relative to offsets
+    indices.bin   int32, concatenated column indices
+    data.bin      float32, concatenated absolute edge weights
+
+A network inside a store is addressed like a file, `{store_dir}/{name}`,
+where name is the basename of its `*_adjacency.txt` file.
+"""
+import json
+import os
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from gemini.net_io import load_edges, load_nodes
+
+_stores = {}
+
+
+def collection_store(org, net):
+    """
+    store directory of a collection, the `*_ex` collections share the
+    remapped `_gm` networks and therefore one store
+    """
+    key = 'ex' if net.endswith('_ex') else net
+    return f'data/networks/{org}/{org}_{key}_store'
+
+
+def edges_to_csr(row, col, weight, ngene):
+    """
+    csr matrix of an edge list, a repeated edge keeps its last weight
+    """
+    key = row * ngene + col
+    _, last = np.unique(key[::-1], return_index=True)
+    last = len(key) - 1 - last
+    A = csr_matrix((np.abs(weight[last]).astype('float32'),
+                    (row[last], col[last])), shape=(ngene, ngene))
+    A.eliminate_zeros()
+    return A
+
+
+class StoreWriter:
+    """
+    stream networks into a new store, networks are appended one at a time
+    so the collection is never held in memory
+    """
+
+    def __init__(self, store_dir, genes):
+        if not os.path.exists(store_dir):
+            os.makedirs(store_dir)
+        self.store_dir = store_dir
+        self.ngene = len(genes)
+        with open(f'{store_dir}/genes.txt', 'w') as f:
+            f.writelines('\n'.join(genes))
+        self.files = {k: open(f'{store_dir}/{k}.bin', 'wb')
+                      for k in ['indptr', 'indices', 'data']}
+        self.names = []
+        self.offsets = [0]
+        self.stats = []
+
+    def add(self, name, row, col, weight):
+        A = edges_to_csr(np.asarray(row), np.asarray(col),
+                         np.asarray(weight), self.ngene)
+        self.files['indptr'].write(A.indptr.astype(np.int32).tobytes())
+        self.files['indices'].write(A.indices.astype(np.int32).tobytes())
+        self.files['data'].write(A.data.astype(np.float32).tobytes())
+        covered = np.zeros(self.ngene, dtype=bool)
+        covered[np.diff(A.indptr) > 0] = True
+        covered[A.indices] = True
+        self.names.append(name)
+        self.offsets.append(self.offsets[-1] + A.nnz)
+        self.stats.append({
+            'edges': int(A.nnz),
+            'coverage': int(covered.sum()),
+            'weight_min': float(A.data.min()) if A.nnz else 0.,
+            'weight_max': float(A.data.max()) if A.nnz else 0.,
+            'weight_mean': float(A.data.mean()) if A.nnz else 0.})
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        meta = {'ngene': self.ngene, 'names': self.names,
+                'offsets': self.offsets, 'stats': self.stats}
+        with open(f'{self.store_dir}/meta.json', 'w') as f:
+            json.dump(meta, f)
+
+
+class NetworkStore:
+    """
+    read only view of a store, networks are zero-copy slices of memmaps
+    """
+
+    def __init__(self, store_dir):
+        with open(f'{store_dir}/meta.json', 'r') as f:
+            meta = json.load(f)
+        self.store_dir = store_dir
+        self.ngene = meta['ngene']
+        self.names = meta['names']
+        self.offsets = meta['offsets']
+        self.stats = dict(zip(self.names, meta['stats']))
+        self.name2idx = {name: i for i, name in enumerate(self.names)}
+        self.indptr = self._memmap('indptr', np.int32)
+        self.indices = self._memmap('indices', np.int32)
+        self.data = self._memmap('data', np.float32)
+
+    def _memmap(self, key, dtype):
+        path = f'{self.store_dir}/{key}.bin'
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r')
+
+    def __contains__(self, name):
+        return name in self.name2idx
+
+    def csr(self, name):
+        i = self.name2idx[name]
+        start, end = self.offsets[i], self.offsets[i+1]
+        n = self.ngene + 1
+        return csr_matrix((self.data[start:end], self.indices[start:end],
+                           self.indptr[i*n:(i+1)*n]),
+                          shape=(self.ngene, self.ngene), copy=False)
+
+
+def open_store(store_dir):
+    """
+    NetworkStore of store_dir, opened once per process
+    """
+    if store_dir not in _stores:
+        _stores[store_dir] = NetworkStore(store_dir)
+    return _stores[store_dir]
+
+
+def is_store_network(network_file):
+    return os.path.exists(
+        os.path.join(os.path.dirname(network_file), 'meta.json'))
+
+
+def network_csr(network_file, ngene):
+    """
+    raw (unnormalized) adjacency of a text file or store network
+    """
+    if is_store_network(network_file):
+        store = open_store(os.path.dirname(network_file))
+        return store.csr(os.path.basename(network_file))
+    x, y, n = load_edges(network_file)
+    return edges_to_csr(x, y, n, ngene)
+
+
+def network_nodes(network_file):
+    """
+    sorted source nodes of a text file or store network
+    """
+    if is_store_network(network_file):
+        store = open_store(os.path.dirname(network_file))
+        A = store.csr(os.path.basename(network_file))
+        return np.flatnonzero(np.diff(A.indptr))
+    return load_nodes(network_file)
+
+
+def network_size(network_file):
+    """
+    edge count of a store network, byte size of a text file; only used to
+    order work, largest networks first
+    """
+    if is_store_network(network_file):
+        store = open_store(os.path.dirname(network_file))
+        return store.stats[os.path.basename(network_file)]['edges']
+    return os.path.getsize(network_file)
@@ -0,0 +1,175 @@
+"""
+Mingxin Zhang
+Content addressed cache for RWR results
+
+An entry is keyed on a hash of the network contents plus the parameters
+that produced it (alpha, solver, dtype, truncation, ...), so a changed
+network or a different parameter never hits a stale entry. Entries are
+written to a temporary file and renamed into place, and manifest.json is
+updated under a file lock, so parallel jobs can share one cache directory.
+
+    {cache_dir}/manifest.json          key -> network, hash and parameters
+    {cache_dir}/{key[:2]}/{key}.npy    a single dense array
+    {cache_dir}/{key[:2]}/{key}.npz    several named arrays
+
+The cache lives in GEMINI_RWR_CACHE, data/rwr_cache by default. The .npz
+(or .npy) files the RWR stage used to write next to each network are never
+read implicitly; gemini/migrate_legacy_rwr.py copies the ones that still
+solve the RWR of their network into the cache, see func.migrate_legacy_rwr.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(sys.path[0], '../'))
+from config import GEMINI_DIR
+from gemini.net_store import is_store_network, open_store
+
+CACHE_DIR = os.environ.get('GEMINI_RWR_CACHE',
+                           GEMINI_DIR + 'data/rwr_cache')
+_hashes = {}
+
+
+def network_hash(network_file):
+    """
+    sha1 of the network contents, memoized per file size and mtime
+    """
+    if is_store_network(network_file):
+        stat = os.stat(os.path.join(os.path.dirname(network_file),
+                                    'meta.json'))
+    else:
+        stat = os.stat(network_file)
+    memo = (os.path.abspath(network_file), stat.st_size, stat.st_mtime_ns)
+    if memo not in _hashes:
+        h = hashlib.sha1()
+        if is_store_network(network_file):
+            A = open_store(os.path.dirname(network_file)).csr(
+                os.path.basename(network_file))
+            for arr in [A.indptr, A.indices, A.data]:
+                h.update(np.ascontiguousarray(arr).tobytes())
+        else:
+            with open(network_file, 'rb') as f:
+                for chunk in iter(lambda: f.read(2**20), b''):
+                    h.update(chunk)
+        _hashes[memo] = h.hexdigest()
+    return _hashes[memo]
+
+
+def rwr_params(ngene, alpha=0.5, solver='torch', dtype='float32',
+               truncation=None, **extra):
+    """
+    parameters identifying an RWR result, extra keys are added by the
+    solvers and cache representations that need them
+    """
+    params = {'ngene': int(ngene), 'alpha': alpha, 'solver': solver,
+              'dtype': dtype, 'truncation': truncation}
+    if truncation is not None and not truncation.startswith('lowrank'):
+        # sparsified entries are not renormalized, see sparsify_rwr
+        params['renorm'] = False
+    params.update(extra)
+    return params
+
+
+def cache_key(network_file, params):
+    content = {'network': network_hash(network_file), 'params': params}
+    return hashlib.sha1(
+        json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+def _entry_path(key, ext, cache_dir=None):
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    return os.path.join(cache_dir, key[:2], f'{key}.{ext}')
+
+
+def has_entry(key, cache_dir=None):
+    return os.path.exists(_entry_path(key, 'npy', cache_dir)) or \
+        os.path.exists(_entry_path(key, 'npz', cache_dir))
+
+
+def entry_bytes(key, cache_dir=None):
+    """
+    size on disk of an entry, 0 when missing
+    """
+    for ext in ['npy', 'npz']:
+        path = _entry_path(key, ext, cache_dir)
+        if os.path.exists(path):
+            return os.path.getsize(path)
+    return 0
+
+
+def load_entry(key, mmap_mode=None, cache_dir=None):
+    """
+    dict of the arrays of an entry, None when missing
+    mmap_mode: memory-map single array entries instead of reading them
+    """
+    path = _entry_path(key, 'npy', cache_dir)
+    if os.path.exists(path):
+        return {'Q': np.load(path, mmap_mode=mmap_mode)}
+    path = _entry_path(key, 'npz', cache_dir)
+    if os.path.exists(path):
+        with np.load(path) as data:
+            return {k: data[k] for k in data.files}
+    return None
+
+
+def save_entry(key, arrays, network_file=None, params=None, meta=None,
+               cache_dir=None):
+    """
+    atomically write arrays (dict name -> array) under key and record it in
+    the manifest, a lone 'Q' is written as .npy so it can be memory-mapped
+    """
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    ext = 'npy' if list(arrays) == ['Q'] else 'npz'
+    path = _entry_path(key, ext, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        if ext == 'npy':
+            np.save(f, arrays['Q'])
+        else:
+            np.savez(f, **arrays)
+    os.replace(tmp, path)
+
+    record = {'file': os.path.relpath(path, cache_dir),
+              'created': time.time()}
+    if network_file is not None:
+        record['network_file'] = network_file
+        record['network_hash'] = network_hash(network_file)
+    if params is not None:
+        record['params'] = params
+    if meta is not None:
+        record['meta'] = meta
+    update_manifest({key: record}, cache_dir)
+    return path
+
+
+def update_manifest(records, cache_dir=None):
+    """
+    merge records into manifest.json under an exclusive lock
+    """
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest_file = os.path.join(cache_dir, 'manifest.json')
+    with open(os.path.join(cache_dir, 'manifest.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        manifest = read_manifest(cache_dir)
+        manifest.update(records)
+        tmp = f'{manifest_file}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, manifest_file)
+        fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def read_manifest(cache_dir=None):
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    manifest_file = os.path.join(cache_dir, 'manifest.json')
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file, 'r') as f:
+        return json.load(f)
@@ -1,8 +1,11 @@
+import math
 import random
 import sys
 
 import numpy as np
 import torch
+from scipy.sparse import csr_matrix, diags, issparse, vstack
+from scipy.sparse.csgraph import connected_components
 
 random.seed(1)
 torch.manual_seed(1)
@@ -10,11 +13,22 @@ np.random.seed(1)
 
 
 def rwr_torch(A=None, restart_prob=None):
+    """
+    A: dense array or sparse matrix, a sparse A is scattered straight into
+    the dense system without building a dense copy of A first
+    """
     random.seed(1)
     torch.manual_seed(1)
     np.random.seed(1)
     n = A.shape[0]
-    a = (torch.eye(n) - (1 - restart_prob) * A).type(torch.Tensor)
+    if issparse(A):
+        A = A.tocoo()
+        a = torch.eye(n)
+        a[torch.from_numpy(A.row.astype(np.int64)),
+          torch.from_numpy(A.col.astype(np.int64))] -= \
+            torch.from_numpy(((1 - restart_prob) * A.data).astype('float32'))
+    else:
+        a = (torch.eye(n) - (1 - restart_prob) * A).type(torch.Tensor)
     b = (restart_prob * torch.eye(n)).type(torch.Tensor)
     Q = torch.linalg.solve(a, b).cpu().numpy()
     return Q.T
@@ -25,7 +39,12 @@ def rwr(A=None, restart_prob=None):
     torch.manual_seed(1)
     random.seed(1)
     n = A.shape[0]
-    a = (np.eye(n) - (1 - restart_prob) * A).astype('float32')
+    if issparse(A):
+        A = A.tocoo()
+        a = np.eye(n, dtype='float32')
+        a[A.row, A.col] -= (1 - restart_prob) * A.data
+    else:
+        a = (np.eye(n) - (1 - restart_prob) * A).astype('float32')
     b = (restart_prob * np.eye(n)).astype('float32')
     # a = (np.eye(n) - (1 - restart_prob) * A)
     # b = (restart_prob * np.eye(n))
@@ -33,8 +52,515 @@ def rwr(A=None, restart_prob=None):
     return Q.T
 
 
+def rwr_blocks(A=None, restart_prob=None, block=1024, solver='sparse',
+               tol=1e-6, max_iter=100):
+    """
+    yield (start, end, Q[start:end]) for blocks of seeds, Q = X.T with
+    X = alpha (I - (1 - alpha) A)^-1, without ever holding all of Q
+    solver: 'sparse' iterates X_b = alpha E_b + (1 - alpha) A X_b with
+    sparse times dense block products until the largest change is below
+    tol, so nothing ngene x ngene is allocated; 'torch' factors the dense
+    system once and solves it against slices of the identity
+    the change of an iteration is the residual alpha E_b + (1 - alpha) A X_b
+    - X_b of the previous iterate, so the yielded rows satisfy
+    |Q - alpha I - (1 - alpha) Q A^T| <= tol elementwise and are within
+    tol / alpha of the exact Q for a row normalized A; a block that is not
+    there after max_iter iterations raises ValueError
+    """
+    n = A.shape[0]
+    c = 1 - restart_prob
+    if solver == 'sparse':
+        A = csr_matrix(A, dtype='float32')
+    else:
+        if issparse(A):
+            A = A.toarray()
+        lu, pivots = torch.linalg.lu_factor(
+            torch.eye(n) - c * torch.from_numpy(np.asarray(A, 'float32')))
+        del(A)
+    for start in range(0, n, block):
+        end = min(start + block, n)
+        E = np.zeros((n, end - start), dtype='float32')
+        E[np.arange(start, end), np.arange(end - start)] = restart_prob
+        if solver == 'sparse':
+            X = E.copy()
+            for it in range(max_iter):
+                X_new = A.dot(X)
+                X_new *= c
+                X_new += E
+                delta = np.abs(X_new - X).max()
+                X = X_new
+                if delta <= tol:
+                    break
+            del(X_new)
+            if delta > tol:
+                raise ValueError(
+                    f'rwr_blocks: not converged after {max_iter} iterations, '
+                    f'change {delta:.2e} > tol {tol:.0e}')
+        else:
+            X = torch.linalg.lu_solve(lu, pivots, torch.from_numpy(E))
+            X = X.numpy()
+        yield start, end, np.ascontiguousarray(X.T)
+        del(E, X)
+
+
+def rwr_sparse(A=None, restart_prob=None, tol=1e-6, max_iter=100,
+               block=1024):
+    """
+    RWR of a sparse row normalized A without a dense solve, see rwr_blocks,
+    so time and memory scale with the edges instead of n^3 and n^2 for A
+    returns the dense Q = X.T like rwr_torch
+    """
+    n = A.shape[0]
+    Q = np.empty((n, n), dtype='float32')
+    for start, end, Qb in rwr_blocks(A, restart_prob, block, 'sparse', tol,
+                                     max_iter):
+        Q[start:end] = Qb
+    return Q
+
+
+def rwr_push_blocks(A=None, restart_prob=None, eps=1e-4, block=1024):
+    """
+    yield (start, end, Q[start:end]) as csr matrices, each row approximated
+    by reverse local push: row t of Q is column t of
+    X = alpha (I - (1 - alpha) A)^-1, the contributions of every node to
+    t, found by pushing the residual of t backwards along the edges of A
+        p[v] += alpha r[v], r[u] += (1 - alpha) A[u, v] r[v], r[v] = 0
+    until no residual is above eps; all nodes above eps are pushed at once,
+    on a sparse block of seeds, so only reached nodes are ever stored
+    every entry of the row is under-estimated by at most eps (X has unit
+    row sums), entries that were never reached are 0
+    """
+    A = csr_matrix(A, dtype='float32')
+    n = A.shape[0]
+    c = 1 - restart_prob
+    for start in range(0, n, block):
+        end = min(start + block, n)
+        seeds = np.arange(start, end)
+        R = csr_matrix((np.ones(end - start, dtype='float32'),
+                        (seeds, np.arange(end - start))),
+                       shape=(n, end - start))
+        P = csr_matrix((n, end - start), dtype='float32')
+        # after k sweeps every residual is at most (1 - alpha)^k
+        while R.nnz:
+            push = R.multiply(R > eps).tocsr()
+            if push.nnz == 0:
+                break
+            P = P + restart_prob * push
+            R = R - push + c * A.dot(push)
+            R.eliminate_zeros()
+            del(push)
+        yield start, end, P.T.tocsr()
+        del(P, R)
+
+
+def rwr_push(A=None, restart_prob=None, eps=1e-4, block=1024):
+    """
+    sparse approximate Q of a row normalized A by reverse local push, see
+    rwr_push_blocks, in memory proportional to the entries above ~eps
+    """
+    return vstack([Qb for _, _, Qb in rwr_push_blocks(
+        A, restart_prob, eps, block)]).tocsr()
+
+
+def heat_blocks(A=None, t=1.0, block=1024, tol=1e-6):
+    """
+    yield (start, end, H[start:end]) of the heat kernel of a row normalized
+    A, H = X.T with X = exp(-t (I - A)) = sum_k pois(k; t) A^k, the diffusion
+    of the random walk after time t, in the same orientation as the RWR Q
+    the series is applied to blocks of seeds with sparse times dense block
+    products and cut once the Poisson weights left sum to at most tol; as
+    A^k has entries in [0, 1], that bounds the error of every entry
+    """
+    A = csr_matrix(A, dtype='float32')
+    n = A.shape[0]
+    # Poisson weights in log space, e^-t alone underflows for large t
+    weights = []
+    total, k = 0, 0
+    while total < 1 - tol:
+        weights.append(math.exp(-t + k * math.log(t) - math.lgamma(k + 1))
+                       if t > 0 else float(k == 0))
+        total += weights[-1]
+        k += 1
+    for start in range(0, n, block):
+        end = min(start + block, n)
+        T = np.zeros((n, end - start), dtype='float32')
+        T[np.arange(start, end), np.arange(end - start)] = 1
+        X = weights[0] * T
+        for w in weights[1:]:
+            T = A.dot(T)
+            X += w * T
+        yield start, end, np.ascontiguousarray(X.T)
+        del(T, X)
+
+
+def heat_kernel(A=None, t=1.0, tol=1e-6, block=1024):
+    """
+    dense heat kernel of a row normalized A, see heat_blocks, at a cost of
+    O(nnz(A) n) per series term instead of the O(n^3) of a dense solve
+    """
+    n = A.shape[0]
+    H = np.empty((n, n), dtype='float32')
+    for start, end, Hb in heat_blocks(A, t, block, tol):
+        H[start:end] = Hb
+    return H
+
+
+# solvers of the dense I - (1 - alpha) A system
+DENSE_SOLVERS = ('torch', 'numpy')
+
+
+def rwr_solve(A=None, restart_prob=None, solver='torch', tol=1e-6,
+              max_iter=100):
+    """
+    dispatch to the RWR solver named by solver, tol and max_iter only
+    apply to the iterative 'sparse' solver; 'push', the only solver
+    returning a sparse Q, takes tol as its eps instead, which the callers
+    fill from push_eps rather than rwr_tol, see func.solver_tol
+    """
+    if solver == 'torch':
+        return rwr_torch(A, restart_prob)
+    elif solver == 'numpy':
+        return rwr(A, restart_prob)
+    elif solver == 'sparse':
+        if not issparse(A):
+            A = csr_matrix(A)
+        return rwr_sparse(A, restart_prob, tol, max_iter)
+    elif solver == 'push':
+        return rwr_push(A, restart_prob, tol)
+    elif solver == 'eig':
+        raise ValueError('the eig solver needs the network degrees, '
+                         'use func.get_rwr_alphas or RWREig')
+    raise ValueError(f'unknown rwr solver {solver}')
+
+
+class RestrictedRWR:
+    """
+    RWR matrix stored as its non-trivial block: rows and columns idx of Q
+    are block, every other row of Q is e_i
+    """
+
+    def __init__(self, idx, block, ngene):
+        self.idx = np.asarray(idx)
+        self.block = block
+        self.ngene = ngene
+
+    @property
+    def shape(self):
+        return (self.ngene, self.ngene)
+
+    def todense(self, dtype='float32'):
+        Q = np.eye(self.ngene, dtype=dtype)
+        Q[np.ix_(self.idx, self.idx)] = self.block
+        return Q
+
+    def rows(self, start, end, dtype='float32'):
+        """
+        dense rows start:end of Q
+        """
+        pos = np.full(self.ngene, -1)
+        pos[self.idx] = np.arange(len(self.idx))
+        Qb = np.zeros((end - start, self.ngene), dtype=dtype)
+        r = pos[start:end]
+        inside = r >= 0
+        Qb[np.ix_(inside, self.idx)] = self.block[r[inside]]
+        trivial = np.flatnonzero(~inside)
+        Qb[trivial, start + trivial] = 1
+        return Qb
+
+    def tosparse(self, truncation=None, renorm=False):
+        """
+        csr_matrix of Q with the block sparsified by truncation, see
+        sparsify_rwr, and the e_i rows as single diagonal entries
+        """
+        if truncation is None:
+            block, stats = csr_matrix(self.block), None
+        else:
+            block, stats = sparsify_rwr(self.block, truncation, renorm)
+        block = block.tocoo()
+        trivial = np.setdiff1d(np.arange(self.ngene), self.idx)
+        row = np.concatenate([self.idx[block.row], trivial])
+        col = np.concatenate([self.idx[block.col], trivial])
+        data = np.concatenate([block.data,
+                               np.ones(len(trivial), dtype=block.dtype)])
+        Q = csr_matrix((data, (row, col)), shape=self.shape)
+        if stats is not None:
+            stats.update({'nnz': int(Q.nnz),
+                          'density': Q.nnz / self.ngene**2})
+        return Q, stats
+
+
+class FactoredRWR(RestrictedRWR):
+    """
+    restricted RWR matrix whose block is kept as truncated SVD factors,
+    block ~ U diag(s) Vt, and only rebuilt row block by row block
+    """
+
+    def __init__(self, idx, U, s, Vt, ngene):
+        self.idx = np.asarray(idx)
+        self.U, self.s, self.Vt = U, s, Vt
+        self.ngene = ngene
+
+    @property
+    def block(self):
+        return self.block_rows(0, len(self.idx))
+
+    def block_rows(self, start, end):
+        return np.dot(self.U[start:end] * self.s, self.Vt)
+
+    def rows(self, start, end, dtype='float32'):
+        pos = np.full(self.ngene, -1)
+        pos[self.idx] = np.arange(len(self.idx))
+        Qb = np.zeros((end - start, self.ngene), dtype=dtype)
+        r = pos[start:end]
+        inside = r >= 0
+        Qb[np.ix_(inside, self.idx)] = np.dot(self.U[r[inside]] * self.s,
+                                              self.Vt)
+        trivial = np.flatnonzero(~inside)
+        Qb[trivial, start + trivial] = 1
+        return Qb
+
+
+def factor_rwr(Q, energy=0.99):
+    """
+    truncated SVD of a RestrictedRWR block or a dense Q, keeping the
+    smallest rank whose singular values hold a fraction energy of the
+    squared Frobenius norm
+    returns the FactoredRWR and the statistics of the approximation
+    """
+    if isinstance(Q, RestrictedRWR):
+        idx, block, ngene = Q.idx, Q.block, Q.ngene
+    else:
+        idx, block, ngene = np.arange(len(Q)), Q, len(Q)
+    m = len(idx)
+    U, s, Vt = torch.linalg.svd(torch.from_numpy(
+        np.asarray(block, dtype='float32')), full_matrices=False)
+    U, s, Vt = U.numpy(), s.numpy(), Vt.numpy()
+    total = np.cumsum(s.astype('float64') ** 2)
+    rank = int(np.searchsorted(total, energy * total[-1]) + 1) if m else 0
+    rank = min(rank, m)
+    F = FactoredRWR(idx, np.ascontiguousarray(U[:, :rank]), s[:rank].copy(),
+                    np.ascontiguousarray(Vt[:rank]), ngene)
+    del(U, Vt)
+    stats = {'truncation': f'lowrank:{energy}', 'rank': rank,
+             'covered': m,
+             'kept_energy': float(total[rank - 1] / total[-1]) if m else 1.,
+             'compression': m * m / max(rank * (2 * m + 1), 1)}
+    return F, stats
+
+
+def parse_truncation(truncation):
+    """
+    'topk:50', 'mass:0.9', 'eps:1e-4' or 'lowrank:0.99' -> (policy, value),
+    lowrank caches SVD factors instead of sparse rows, see factor_rwr
+    """
+    policy, value = truncation.split(':')
+    if policy not in ['topk', 'mass', 'eps', 'lowrank']:
+        raise ValueError(f'unknown truncation {truncation}, use topk:k, '
+                         'mass:fraction, eps:value or lowrank:energy')
+    return policy, int(value) if policy == 'topk' else float(value)
+
+
+def sparsify_rwr(Q, truncation, renorm=False, block=1024):
+    """
+    sparse approximation of a dense RWR matrix, row by row
+    truncation: 'topk:k' keeps the k largest entries, 'mass:f' the largest
+    entries holding a fraction f of the row mass, 'eps:v' entries above v
+    renorm: rescale the kept entries to the original row sum; off by
+    default, the dropped mass then stays at the log(1/ngene) floor instead
+    of inflating the kept entries; get_rwr, store_rwr and --truncation
+    leave it off on purpose, so every cached truncated Q is unrenormalized
+    and rwr_params records that, renorm is only for direct comparisons
+    returns the csr_matrix and the statistics of the approximation; dropped
+    entries read as 0, i.e. the log(1/ngene) floor of log(Q + 1/ngene)
+    """
+    policy, value = parse_truncation(truncation)
+    n, m = Q.shape
+    parts, kept = [], []
+    for start in range(0, n, block):
+        Qb = Q[start:start + block]
+        Qb = np.asarray(Qb.toarray() if issparse(Qb) else Qb,
+                        dtype='float32')
+        if policy == 'topk':
+            k = min(value, m)
+            col = np.argpartition(-Qb, k - 1, axis=1)[:, :k]
+            mask = np.zeros(Qb.shape, dtype=bool)
+            np.put_along_axis(mask, col, True, axis=1)
+        elif policy == 'mass':
+            col = np.argsort(-Qb, axis=1)
+            csum = np.cumsum(np.take_along_axis(Qb, col, axis=1), axis=1)
+            # keep up to and including the entry that reaches the fraction
+            need = value * csum[:, -1:]
+            keep = np.concatenate(
+                [np.ones((len(Qb), 1), dtype=bool),
+                 csum[:, :-1] < need], axis=1)
+            mask = np.zeros(Qb.shape, dtype=bool)
+            np.put_along_axis(mask, col, keep, axis=1)
+        else:
+            mask = Qb > value
+        total = Qb.sum(axis=1)
+        Qb = np.where(mask, Qb, 0)
+        part = Qb.sum(axis=1)
+        kept.append(np.divide(part, total, out=np.ones_like(part),
+                              where=total > 0))
+        if renorm:
+            Qb *= np.divide(total, part, out=np.zeros_like(part),
+                            where=part > 0)[:, None]
+        parts.append(csr_matrix(Qb))
+        del(Qb, mask)
+    Qs = vstack(parts).tocsr()
+    kept = np.concatenate(kept)
+    stats = {'truncation': truncation, 'renorm': renorm, 'nnz': int(Qs.nnz),
+             'density': Qs.nnz / (n * m),
+             'kept_mass_mean': float(kept.mean()),
+             'kept_mass_min': float(kept.min())}
+    return Qs, stats
+
+
+def trivial_nodes(A):
+    """
+    nodes whose only edge is the self-loop load_network gives uncovered
+    genes, their RWR row is e_i and no other row reaches them
+    """
+    A = A.tocsr()
+    diag = A.diagonal() != 0
+    row_nnz = np.diff(A.indptr)
+    col_nnz = np.bincount(A.indices, minlength=A.shape[0])
+    return diag & (row_nnz == 1) & (col_nnz == 1)
+
+
+def rwr_restricted(A=None, restart_prob=None, solver='torch', tol=1e-6,
+                   max_iter=100):
+    """
+    RWR solved only on the covered nodes, one connected component at a
+    time, since Q is block diagonal over components and e_i on the rest
+    returns a RestrictedRWR whose block holds the covered nodes grouped by
+    component
+    """
+    A = A.tocsr()
+    n = A.shape[0]
+    covered = np.flatnonzero(~trivial_nodes(A))
+    sub = A[covered][:, covered]
+    _, labels = connected_components(sub, directed=True, connection='weak')
+    order = np.argsort(labels, kind='stable')
+    idx = covered[order]
+    sub = sub[order][:, order].tocsr()
+    sizes = np.bincount(labels)
+    block = np.zeros((len(idx), len(idx)), dtype='float32')
+    start = 0
+    for size in sizes:
+        end = start + size
+        block[start:end, start:end] = rwr_solve(
+            sub[start:end, start:end], restart_prob, solver, tol, max_iter)
+        start = end
+    return RestrictedRWR(idx, block, n)
+
+
+def padded_size(n, smallest=16):
+    """
+    power of two at or above n, the size small subgraphs are padded to so
+    that networks of similar size share one batched solve
+    """
+    return max(smallest, 1 << max(int(n) - 1, 0).bit_length())
+
+
+def rwr_batched(subs, restart_prob, size=None):
+    """
+    RWR of several small networks in one batched torch.linalg.solve, the
+    batch dimension first; subs are row normalized matrices (dense or
+    sparse), each is padded to size with zero rows, which leaves identity
+    rows in I - (1 - alpha) A and so does not touch the real nodes
+    returns the Q of each sub, cropped back to its own size
+    """
+    size = max(sub.shape[0] for sub in subs) if size is None else size
+    a = torch.eye(size).repeat(len(subs), 1, 1)
+    for k, sub in enumerate(subs):
+        sub = csr_matrix(sub).tocoo()
+        a[k, torch.from_numpy(sub.row.astype(np.int64)),
+          torch.from_numpy(sub.col.astype(np.int64))] -= \
+            torch.from_numpy(((1 - restart_prob) * sub.data).astype('float32'))
+    b = (restart_prob * torch.eye(size)).expand(len(subs), size, size)
+    X = torch.linalg.solve(a, b)
+    del(a, b)
+    Qs = []
+    for k, sub in enumerate(subs):
+        n = sub.shape[0]
+        Qs.append(np.ascontiguousarray(X[k, :n, :n].T.numpy()))
+    del(X)
+    return Qs
+
+
+def rwr_woodbury(Q, dA, restart_prob):
+    """
+    Q of A + dA from the Q of a row normalized A, for a dA whose non-zero
+    rows K are few: I - (1 - alpha)(A + dA) is a rank |K| change of
+    I - (1 - alpha) A, so by Sherman-Morrison-Woodbury, with c = 1 - alpha,
+        P = dA_K Q^T, C = I - c / alpha P[:, K]
+        Q' = Q + c / alpha P^T C^-T Q[K]
+    at O(nnz(dA) n + |K| n^2) instead of the O(n^3) solve
+    returns Q' and the condition number of C, large when the update lost
+    accuracy and the network should be solved again
+    """
+    dA = csr_matrix(dA)
+    K = np.flatnonzero(np.diff(dA.indptr))
+    c = (1 - restart_prob) / restart_prob
+    P = np.asarray(dA[K].dot(Q.T), dtype='float64')
+    C = np.eye(len(K)) - c * P[:, K]
+    cond = np.linalg.cond(C) if len(K) else 1.
+    Z = np.linalg.solve(C.T, np.asarray(Q[K], dtype='float64'))
+    Q = Q + c * torch.mm(torch.from_numpy(P.T.astype(Q.dtype)),
+                         torch.from_numpy(Z.astype(Q.dtype))).numpy()
+    del(P, Z)
+    return Q, cond
+
+
+class RWREig:
+    """
+    one eigendecomposition S = U diag(lam) U^T of the symmetric
+    S = D^1/2 A D^-1/2 = D^-1/2 W D^-1/2 of a row normalized A = D^-1 W,
+    after which the RWR of any restart probability alpha is one product
+        Q = alpha D^1/2 U diag(1 / (1 - (1 - alpha) lam)) U^T D^-1/2
+    restrict: factor only the covered nodes, see rwr_restricted
+    """
+
+    def __init__(self, A, deg, restrict=True):
+        A = A.tocsr()
+        self.ngene = A.shape[0]
+        self.restrict = restrict
+        if restrict:
+            self.idx = np.flatnonzero(~trivial_nodes(A))
+            A = A[self.idx][:, self.idx]
+        else:
+            self.idx = np.arange(self.ngene)
+        self.sq = np.sqrt(np.asarray(deg, dtype='float64')[self.idx])
+        S = (diags(self.sq).dot(A).dot(diags(1 / self.sq))).toarray()
+        asym = np.abs(S - S.T).max() if len(S) else 0
+        if asym > 1e-4:
+            raise ValueError('the eig RWR solver needs a symmetric network, '
+                             f'D^1/2 A D^-1/2 is off by {asym:.1e}')
+        lam, U = torch.linalg.eigh(torch.from_numpy((S + S.T) / 2))
+        del(S)
+        self.lam, self.U = lam.numpy(), U.numpy()
+
+    def rwr(self, alpha):
+        """
+        Q for restart probability alpha, a RestrictedRWR when restricted
+        """
+        f = alpha / (1 - (1 - alpha) * self.lam)
+        L = torch.from_numpy(self.U * self.sq[:, None] * f[None, :])
+        R = torch.from_numpy(self.U.T / self.sq[None, :])
+        block = torch.mm(L, R).numpy().astype('float32')
+        del(L, R)
+        if self.restrict:
+            return RestrictedRWR(self.idx, block, self.ngene)
+        return block
+
+
 def rwr_torch_iterative(A=None, restart_prob=None, delta_=1e-3, max_iter=10,
                verbal=True, device=None):
+    """
+    dense float16 power iteration on a device, kept for the GPU
+    experiments; on the cpu use rwr_sparse (solver='sparse')
+    """
     torch.manual_seed(1)
     nnode, nfeat = A.shape
     for i in range(nnode):
@@ -0,0 +1,122 @@
+"""
+Mingxin Zhang
+Shared memory slots for moving ngene x ngene matrices from pool workers to
+the parent without pickling them through a pipe
+"""
+from functools import partial
+from multiprocessing import Pool, Queue
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import torch
+
+_attached = {}
+_free = None
+
+
+class SharedSlots:
+    """
+    nslot shared memory buffers of a fixed shape and dtype, created and
+    unlinked by the parent; workers fill them through imap_results and the
+    parent reads them back as zero-copy arrays or tensors
+    """
+
+    def __init__(self, nslot, shape, dtype='float32'):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype).name
+        nbytes = int(np.prod(self.shape)) * np.dtype(dtype).itemsize
+        self.shms = [SharedMemory(create=True, size=max(nbytes, 1))
+                     for _ in range(nslot)]
+        self.spec = ([shm.name for shm in self.shms], self.shape, self.dtype)
+
+    def __len__(self):
+        return len(self.shms)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def array(self, idx):
+        return np.ndarray(self.shape, dtype=self.dtype,
+                          buffer=self.shms[idx].buf)
+
+    def tensor(self, idx):
+        return torch.from_numpy(self.array(idx))
+
+    def close(self):
+        for shm in self.shms:
+            shm.close()
+            shm.unlink()
+        self.shms = []
+
+
+def _attach(name):
+    # pool workers share the parent's resource tracker, so attaching here
+    # does not make the segment outlive or die before the parent's unlink
+    if name not in _attached:
+        _attached[name] = SharedMemory(name=name)
+    return _attached[name]
+
+
+def slot_array(spec, idx):
+    """
+    worker side view of slot idx of a SharedSlots spec
+    """
+    names, shape, dtype = spec
+    return np.ndarray(shape, dtype=dtype, buffer=_attach(names[idx]).buf)
+
+
+def _init_worker(free):
+    global _free
+    _free = free
+
+
+def _run(f, task):
+    i, item = task
+    return i, f(item)
+
+
+def _fill_free_slot(f, spec, task):
+    """
+    run f(item) and copy the result into the next free slot, or return it
+    as it is when it is not an array
+    """
+    i, item = task
+    out = f(item)
+    if not isinstance(out, np.ndarray):
+        return i, None, out
+    idx = _free.get()
+    np.copyto(slot_array(spec, idx), out, casting='unsafe')
+    del(out)
+    return i, idx, None
+
+
+def imap_results(f, items, num_thread, slots=None, order=None):
+    """
+    run f over items on one long-lived pool and yield (i, f(items[i])) as
+    workers finish, submitting tasks in order (e.g. largest network first)
+    slots: SharedSlots, results are then zero-copy views of shared memory
+    that stay valid until the next result is requested; results that are
+    not arrays (a RestrictedGram, a sparse Q) come back through the pipe
+    """
+    order = range(len(items)) if order is None else order
+    tasks = [(i, items[i]) for i in order]
+    free = Queue()
+    if slots is not None:
+        for idx in range(len(slots)):
+            free.put(idx)
+    with Pool(processes=num_thread, initializer=_init_worker,
+              initargs=(free,)) as pl:
+        if slots is None:
+            for i, out in pl.imap_unordered(partial(_run, f), tasks):
+                yield i, out
+        else:
+            for i, idx, out in pl.imap_unordered(
+                    partial(_fill_free_slot, f, slots.spec), tasks):
+                if idx is None:
+                    yield i, out
+                    continue
+                yield i, slots.array(idx)
+                free.put(idx)
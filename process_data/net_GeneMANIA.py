@@ -1,11 +1,22 @@
 # from functools import partial
 # from multiprocessing import Pool, cpu_count
 
+import argparse
 import os
+import sys
 
 import pandas as pd
 from tqdm import tqdm
 
+sys.path.append(os.path.join(sys.path[0], '../'))
+from gemini.net_io import gene_indices, write_edges
+from gemini.net_store import StoreWriter, collection_store
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--store', type=int, default=0,
+                    help='also write packed network stores (gemini/net_store.py)')
+args = parser.parse_args()
+
 if not os.path.exists('data/networks/'):
     os.mkdir('data/networks/')
 
@@ -54,16 +65,18 @@ for org in org2binomial.keys():
         f.writelines('\n'.join(genes))
 
     print('process networks')
+    if args.store:
+        store = StoreWriter(collection_store(org, 'GeneMANIA'), genes)
     for net in tqdm(lst):
         net_path = f"data/raw/{binomial}/{net}"
         data = pd.read_csv(net_path, sep='\t')
         net_name = net_path.split('/')[-1].replace('.txt', '')
-        seq1 = list(data['Gene_A'])
-        seq2 = list(data['Gene_B'])
-        seq3 = list(data['Weight'])
-        seq1 = [gene2idx[gene] for gene in seq1]
-        seq2 = [gene2idx[gene] for gene in seq2]
+        seq1 = gene_indices(data['Gene_A'], gene2idx, net_path)
+        seq2 = gene_indices(data['Gene_B'], gene2idx, net_path)
+        seq3 = data['Weight'].to_numpy()
         path = f'data/networks/{org}/{org}_string_{net_name}_adjacency.txt'
-        with open(path, 'w') as f:
-            for idx, pair in enumerate(zip(seq1, seq2)):
-                f.write(f'{pair[0]} {pair[1]} {seq3[idx]}\n')
+        write_edges(path, seq1, seq2, seq3)
+        if args.store:
+            store.add(os.path.basename(path), seq1, seq2, seq3)
+    if args.store:
+        store.close()
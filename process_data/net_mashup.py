@@ -1,11 +1,22 @@
 # from functools import partial
 # from multiprocessing import Pool, cpu_count
 
+import argparse
 import os
 import shutil
+import sys
 
 from tqdm import tqdm
 
+sys.path.append(os.path.join(sys.path[0], '../'))
+from gemini.net_io import gene_indices, load_edges, write_edges
+from gemini.net_store import StoreWriter, collection_store
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--store', type=int, default=0,
+                    help='also write packed network stores (gemini/net_store.py)')
+args = parser.parse_args()
+
 if not os.path.exists('data/networks/'):
     os.mkdir('data/networks/')
 
@@ -45,6 +56,10 @@ for org in orgs:
         src = f'data/raw/mashup_networks/{org}/{org}_string_genes.txt'
         dst = f'data/networks/{org}/{org}_mashup_genes.txt'
         shutil.copyfile(src, dst)
+        with open(dst, 'r') as f:
+            genes = [line.strip() for line in f.readlines()]
+    if args.store:
+        store = StoreWriter(collection_store(org, 'mashup'), genes)
 
     lst = {'neighborhood', 'fusion', 'cooccurence',
            'coexpression',  'experimental', 'database'}
@@ -55,18 +70,20 @@ for org in orgs:
         else:
             net_path = \
                 f"{data_path}/{org}/{org}_string_{net_name}_adjacency.txt"
-        seq1 = []
-        seq2 = []
-        seq3 = []
-        with open(net_path, 'r') as f:
-            for line in f.readlines():
-                seq1.append(int(line.strip().split()[0])-1)
-                seq2.append(int(line.strip().split()[1])-1)
-                seq3.append(float(line.strip().split()[2]))
-            if org == 'human_match':
-                seq1 = [geneidx2idx[gene] for gene in seq1]
-                seq2 = [geneidx2idx[gene] for gene in seq2]
+        seq1, seq2, seq3 = load_edges(net_path, absolute=False)
+        seq1, seq2 = seq1 - 1, seq2 - 1
+        if org == 'human_match':
+            # 1-based rows of the raw gene list, a 0 or a row past its end
+            # raises instead of wrapping around
+            seq1 = gene_indices(seq1, geneidx2idx, net_path)
+            seq2 = gene_indices(seq2, geneidx2idx, net_path)
+        elif min(seq1.min(), seq2.min()) < 0 or \
+                max(seq1.max(), seq2.max()) >= len(genes):
+            raise ValueError(f'{net_path}: gene indices outside '
+                             f'1..{len(genes)}')
         path = f'data/networks/{org}/{org}_string_{net_name}_adjacency.txt'
-        with open(path, 'w') as f:
-            for idx, pair in enumerate(zip(seq1, seq2)):
-                f.write(f'{pair[0]} {pair[1]} {seq3[idx]}\n')
+        write_edges(path, seq1, seq2, seq3)
+        if args.store:
+            store.add(os.path.basename(path), seq1, seq2, seq3)
+    if args.store:
+        store.close()
@@ -1,7 +1,21 @@
+import argparse
+import os
+import sys
+
+import numpy as np
 import pandas as pd
 from func import textread
 from tqdm import tqdm
 
+sys.path.append(os.path.join(sys.path[0], '../'))
+from gemini.net_io import load_edges, write_edges
+from gemini.net_store import StoreWriter, collection_store
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--store', type=int, default=0,
+                    help='also write packed network stores (gemini/net_store.py)')
+args = parser.parse_args()
+
 print('read mapping for human genes')
 filename = 'data/raw/aliase/9606.protein.aliases.v11.5.txt'
 alias2string = {}
@@ -19,6 +33,7 @@ net = 'GeneMANIA'
 
 # for org in ['human_match']:
 # for net in ['mashup']:
+store = None
 for net in ['mashup', 'GeneMANIA']:
     # for net in ['GeneMANIA']:
     org = 'human_match' if net == 'mashup' else 'human'
@@ -41,6 +56,9 @@ for net in ['mashup', 'GeneMANIA']:
 
     # gs = gm if net == 'mashup' else gg
     genes_union = sorted(list(set(gm + gg)))
+    if args.store and store is None:
+        store = StoreWriter(collection_store('human_match', 'GeneMANIA_ex'),
+                            genes_union)
     with open(f'data/networks/{org}/{org}_GeneMANIA_ex_genes.txt',
               'w') as f:
         for gene in genes_union:
@@ -76,29 +94,20 @@ for net in ['mashup', 'GeneMANIA']:
             string_nets.append(net_name)
         string_nets = sorted(string_nets)
 
+    idx2g = idx2gg if net == 'GeneMANIA' else idx2gm
+    idx_map = np.array([gene2idx[idx2g[idx]] for idx in range(len(idx2g))])
     network_files = []
     for i in tqdm(range(len(string_nets))):
         network_file = f'data/networks/{org}/{org}_' +\
             f'string_{string_nets[i]}_adjacency.txt'
-        seq1 = []
-        seq2 = []
-        seq3 = []
-        with open(network_file, 'r') as f:
-            for line in f.readlines():
-                x, y, n = line.split()
-                seq1.append(int(x))
-                seq2.append(int(y))
-                seq3.append(abs(float(n)))
-        if net == 'GeneMANIA':
-            seq1 = [gene2idx[idx2gg[gene]] for gene in seq1]
-            seq2 = [gene2idx[idx2gg[gene]] for gene in seq2]
-        else:
-            seq1 = [gene2idx[idx2gm[gene]] for gene in seq1]
-            seq2 = [gene2idx[idx2gm[gene]] for gene in seq2]
+        seq1, seq2, seq3 = load_edges(network_file)
+        seq1, seq2 = idx_map[seq1], idx_map[seq2]
         org = 'human_match'
         path = f'data/networks/{org}/{org}_' +\
             f'string_{string_nets[i]}_gm_adjacency.txt'
-        with open(path, 'w') as f:
-            for idx, pair in enumerate(zip(seq1, seq2)):
-                f.write(f'{pair[0]} {pair[1]} {seq3[idx]}\n')
+        write_edges(path, seq1, seq2, seq3)
+        if args.store:
+            store.add(os.path.basename(path), seq1, seq2, seq3)
         org = 'human_match' if net == 'mashup' else 'human'
+if args.store:
+    store.close()
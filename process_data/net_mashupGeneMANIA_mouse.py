@@ -1,7 +1,21 @@
+import argparse
+import os
+import sys
+
+import numpy as np
 import pandas as pd
 from func import textread
 from tqdm import tqdm
 
+sys.path.append(os.path.join(sys.path[0], '../'))
+from gemini.net_io import gene_indices, load_edges, write_edges
+from gemini.net_store import StoreWriter, collection_store
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--store', type=int, default=0,
+                    help='also write packed network stores (gemini/net_store.py)')
+args = parser.parse_args()
+
 org2binomial = {'yeast': 'Saccharomyces_cerevisiae',
                 'human': 'Homo_sapiens',
                 'mouse': 'Mus_musculus'}
@@ -18,24 +32,26 @@ gm2idx = {g: idx for idx, g in enumerate(gm)}
 string_nets = ['neighborhood', 'fusion', 'cooccurence',
                'coexpression',  'experimental', 'database']
 string_nets = sorted(string_nets)
+if args.store:
+    store = StoreWriter(collection_store(org, 'mashup'), gm)
 for i in tqdm(range(len(string_nets))):
     s_net = string_nets[i]
     filt = mashup_df[s_net] > 0
     s_df = mashup_df[filt]
-    seq1 = list(s_df.protein1)
-    seq2 = list(s_df.protein2)
-    seq3 = list(s_df[s_net])
-
-    seq1 = [gm2idx[gene] for gene in seq1]
-    seq2 = [gm2idx[gene] for gene in seq2]
+    seq1 = gene_indices(s_df.protein1, gm2idx, file_name)
+    seq2 = gene_indices(s_df.protein2, gm2idx, file_name)
+    seq3 = s_df[s_net].to_numpy()
     path = f'data/networks/{org}/{org}_' +\
         f'string_{s_net}_adjacency.txt'
-    with open(path, 'w') as f:
-        for idx, pair in enumerate(zip(seq1, seq2)):
-            f.write(f'{pair[0]} {pair[1]} {seq3[idx]}\n')
+    write_edges(path, seq1, seq2, seq3)
+    if args.store:
+        store.add(os.path.basename(path), seq1, seq2, seq3)
+if args.store:
+    store.close()
 with open(f'data/networks/{org}/{org}_mashup_genes.txt', 'w') as f:
     f.writelines('\n'.join(gm))
 
+store = None
 for net in ['mashup', 'GeneMANIA']:
     genem = f'data/networks/{org}/{org}_mashup_genes.txt'
     gm = textread(genem)
@@ -48,6 +64,9 @@ for net in ['mashup', 'GeneMANIA']:
     idx2gm = {idx: g for idx, g in enumerate(gm)}
 
     genes_union = sorted(list(set(gm + gg)))
+    if args.store and store is None:
+        store = StoreWriter(collection_store(org, 'GeneMANIA_ex'),
+                            genes_union)
     gene2idx = {gene: idx for idx, gene in enumerate(genes_union)}
     with open(f'data/networks/{org}/{org}_GeneMANIA_ex_genes.txt',
               'w') as f:
@@ -82,27 +101,18 @@ for net in ['mashup', 'GeneMANIA']:
             string_nets.append(net_name)
         string_nets = sorted(string_nets)
 
+    idx2g = idx2gg if net == 'GeneMANIA' else idx2gm
+    idx_map = np.array([gene2idx[idx2g[idx]] for idx in range(len(idx2g))])
     network_files = []
     for i in tqdm(range(len(string_nets))):
         network_file = f'data/networks/{org}/{org}_' +\
             f'string_{string_nets[i]}_adjacency.txt'
-        seq1 = []
-        seq2 = []
-        seq3 = []
-        with open(network_file, 'r') as f:
-            for line in f.readlines():
-                x, y, n = line.split()
-                seq1.append(int(x))
-                seq2.append(int(y))
-                seq3.append(abs(float(n)))
-        if net == 'GeneMANIA':
-            seq1 = [gene2idx[idx2gg[gene]] for gene in seq1]
-            seq2 = [gene2idx[idx2gg[gene]] for gene in seq2]
-        else:
-            seq1 = [gene2idx[idx2gm[gene]] for gene in seq1]
-            seq2 = [gene2idx[idx2gm[gene]] for gene in seq2]
+        seq1, seq2, seq3 = load_edges(network_file)
+        seq1, seq2 = idx_map[seq1], idx_map[seq2]
         path = f'data/networks/{org}/{org}_' +\
             f'string_{string_nets[i]}_gm_adjacency.txt'
-        with open(path, 'w') as f:
-            for idx, pair in enumerate(zip(seq1, seq2)):
-                f.write(f'{pair[0]} {pair[1]} {seq3[idx]}\n')
+        write_edges(path, seq1, seq2, seq3)
+        if args.store:
+            store.add(os.path.basename(path), seq1, seq2, seq3)
+if args.store:
+    store.close()
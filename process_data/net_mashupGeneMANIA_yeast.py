@@ -4,11 +4,26 @@ merge STRING and BioGRID networks together: find the union genes and
 map the gene index from original to the new one
 '''
 
+import argparse
+import os
+import sys
+
+import numpy as np
 import pandas as pd
 from func import textread
 from tqdm import tqdm
 
+sys.path.append(os.path.join(sys.path[0], '../'))
+from gemini.net_io import load_edges, write_edges
+from gemini.net_store import StoreWriter, collection_store
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--store', type=int, default=0,
+                    help='also write packed network stores (gemini/net_store.py)')
+args = parser.parse_args()
+
 for org in ['yeast']:
+    store = None
     for net in ['mashup', 'GeneMANIA']:
         genem = f'data/networks/{org}/{org}_mashup_genes.txt'
         gm = textread(genem)
@@ -19,6 +34,9 @@ for org in ['yeast']:
 
         gs = gm if net == 'mashup' else gg
         genes_union = sorted(list(set(gm + gg)))
+        if args.store and store is None:
+            store = StoreWriter(collection_store(org, 'GeneMANIA_ex'),
+                                genes_union)
         with open(f'data/networks/{org}/{org}_GeneMANIA_ex_genes.txt',
                   'w') as f:
             for gene in genes_union:
@@ -54,23 +72,17 @@ for org in ['yeast']:
                 string_nets.append(net_name)
             string_nets = sorted(string_nets)
 
+        idx_map = np.array([gene2idx[idx2g[idx]] for idx in range(len(idx2g))])
         network_files = []
         for i in tqdm(range(len(string_nets))):
             network_file = f'data/networks/{org}/{org}_' +\
                 f'string_{string_nets[i]}_adjacency.txt'
-            seq1 = []
-            seq2 = []
-            seq3 = []
-            with open(network_file, 'r') as f:
-                for line in f.readlines():
-                    x, y, n = line.split()
-                    seq1.append(int(x))
-                    seq2.append(int(y))
-                    seq3.append(abs(float(n)))
-            seq1 = [gene2idx[idx2g[gene]] for gene in seq1]
-            seq2 = [gene2idx[idx2g[gene]] for gene in seq2]
+            seq1, seq2, seq3 = load_edges(network_file)
+            seq1, seq2 = idx_map[seq1], idx_map[seq2]
             path = f'data/networks/{org}/{org}_' +\
                 f'string_{string_nets[i]}_gm_adjacency.txt'
-            with open(path, 'w') as f:
-                for idx, pair in enumerate(zip(seq1, seq2)):
-                    f.write(f'{pair[0]} {pair[1]} {seq3[idx]}\n')
+            write_edges(path, seq1, seq2, seq3)
+            if args.store:
+                store.add(os.path.basename(path), seq1, seq2, seq3)
+    if args.store:
+        store.close()
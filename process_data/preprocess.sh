@@ -1,8 +1,11 @@
-python process_data/net_mashup.py
-python process_data/net_GeneMANIA.py
+# STORE=1 sh process_data/preprocess.sh also writes packed network stores
+store=${STORE:-0}
+
+python process_data/net_mashup.py --store $store
+python process_data/net_GeneMANIA.py --store $store
 python process_data/anno_goa.py
 
-python process_data/net_mashupGeneMANIA_mouse.py
-python process_data/net_mashupGeneMANIA_human.py
-python process_data/net_mashupGeneMANIA_yeast.py
+python process_data/net_mashupGeneMANIA_mouse.py --store $store
+python process_data/net_mashupGeneMANIA_human.py --store $store
+python process_data/net_mashupGeneMANIA_yeast.py --store $store
 python process_data/anno_goa_all.py
@@ -0,0 +1,54 @@
+"""
+Small networks and a private RWR cache for the tests; every check compares
+an incremental or closed-form path against a dense reference at small n
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from gemini import rwr_cache
+from gemini.net_io import write_edges
+
+NGENE = 80
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """
+    point the RWR cache at a fresh directory for every test
+    """
+    path = str(tmp_path / 'rwr_cache')
+    monkeypatch.setattr(rwr_cache, 'CACHE_DIR', path)
+    return path
+
+
+@pytest.fixture
+def network_files(tmp_path):
+    """
+    six edge lists over NGENE genes, each covering a different share of
+    them so the RWR matrices are restricted to different blocks
+    """
+    rng = np.random.default_rng(1)
+    files = []
+    for k, m in enumerate([20, 120, 10, 240, 40, 80]):
+        cover = rng.choice(NGENE, size=min(NGENE, 8 + m // 4),
+                           replace=False)
+        path = str(tmp_path / f'net{k}.txt')
+        write_edges(path, rng.choice(cover, m), rng.choice(cover, m),
+                    rng.random(m))
+        files.append(path)
+    return files
+
+
+def dense_gram(Qs, weights, ngene):
+    """
+    sum_i w_i R_i^T R_i, R_i = log(Q_i + 1/ngene), in float64
+    """
+    G = np.zeros((ngene, ngene))
+    for Q, w in zip(Qs, weights):
+        R = np.log(np.asarray(Q, dtype='float64') + 1 / ngene)
+        G += w * R.T.dot(R)
+    return G
@@ -0,0 +1,47 @@
+import numpy as np
+
+from conftest import NGENE, dense_gram
+from gemini.ablation import ablation_embeddings, fill_gram_cache, sum_grams
+from gemini.func import get_rwr
+from gemini.lowrank import embedding_alignment
+from gemini.mashup import network_svd
+
+
+def test_subtract_matches_resum(network_files):
+    """
+    total minus the dropped log-Grams against the sum of the kept ones and
+    the dense Gram of the kept networks
+    """
+    keys = fill_gram_cache(network_files, NGENE, num_thread=2,
+                           torch_thread=1)
+    weights = np.linspace(0.5, 2, len(keys))
+    drop = [1, 4]
+    keep = [i for i in range(len(keys)) if i not in drop]
+    acc = sum_grams(keys, NGENE, weights)
+    sum_grams([keys[i] for i in drop], NGENE, -weights[drop], acc)
+    G_sub = acc.result().numpy()
+    G_sum = sum_grams([keys[i] for i in keep], NGENE,
+                      weights[keep]).result().numpy()
+    G_ref = dense_gram([get_rwr(network_files[i], NGENE) for i in keep],
+                       weights[keep], NGENE)
+    scale = np.abs(G_ref).max()
+    assert np.abs(G_sum - G_ref).max() / scale < 1e-5
+    assert np.abs(G_sub - G_sum).max() / scale < 1e-5
+
+
+def test_ablation_embeddings_match_rebuild(network_files):
+    """
+    subset embeddings, by subtraction and by re-sum, against network_svd
+    of the dense Gram of the subset
+    """
+    keys = fill_gram_cache(network_files, NGENE, num_thread=2,
+                           torch_thread=1)
+    subsets = {'drop one': [0, 1, 2, 3, 4], 'keep two': [1, 3]}
+    ndim = 10
+    out = dict((name, x) for name, x, _ in ablation_embeddings(
+        keys, NGENE, ndim, subsets, torch_thread=1))
+    for name, keep in subsets.items():
+        G_ref = dense_gram([get_rwr(network_files[i], NGENE) for i in keep],
+                           np.ones(len(keep)), NGENE)
+        x_ref = network_svd(ndim, 1, G_ref, verbose=0, solver='eigh')
+        assert embedding_alignment(out[name], x_ref) < 1e-3
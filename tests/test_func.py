@@ -0,0 +1,52 @@
+import os
+
+import numpy as np
+from scipy.sparse import csr_matrix, save_npz
+
+from conftest import NGENE
+from gemini.func import get_rwr, load_network, migrate_legacy_rwr, rwr_key
+from gemini.rwr_cache import load_entry, read_manifest
+from gemini.rwr_func import rwr_torch
+
+
+def write_legacy(network_file, Q):
+    path = network_file.replace('txt', 'npz')
+    save_npz(path, csr_matrix(Q))
+    return path
+
+
+def test_get_rwr_ignores_legacy_file(network_files):
+    """
+    a legacy Q next to the network is never read implicitly
+    """
+    network_file = network_files[0]
+    write_legacy(network_file, np.zeros((NGENE, NGENE)))
+    Q = get_rwr(network_file, NGENE)
+    Q_ref = rwr_torch(load_network(network_file, NGENE, sparse=True), 0.5)
+    assert np.abs(Q - Q_ref).max() < 1e-5
+
+
+def test_migrate_legacy_rwr(network_files):
+    """
+    a legacy Q that solves the current network is cached, a stale one is not
+    """
+    good, stale = network_files[1], network_files[2]
+    write_legacy(good, rwr_torch(load_network(good, NGENE, sparse=True),
+                                 0.5))
+    key = migrate_legacy_rwr(good, NGENE)
+    assert key == rwr_key(good, NGENE)[0]
+    assert read_manifest()[key]['meta']['migrated'].endswith('.npz')
+    Q_ref = rwr_torch(load_network(good, NGENE, sparse=True), 0.5)
+    assert np.abs(get_rwr(good, NGENE) - Q_ref).max() < 1e-5
+
+    # the RWR of another network, written after this one
+    write_legacy(stale, Q_ref)
+    assert migrate_legacy_rwr(stale, NGENE) is None
+    assert load_entry(rwr_key(stale, NGENE)[0]) is None
+
+    # the right Q, but older than the network file
+    path = write_legacy(stale, rwr_torch(
+        load_network(stale, NGENE, sparse=True), 0.5))
+    mtime = os.path.getmtime(stale)
+    os.utime(path, (mtime - 10, mtime - 10))
+    assert migrate_legacy_rwr(stale, NGENE) is None
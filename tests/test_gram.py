@@ -0,0 +1,58 @@
+import numpy as np
+
+from conftest import NGENE, dense_gram
+from gemini.func import get_rwr
+from gemini.gram import (GramAccumulator, pack_gram, restricted_gram,
+                         unpack_gram)
+from gemini.rwr_func import RestrictedRWR
+
+
+def relative_error(G, G_ref):
+    return np.abs(np.asarray(G, dtype='float64') - G_ref).max() / \
+        np.abs(G_ref).max()
+
+
+def test_add_restricted_matches_dense(network_files):
+    """
+    closed-form Gram of restricted Qs against R^T R of their dense Qs
+    """
+    Qs = [get_rwr(f, NGENE, dense=False) for f in network_files]
+    assert all(isinstance(Q, RestrictedRWR) for Q in Qs)
+    assert any(len(Q.idx) < NGENE for Q in Qs)
+    weights = np.linspace(0.5, 2, len(Qs))
+    acc = GramAccumulator(NGENE, 'cpu')
+    for Q, w in zip(Qs, weights):
+        acc.add(Q, w)
+    G_ref = dense_gram([Q.todense() for Q in Qs], weights, NGENE)
+    assert relative_error(acc.result().numpy(), G_ref) < 1e-5
+
+
+def test_restricted_gram_mixed_with_dense(network_files):
+    """
+    RestrictedGrams from the workers and dense Qs in one accumulator
+    """
+    Qs = [get_rwr(f, NGENE, dense=False) for f in network_files]
+    weights = np.linspace(2, 0.5, len(Qs))
+    acc = GramAccumulator(NGENE, 'cpu')
+    for i, (Q, w) in enumerate(zip(Qs, weights)):
+        if i % 2 == 0:
+            acc.add(restricted_gram(Q, NGENE), w)
+        else:
+            acc.add(Q.todense(), w)
+    G_ref = dense_gram([Q.todense() for Q in Qs], weights, NGENE)
+    assert relative_error(acc.result().numpy(), G_ref) < 1e-5
+
+
+def test_pack_gram_round_trip(network_files):
+    """
+    packed triangles of a dense Gram, exact in float32 and within the
+    float16 precision of the scaled entries in float16
+    """
+    G = dense_gram([get_rwr(f, NGENE) for f in network_files],
+                   np.ones(len(network_files)), NGENE).astype('float32')
+    packed, scale = pack_gram(G)
+    assert scale == 1. and len(packed) == NGENE * (NGENE + 1) // 2
+    assert np.array_equal(unpack_gram(packed, NGENE, scale), G)
+    packed, scale = pack_gram(G, 'float16')
+    assert packed.dtype == np.float16 and np.isfinite(packed).all()
+    assert relative_error(unpack_gram(packed, NGENE, scale), G) < 1e-3
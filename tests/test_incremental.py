@@ -0,0 +1,53 @@
+import numpy as np
+
+from conftest import NGENE, dense_gram
+from gemini.func import get_rwr
+from gemini.incremental import incremental_embedding
+from gemini.lowrank import embedding_alignment
+from gemini.mashup import network_svd
+
+NDIM = 10
+
+
+def embed(state_dir, network_files, weights):
+    return incremental_embedding(
+        state_dir, network_files, NGENE, NDIM, weights, num_thread=2,
+        torch_thread=1, gram_cache='float32')
+
+
+def dense_embedding(network_files, weights):
+    G = dense_gram([get_rwr(f, NGENE) for f in network_files], weights,
+                   NGENE)
+    return network_svd(NDIM, 1, G, verbose=0, solver='eigh')
+
+
+def test_updates_match_rebuild(network_files, tmp_path):
+    """
+    add, then remove and reweight, against a rebuild from scratch and the
+    dense Gram of the final collection
+    """
+    state_dir = str(tmp_path / 'state')
+    _, info = embed(state_dir, network_files[:4], np.ones(4))
+    assert info['added'] == 4
+
+    _, info = embed(state_dir, network_files[:5], np.ones(5))
+    assert (info['added'], info['removed'], info['reweighted']) == (1, 0, 0)
+
+    files = network_files[1:5]
+    weights = np.array([1., 2.5, 1., 1.])
+    x, info = embed(state_dir, files, weights)
+    assert (info['added'], info['removed'], info['reweighted']) == (0, 1, 1)
+
+    x_rebuild, info = embed(str(tmp_path / 'rebuild'), files, weights)
+    assert info['added'] == len(files)
+    x_ref = dense_embedding(files, weights)
+    assert embedding_alignment(x, x_rebuild) < 1e-3
+    assert embedding_alignment(x, x_ref) < 1e-3
+
+
+def test_unchanged_collection_is_kept(network_files, tmp_path):
+    state_dir = str(tmp_path / 'state')
+    x0, _ = embed(state_dir, network_files, np.ones(len(network_files)))
+    x, info = embed(state_dir, network_files, np.ones(len(network_files)))
+    assert info['solver'] == 'unchanged'
+    assert np.allclose(x, x0)
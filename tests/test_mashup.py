@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+import torch
+
+from gemini.mashup import pick_eig_solver, top_eigh
+
+
+def test_top_eigh_randomized():
+    """
+    randomized top eigenpairs against eigh, a ValueError when the residual
+    bound is missed, and auto stays exact without a tol
+    """
+    rng = np.random.default_rng(0)
+    U, _ = np.linalg.qr(rng.standard_normal((300, 300)))
+    G = torch.from_numpy((U * 0.7 ** np.arange(300)).dot(U.T).astype(
+        'float32'))
+    d_ref, V_ref = top_eigh(G, 5, 'eigh')
+    d, V = top_eigh(G, 5, 'randomized', tol=1e-3)
+    assert np.abs(d - d_ref).max() / d_ref[0] < 1e-3
+    assert np.abs(np.abs((V * V_ref).sum(axis=0)) - 1).max() < 1e-3
+    with pytest.raises(ValueError):
+        top_eigh(G, 5, 'randomized', tol=1e-12, n_iter=1, max_iter=1)
+    assert pick_eig_solver(200, 5000) == 'eigh'
+    assert pick_eig_solver(200, 5000, tol=1e-2) == 'randomized'
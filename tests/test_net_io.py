@@ -0,0 +1,17 @@
+import numpy as np
+import pytest
+
+from gemini.net_io import gene_indices
+
+
+def test_gene_indices_rejects_unknown_genes():
+    """
+    known genes map to their indices, an unknown one raises instead of
+    turning into NaN
+    """
+    gene2idx = {'a': 2, 'b': 0, 'c': 1}
+    idx = gene_indices(['c', 'a', 'a', 'b'], gene2idx, 'net.txt')
+    assert idx.dtype == np.int64
+    assert idx.tolist() == [1, 2, 2, 0]
+    with pytest.raises(ValueError, match='net.txt: 1 edges'):
+        gene_indices(['a', 'd', 'b'], gene2idx, 'net.txt')
@@ -0,0 +1,134 @@
+import numpy as np
+import pytest
+from scipy.linalg import expm
+
+from conftest import NGENE
+from gemini.func import (apply_edge_delta, get_rwr, load_network, rwr_key,
+                         update_rwr)
+from gemini.net_io import load_edges
+from gemini.rwr_cache import read_manifest
+from gemini.rwr_func import (RWREig, heat_kernel, rwr_blocks, rwr_push,
+                              rwr_torch, rwr_woodbury, sparsify_rwr)
+
+
+def row_normalize(W):
+    return W / W.sum(axis=1, keepdims=True)
+
+
+def test_woodbury_matches_resolve():
+    """
+    Q of A + dA for a few changed rows against solving A + dA again
+    """
+    rng = np.random.default_rng(2)
+    n, alpha = 60, 0.5
+    A = row_normalize(rng.random((n, n)) * (rng.random((n, n)) < 0.2) +
+                      np.eye(n))
+    A_new = A.copy()
+    rows = [3, 17, 42]
+    A_new[rows] = row_normalize(rng.random((len(rows), n)))
+    Q = rwr_torch(A, alpha)
+    Q_new, cond = rwr_woodbury(Q, A_new - A, alpha)
+    assert cond < 1e4
+    assert np.abs(Q_new - rwr_torch(A_new, alpha)).max() < 1e-5
+
+
+def test_update_rwr_matches_resolve(network_files, tmp_path):
+    """
+    update_rwr from the cached parent against the RWR of the edited network
+    """
+    parent = network_files[3]
+    get_rwr(parent, NGENE)
+    row, col, weight = load_edges(parent, absolute=False)
+    edited = str(tmp_path / 'edited.txt')
+    apply_edge_delta(parent, edited, added=(row[:1], col[:1], [5.]))
+    Q = update_rwr(parent, edited, NGENE)
+    key, _ = rwr_key(edited, NGENE)
+    assert read_manifest()[key]['meta']['update'] == 'woodbury'
+    Q_ref = rwr_torch(load_network(edited, NGENE, sparse=True), 0.5)
+    assert np.abs(Q - Q_ref).max() < 1e-5
+
+
+def test_rwr_blocks_residual(network_files):
+    """
+    sparse block iteration against the RWR residual and the dense solve,
+    and a ValueError instead of an unconverged block
+    """
+    A = load_network(network_files[0], NGENE, sparse=True)
+    alpha, tol = 0.5, 1e-6
+    Q = np.concatenate([Qb for _, _, Qb in rwr_blocks(A, alpha, 32, 'sparse',
+                                                      tol)])
+    res = Q - alpha * np.eye(NGENE) - (1 - alpha) * A.dot(Q.T).T
+    assert np.abs(res).max() <= 1e-5
+    assert np.abs(Q - rwr_torch(A, alpha)).max() < 1e-5
+    with pytest.raises(ValueError):
+        list(rwr_blocks(A, alpha, 32, 'sparse', tol, max_iter=3))
+
+
+def test_sparsify_rwr_matches_dense_policies(network_files):
+    """
+    every truncation policy against the same selection made on the dense Q
+    """
+    A = load_network(network_files[3], NGENE, sparse=True)
+    Q = rwr_torch(A, 0.5)
+    order = np.argsort(-Q, axis=1)
+    mass = np.cumsum(np.take_along_axis(Q, order, axis=1), axis=1)
+    for truncation in ['topk:5', 'mass:0.9', 'eps:0.01']:
+        Qs, stats = sparsify_rwr(Q, truncation, block=32)
+        Qs = Qs.toarray()
+        kept = Qs != 0
+        # kept entries are copied, not renormalized
+        assert np.array_equal(Qs[kept], Q[kept])
+        if truncation == 'topk:5':
+            # rows of uncovered nodes are e_i, with a single entry to keep
+            assert (kept.sum(axis=1) == np.minimum(
+                (Q > 0).sum(axis=1), 5)).all()
+            assert (Qs.max(axis=1) == Q.max(axis=1)).all()
+        elif truncation == 'mass:0.9':
+            k = (mass < 0.9 * mass[:, -1:]).sum(axis=1) + 1
+            assert (kept.sum(axis=1) == k).all()
+        else:
+            assert np.array_equal(kept, Q > 0.01)
+        part = Qs.sum(axis=1) / Q.sum(axis=1)
+        assert abs(stats['kept_mass_min'] - part.min()) < 1e-5
+
+
+def test_rwr_eig_matches_dense_solve(network_files):
+    """
+    one eigendecomposition against a dense solve for every alpha, with and
+    without the restriction to the covered nodes
+    """
+    A, deg = load_network(network_files[1], NGENE, sparse=True, degree=True)
+    factors = [RWREig(A, deg), RWREig(A, deg, restrict=False)]
+    assert len(factors[0].idx) < NGENE
+    for alpha in [0.2, 0.5, 0.8]:
+        Q_ref = rwr_torch(A, alpha)
+        for factor in factors:
+            Q = factor.rwr(alpha)
+            if factor.restrict:
+                Q = Q.todense()
+            assert np.abs(Q - Q_ref).max() < 1e-4
+
+
+def test_rwr_push_under_estimates_by_eps(network_files):
+    """
+    local push against the dense solve: entries only under-estimated, by
+    at most eps
+    """
+    A = load_network(network_files[5], NGENE, sparse=True)
+    Q_ref = rwr_torch(A, 0.5)
+    for eps in [1e-3, 1e-5]:
+        Q = rwr_push(A, 0.5, eps, block=32).toarray()
+        gap = Q_ref - Q
+        assert gap.min() > -1e-5
+        assert gap.max() <= eps + 1e-5
+
+
+def test_heat_kernel_matches_expm(network_files):
+    """
+    truncated Poisson series against the dense matrix exponential
+    """
+    A = load_network(network_files[4], NGENE, sparse=True)
+    for t in [0.5, 3.0]:
+        H_ref = expm(-t * (np.eye(NGENE) - A.toarray())).T
+        H = heat_kernel(A, t, tol=1e-6, block=32)
+        assert np.abs(H - H_ref).max() < 1e-5
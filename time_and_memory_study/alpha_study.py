@@ -0,0 +1,107 @@
+"""
+Sweep the RWR restart probability: every network is factored once (rwr
+solver 'eig') and its Q cached for all alphas, then the Gemini embedding
+of each alpha is built from the cache and evaluated.
+"""
+
+import argparse
+import os
+import random
+import time
+import json
+from functools import partial
+
+import numpy as np
+import torch
+import sys
+
+sys.path.append(os.path.join(sys.path[0], '../'))
+from config import GEMINI_DIR
+from gemini.func import get_rwr_alphas, out_network_files, textread
+from gemini.load_anno_vali import load_anno_and_cross_validation
+from gemini.mashup import largest_first, load_multi
+from gemini.shm_slots import imap_results
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--org', type=str, default='yeast')
+    parser.add_argument('--net', type=str, default='GeneMANIA_ex')
+    parser.add_argument('--ndim', type=int, default=800)
+    parser.add_argument('--num_thread', type=int, default=4)
+    parser.add_argument('--torch_thread', type=int, default=5)
+    parser.add_argument('--alphas', type=str, default='0.1,0.3,0.5,0.7,0.9',
+                        help='comma separated restart probabilities')
+    parser.add_argument('--best_epoch', type=int, default=None)
+    parser.add_argument('--ratio', type=float, default=0.2)
+    parser.add_argument('--device', type=str, default='')
+    parser.add_argument('--num-nets', type=int,
+                        help='Number of networks to use.')
+    return parser.parse_args()
+
+
+args = get_args()
+
+
+def read_auprc(experiment_name, best_epoch):
+    with open(GEMINI_DIR + f'data/results/{experiment_name}' +
+              f'_{best_epoch}_result.txt', 'r') as f:
+        for line in f:
+            if line.startswith('AUPRC'):
+                return float(line.split()[1])
+
+
+def fill_cache(ngene, alphas, torch_thread, network_file):
+    torch.set_num_threads(torch_thread)
+    Qs = get_rwr_alphas(network_file, ngene, alphas, dense=False)
+    del(Qs)
+    return network_file
+
+
+def main():
+    torch.manual_seed(1)
+    random.seed(1)
+    np.random.seed(1)
+    org, net, ndim = args.org, args.net, args.ndim
+
+    network_files = out_network_files(net, org)[:args.num_nets]
+    gene_file = GEMINI_DIR + f'data/networks/{org}/{org}_{net}_genes.txt'
+    ngene = len(textread(gene_file))
+    device = None if args.device == '' else args.device
+    alphas = [float(a) for a in args.alphas.split(',')]
+
+    # one factorization per network serves every alpha
+    s = time.time()
+    f = partial(fill_cache, ngene, alphas, args.torch_thread)
+    for _ in imap_results(f, network_files, args.num_thread,
+                          order=largest_first(network_files)):
+        pass
+    sweep_time = time.time() - s
+    print(f'{len(alphas)} alphas of {len(network_files)} networks cached '
+          f'in {sweep_time:.1f}s')
+
+    results = {'sweep time (s)': sweep_time}
+    for alpha in alphas:
+        print(f'[alpha {alpha}]')
+        x = load_multi(network_files, ngene, ndim, None, args.num_thread,
+                       args.torch_thread, rwr_solver='eig', alpha=alpha)
+        experiment_name = f'alpha_{org}_{net}_{ndim}_{alpha}'
+        load_anno_and_cross_validation('NN', org, net, experiment_name, x,
+                                       args.ratio, args.best_epoch,
+                                       device=device)
+        results[str(alpha)] = read_auprc(experiment_name, args.best_epoch)
+
+    print('_______________________________________________________________')
+    print('alpha\tAUPRC')
+    for alpha in alphas:
+        print(f'{alpha}\t{results[str(alpha)]:.4f}')
+    print('_______________________________________________________________')
+
+    if not os.path.exists('monitoring_results/'):
+        os.makedirs('monitoring_results/')
+    with open(f'monitoring_results/alpha_{org}_{net}_{ndim}.txt', 'w') as f:
+        json.dump(results, f)
+
+
+if __name__ == '__main__':
+    main()
@@ -19,8 +19,10 @@ import tracemalloc
 import sys
 sys.path.append(os.path.join(sys.path[0], '../'))
 from config import GEMINI_DIR
-from gemini.func import out_moment_emb, out_string_nets, textread
-from gemini.mashup import mashup_multi
+from gemini.func import out_moment_emb, out_network_files, textread
+from gemini.net_store import network_nodes
+from gemini.mashup import largest_first, mashup_multi
+from gemini.shm_slots import imap_results
 
 
 def get_args():
@@ -38,124 +40,21 @@ def get_args():
     parser.add_argument('--embed_type', type=str, default='Qsm4')
     parser.add_argument('--axis', type=int, default=1)
     parser.add_argument('--num-nets', type=int, help='Number of networks to use.')
+    parser.add_argument('--prefix_scan', type=str, default='',
+                        help='comma separated M, e.g. 5,10,50,100,250,505: '
+                        'every network is embedded once and the clustering '
+                        'and monitoring results of every M are checkpointed')
     return parser.parse_args()
 
 
 args = get_args()
 
 
-def main():
-    torch.manual_seed(1)
-    random.seed(1)
-    np.random.seed(1)
-    org = args.org
-
-    net = args.net
-
-    method = args.method
-    torch_thread = args.torch_thread
-    num_thread = args.num_thread
-
-    mixup = True
-
-    ndim = args.ndim
-
-    if args.net == 'bionic':
-        print("Thnk we're running Bionic networks!!")
-        network_files = []
-        for name in ['Krogan-2006', 'Costanzo-2016', 'Hu-2007']:
-            network_files.append(GEMINI_DIR + 'data/networks/bionic/{}.txt'.format(name))
-        with open(GEMINI_DIR + 'data/networks/bionic/bionic_gene_ordering.txt', 'r') as f:
-            genes = json.load(f)
-    else:
-        string_nets = out_string_nets(net, org)
-
-        # Load gene list
-        gene_file = GEMINI_DIR +  f'data/networks/{org}/{org}_{net}_genes.txt'
-        genes = textread(gene_file)
-        network_files = []
-        for i in range(len(string_nets)):
-            network_files.append(
-               GEMINI_DIR +  f'data/networks/{org}/{org}_string_{string_nets[i]}_adjacency.txt')
-    
-    network_files = network_files[:args.num_nets]
-    print('RESTRICTED TO {} NETWORKS'.format(len(network_files)))
-    
-    # START MONITORING CODE
-    print("---------STARTING TO MONITOR CLUSTER.PY-----------------")
-    start_time = time.time()
-    torch.cuda.reset_peak_memory_stats()
-    cuda_before = int(torch.cuda.memory_allocated()/2**20)  # convert to MB
-    tracemalloc.start()
-    
-    ngene = len(genes)
-
-    num_net = len(network_files)
-    print(num_net)
-    average_type = 0
-    # 0 averaged on log rwr
-    # 1 averaged on log rwr
-    # compute cluster
-    embeds = []
-    embed_name = GEMINI_DIR + f'data/embed/{args.num_nets}--{net}_{org}_type{average_type}_' + \
-        f'{args.embed_type}{args.axis}_{args.level}.npy'
-
-    if os.path.exists(
-            embed_name) or 'all' in embed_name:
-        pass
-    else:
-        print(embed_name)
-        print('calculate embedding for each network')
-        run_mashup = args.run_mashup
-        if run_mashup == 1:
-            # Mashup integration
-            print(f'{method}_{org}_{net}_{ndim}')
-            print('[Mashup]')
-            _ = mashup_multi(network_files, ngene, ndim,
-                             mixup, num_thread, torch_thread)
-
-        if args.level == 'network':
-            data = network_files, average_type, ngene
-            f = partial(out_moment_emb, data)
-            max_len = num_net
-        elif args.level == 'node':
-            data = network_files, average_type, ngene
-            # f = partial(out_var_emb_node, data)
-            max_len = ngene
-
-        max_idx = max_len//num_thread
-        max_idx = max_idx+1 if max_len % num_thread > 0 else max_idx
-        for i in tqdm(range(max_idx)):
-            start_idx = num_thread*(i)
-            end_idx = num_thread*(i+1)
-            end_idx = end_idx if end_idx <= max_len else max_len
-            idxs = np.arange(num_net)[start_idx:end_idx]
-            use_pool = True
-            if not use_pool:
-                embed_part = []
-                for idx in idxs:
-                    embed_part.append(f(idx))
-            else:
-                with Pool(processes=num_thread) as pl:
-                    embed_part = pl.map(f, idxs)
-            embeds.extend(embed_part)
-
-        i_ = -1
-        for od in [1, 2, 3, 4]:
-            for em in ['Q']:
-                for embed_type in [f'{em}sm{od}', f'{em}m{od}']:
-                    for axis in [1]:
-                        i_ += 1
-                        c = np.array([embeds[i][i_]
-                                      for i in range(len(embeds))])
-                        np.save(
-                            GEMINI_DIR + f'data/embed/{args.num_nets}--{net}_{org}_type{average_type}_' +
-                            f'{embed_type}{axis}_{args.level}', c)
-    c = np.load(
-        GEMINI_DIR + f'data/embed/{args.num_nets}--{net}_{org}_type{average_type}_' +
-        f'{args.embed_type}{args.axis}_{args.level}.npy')
-    c = c[:len(network_files)]
-    print(c.shape)
+def cluster_networks(c, network_files):
+    """
+    cluster the moment embeddings c of network_files with
+    args.cluster_method into args.separate groups, labels renumbered 0..k-1
+    """
     n_components = int(args.separate)
 
     cluster = args.cluster_method
@@ -198,14 +97,7 @@ def main():
         from sklearn.metrics.pairwise import euclidean_distances
         net_seq = []
         for network_file in tqdm(np.array(network_files)):
-            seq1, seq2 = [], []
-            with open(network_file, 'r') as f:
-                for line in f.readlines():
-                    x, y, n = line.split()
-                    x, y, n = int(x), int(y), np.abs(float(n))
-                    seq1.append(x)
-                    seq2.append(y)
-            net_seq.append(set(seq1+seq1))
+            net_seq.append(set(network_nodes(network_file).tolist()))
         N_graphs = len(net_seq)
         kurt_dist = np.zeros((N_graphs, N_graphs))
         for g1 in tqdm(range(N_graphs)):
@@ -230,14 +122,7 @@ def main():
         from sklearn.metrics.pairwise import euclidean_distances
         net_seq = []
         for network_file in tqdm(np.array(network_files)):
-            seq1, seq2 = [], []
-            with open(network_file, 'r') as f:
-                for line in f.readlines():
-                    x, y, n = line.split()
-                    x, y, n = int(x), int(y), np.abs(float(n))
-                    seq1.append(x)
-                    seq2.append(y)
-            net_seq.append(set(seq1+seq1))
+            net_seq.append(set(network_nodes(network_file).tolist()))
         N_graphs = len(net_seq)
         kurt_dist = np.zeros((N_graphs, N_graphs))
         for g1 in tqdm(range(N_graphs)):
@@ -261,32 +146,189 @@ def main():
         separate = clustering.labels_
 
     num2i = {num: i for i, num in enumerate(list(set(separate)))}
-    separate = [num2i[num] for num in separate]
+    return [num2i[num] for num in separate]
+
+
+def moment_embeddings(network_files, ngene, average_type, idxs, embeds):
+    """
+    fill embeds[idx], the moment embeddings of network idx, for idxs on one
+    pool, largest first
+    """
+    data = network_files, average_type, ngene
+    f = partial(out_moment_emb, data)
+    files = [network_files[idx] for idx in idxs]
+    for j, embed in tqdm(imap_results(f, idxs, args.num_thread,
+                                      order=largest_first(files)),
+                         total=len(idxs)):
+        embeds[idxs[j]] = embed
 
+
+def save_embeddings(embeds, num_nets, net, org, average_type):
+    i_ = -1
+    for od in [1, 2, 3, 4]:
+        for em in ['Q']:
+            for embed_type in [f'{em}sm{od}', f'{em}m{od}']:
+                for axis in [1]:
+                    i_ += 1
+                    c = np.array([embeds[i][i_]
+                                  for i in range(len(embeds))])
+                    np.save(
+                        GEMINI_DIR + f'data/embed/{num_nets}--{net}_{org}_type{average_type}_' +
+                        f'{embed_type}{axis}_{args.level}', c)
+
+
+def save_separate(separate, num_nets, net, org, average_type):
     if not os.path.exists(GEMINI_DIR + 'data/separate'):
         os.mkdir(GEMINI_DIR + 'data/separate')
     np.save(
-        GEMINI_DIR + f'data/separate/{args.num_nets}--{net}_{org}_type{average_type}_' +
-        f'{args.embed_type}{args.axis}_{cluster}_{args.level}',
+        GEMINI_DIR + f'data/separate/{num_nets}--{net}_{org}_type{average_type}_' +
+        f'{args.embed_type}{args.axis}_{args.cluster_method}_{args.level}',
         separate)
+
+
+def save_monitoring(num_nets, hours, peak_memory, cuda_peak):
+    print('_______________________________________________________________')
+    print('Monitoring results:')
+    print('\tRuntime (hours): {:.2e}'.format(hours))
+    print('\tPeak CPU memory (MB): {:.2e}'.format(peak_memory))
+    print('\tPeak GPU memory (MB): {:.2e}'.format(cuda_peak))
+    print('_______________________________________________________________')
+
+    if not os.path.exists('monitoring_results/'):
+        os.makedirs('monitoring_results/')
+    with open('monitoring_results/cluster:{}_M={}_results.txt'.format(
+            args.method, num_nets), 'w') as f:
+        json.dump({'time (hrs)': hours,
+                   'peak CPU memory (MiB)': peak_memory,
+                   'peak GPU memory (MiB)': cuda_peak}, f)
+
+
+def prefix_scan(network_files, ngene, checkpoints, net, org, average_type):
+    """
+    every point of the scaling curve from one pass: the moment embedding of
+    a network does not depend on the others, so each is computed once and
+    the first M are clustered at every M; the runtime of M leaves out the
+    clusterings of smaller M, peak memories are running peaks
+    """
+    print("---------STARTING TO MONITOR CLUSTER.PY-----------------")
+    torch.cuda.reset_peak_memory_stats()
+    cuda_before = int(torch.cuda.memory_allocated()/2**20)  # convert to MB
+    tracemalloc.start()
+    s = time.time()
+    spent = 0
+    embeds = [None] * len(network_files)
+    start = 0
+    for M in sorted(set(min(M, len(network_files)) for M in checkpoints)):
+        moment_embeddings(network_files, ngene, average_type,
+                          list(range(start, M)), embeds)
+        start = M
+        save_embeddings(embeds[:M], M, net, org, average_type)
+
+        t = time.time()
+        c = np.load(
+            GEMINI_DIR + f'data/embed/{M}--{net}_{org}_type{average_type}_' +
+            f'{args.embed_type}{args.axis}_{args.level}.npy')
+        separate = cluster_networks(c, network_files[:M])
+        save_separate(separate, M, net, org, average_type)
+        cuda_peak = int(torch.cuda.max_memory_allocated()/2**20)
+        _, peak_memory = tracemalloc.get_traced_memory()
+        print(f'[M = {M}]')
+        save_monitoring(M, (time.time() - s - spent)/60**2,
+                        peak_memory/2**20, cuda_peak-cuda_before)
+        spent += time.time() - t
+    tracemalloc.stop()
+
+
+def main():
+    torch.manual_seed(1)
+    random.seed(1)
+    np.random.seed(1)
+    org = args.org
+
+    net = args.net
+
+    method = args.method
+    torch_thread = args.torch_thread
+    num_thread = args.num_thread
+
+    mixup = True
+
+    ndim = args.ndim
+
+    if args.net == 'bionic':
+        print("Thnk we're running Bionic networks!!")
+        network_files = []
+        for name in ['Krogan-2006', 'Costanzo-2016', 'Hu-2007']:
+            network_files.append(GEMINI_DIR + 'data/networks/bionic/{}.txt'.format(name))
+        with open(GEMINI_DIR + 'data/networks/bionic/bionic_gene_ordering.txt', 'r') as f:
+            genes = json.load(f)
+    else:
+        # Load gene list
+        gene_file = GEMINI_DIR +  f'data/networks/{org}/{org}_{net}_genes.txt'
+        genes = textread(gene_file)
+        network_files = out_network_files(net, org)
+    
+    if args.prefix_scan != '':
+        checkpoints = [int(M) for M in args.prefix_scan.split(',')]
+        network_files = network_files[:max(checkpoints)]
+        print('PREFIX SCAN OVER {} NETWORKS'.format(len(network_files)))
+        prefix_scan(network_files, len(genes), checkpoints, net, org, 0)
+        return
+    network_files = network_files[:args.num_nets]
+    print('RESTRICTED TO {} NETWORKS'.format(len(network_files)))
     
+    # START MONITORING CODE
+    print("---------STARTING TO MONITOR CLUSTER.PY-----------------")
+    start_time = time.time()
+    torch.cuda.reset_peak_memory_stats()
+    cuda_before = int(torch.cuda.memory_allocated()/2**20)  # convert to MB
+    tracemalloc.start()
+    
+    ngene = len(genes)
+
+    num_net = len(network_files)
+    print(num_net)
+    average_type = 0
+    # 0 averaged on log rwr
+    # 1 averaged on log rwr
+    # compute cluster
+    embeds = []
+    embed_name = GEMINI_DIR + f'data/embed/{args.num_nets}--{net}_{org}_type{average_type}_' + \
+        f'{args.embed_type}{args.axis}_{args.level}.npy'
+
+    if os.path.exists(
+            embed_name) or 'all' in embed_name:
+        pass
+    else:
+        print(embed_name)
+        print('calculate embedding for each network')
+        run_mashup = args.run_mashup
+        if run_mashup == 1:
+            # Mashup integration
+            print(f'{method}_{org}_{net}_{ndim}')
+            print('[Mashup]')
+            _ = mashup_multi(network_files, ngene, ndim,
+                             mixup, num_thread, torch_thread)
+
+        # one pool for all networks, largest first
+        embeds = [None] * num_net
+        moment_embeddings(network_files, ngene, average_type,
+                          list(range(num_net)), embeds)
+        save_embeddings(embeds, args.num_nets, net, org, average_type)
+    c = np.load(
+        GEMINI_DIR + f'data/embed/{args.num_nets}--{net}_{org}_type{average_type}_' +
+        f'{args.embed_type}{args.axis}_{args.level}.npy')
+    c = c[:len(network_files)]
+    print(c.shape)
+    separate = cluster_networks(c, network_files)
+    save_separate(separate, args.num_nets, net, org, average_type)
+
     end_time = time.time()
     cuda_peak = int(torch.cuda.max_memory_allocated()/2**20)
     _, peak_memory = tracemalloc.get_traced_memory()
     tracemalloc.stop()
-    
-    print('_______________________________________________________________')
-    print('Monitoring results:')
-    print('\tRuntime (hours): {:.2e}'.format((end_time-start_time)/60**2))
-    print('\tPeak CPU memory (MB): {:.2e}'.format(peak_memory/2**20))
-    print('\tPeak GPU memory (MB): {:.2e}'.format(cuda_peak-cuda_before))
-    print('_______________________________________________________________')
-    
-    import json
-     with open('monitoring_results/cluster:{}_M={}_results.txt'.format(args.method, args.num_nets), 'w') as f:
-         json.dump({'time (hrs)': (end_time-start_time)/60**2,
-                    'peak CPU memory (MiB)': peak_memory/2**20,
-                    'peak GPU memory (MiB)': cuda_peak-cuda_before}, f)
+    save_monitoring(args.num_nets, (end_time-start_time)/60**2,
+                    peak_memory/2**20, cuda_peak-cuda_before)
 
 
 if __name__ == '__main__':
@@ -6,6 +6,7 @@ keeping track of the runtime, peak CPU usage, and peak GPU usage.
 import argparse
 import os
 import random
+import resource
 import time
 import tracemalloc
 import json
@@ -16,8 +17,9 @@ import sys
 
 sys.path.append(os.path.join(sys.path[0], '../'))
 from config import GEMINI_DIR
-from gemini.func import out_string_nets, textread
-from gemini.mashup import load_multi, mashup, mashup_multi
+from gemini.func import out_network_files, textread
+from gemini.mashup import (load_multi, mashup, mashup_multi,
+                           prefix_embeddings)
 
 
 def get_args():
@@ -42,12 +44,67 @@ def get_args():
     parser.add_argument('--ori_seed', type=int, default=0)
     parser.add_argument('--rwr', type=str, default='rwr')
     parser.add_argument('--num-nets', type=int, help='Number of networks to use.')
+    parser.add_argument('--prefix_scan', type=str, default='',
+                        help='comma separated M, e.g. 5,10,50,100,250,505: '
+                        'one pass over the networks checkpoints the '
+                        'embedding and monitoring results of every M')
+    parser.add_argument('--gram_cache', type=str, default=None,
+                        help='float32 or float16 per-network Grams')
     return parser.parse_args()
 
 
 args = get_args()
 
 
+def save_monitoring(method, num_nets, hours, peak_memory, cuda_peak):
+    print('_______________________________________________________________')
+    print('Monitoring results:')
+    print('\tRuntime (hours): {:.2e}'.format(hours))
+    print('\tPeak CPU memory (MB): {:.2e}'.format(peak_memory))
+    print('\tPeak GPU memory (MB): {:.2e}'.format(cuda_peak))
+    print('_______________________________________________________________')
+
+    if not os.path.exists('monitoring_results/'):
+        os.makedirs('monitoring_results/')
+    with open('monitoring_results/{}_M={}_results.txt'.format(
+            method, num_nets), 'w') as f:
+        json.dump({'time (hrs)': hours,
+                   'peak CPU memory (MiB)': peak_memory,
+                   'peak GPU memory (MiB)': cuda_peak}, f)
+
+
+def prefix_scan(network_files, ngene, checkpoints):
+    """
+    every point of the scaling curve from one pass: the networks are
+    streamed once into the running Gram and the embedding of the first M is
+    saved as the M--... embedding of a --num-nets M run; the runtime of M
+    leaves out the eigensolvers of smaller M, peak memories are running
+    peaks, i.e. those of a pass stopping at M; the CPU one is the resident
+    peak of this process (ru_maxrss), so it covers torch and BLAS buffers
+    that tracemalloc does not see, but not the pool workers
+    """
+    if args.weight > 0 or args.mixup != 0:
+        # cluster weights and mixup pairs are drawn per M, so they are not
+        # a prefix of one stream
+        raise ValueError('--prefix_scan runs the unweighted load_multi '
+                         'pipeline, use --weight 0 --mixup 0')
+    method, org, net, ndim = args.method, args.org, args.net, args.ndim
+    print("---------STARTING TO MONITOR GEMINI.PY-----------------")
+    torch.cuda.reset_peak_memory_stats()
+    cuda_before = int(torch.cuda.memory_allocated()/2**20)  # convert to MB
+    for M, x, seconds in prefix_embeddings(
+            network_files, ngene, ndim, checkpoints, args.num_thread,
+            args.torch_thread, gram_cache=args.gram_cache):
+        cuda_peak = int(torch.cuda.max_memory_allocated()/2**20)
+        # ru_maxrss is in KiB on Linux
+        peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        np.save(GEMINI_DIR + f'data/embed/{M}--{method}_{org}_{net}_{ndim}',
+                x)
+        print(f'[M = {M}]')
+        save_monitoring(method, M, seconds/60**2, peak_memory/2**10,
+                        cuda_peak-cuda_before)
+
+
 def main():
     torch.manual_seed(1)
     random.seed(1)
@@ -71,14 +128,13 @@ def main():
             network_files.append(GEMINI_DIR + 'data/networks/bionic/{}.txt'.format(name))
     
     else:
-        string_nets = out_string_nets(net, org)
-
-        network_files = []
-        for i in range(len(string_nets)):
-            network_files.append(
-               GEMINI_DIR + f'data/networks/{org}/{org}_string_{string_nets[i]}_adjacency.txt')
+        network_files = out_network_files(net, org)
 
-    network_files = network_files[:args.num_nets]
+    if args.prefix_scan != '':
+        checkpoints = [int(M) for M in args.prefix_scan.split(',')]
+        network_files = network_files[:max(checkpoints)]
+    else:
+        network_files = network_files[:args.num_nets]
     print('RESTRICTED TO {} NETWORKS'.format(len(network_files)))
     
     # Load gene list
@@ -89,7 +145,13 @@ def main():
         gene_file = GEMINI_DIR + f'data/networks/{org}/{org}_{net}_genes.txt'
         genes = textread(gene_file)
     ngene = len(genes)
-    
+
+    if not os.path.exists(GEMINI_DIR + 'data/embed'):
+        os.mkdir(GEMINI_DIR + 'data/embed')
+    if args.prefix_scan != '':
+        prefix_scan(network_files, ngene, checkpoints)
+        return
+
     # START MONITORING CODE
     print("---------STARTING TO MONITOR GEMINI.PY-----------------")
     start_time = time.time()
@@ -101,9 +163,6 @@ def main():
     print(f'{method}_{org}_{net}_{ndim}')
     print('[Mashup]')
 
-    if not os.path.exists(GEMINI_DIR + 'data/embed'):
-        os.mkdir(GEMINI_DIR + 'data/embed')
-
     embd_name = GEMINI_DIR + f'data/embed/{args.num_nets}--{method}_{org}_{net}_{ndim}'
 
     node_weights = None
@@ -257,22 +316,9 @@ def main():
     cuda_peak = int(torch.cuda.max_memory_allocated()/2**20)
     _, peak_memory = tracemalloc.get_traced_memory()
     tracemalloc.stop()
-        
-    print('_______________________________________________________________')
-    print('Monitoring results:')
-    print('\tRuntime (hours): {:.2e}'.format((end_time-start_time)/60**2))
-    print('\tPeak CPU memory (MB): {:.2e}'.format(peak_memory/2**20))
-    print('\tPeak GPU memory (MB): {:.2e}'.format(cuda_peak-cuda_before))
-    print('_______________________________________________________________')
-    
-    if not os.path.exists('monitoring_results/'):
-        os.makedirs('monitoring_results/')
-        
-    import json
-    with open('monitoring_results/{}_M={}_results.txt'.format(args.method, args.num_nets), 'w') as f:
-        json.dump({'time (hrs)': (end_time-start_time)/60**2,
-                   'peak CPU memory (MiB)': peak_memory/2**20,
-                   'peak GPU memory (MiB)': cuda_peak-cuda_before}, f)
+    save_monitoring(args.method, args.num_nets,
+                    (end_time-start_time)/60**2, peak_memory/2**20,
+                    cuda_peak-cuda_before)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,106 @@
+"""
+Compare sparsified RWR caches against the dense one: cache size, load time
+and the AUPRC of the resulting Gemini embeddings.
+"""
+
+import argparse
+import os
+import random
+import time
+import json
+
+import numpy as np
+import torch
+import sys
+
+sys.path.append(os.path.join(sys.path[0], '../'))
+from config import GEMINI_DIR
+from gemini.func import get_rwr, out_network_files, textread
+from gemini.load_anno_vali import load_anno_and_cross_validation
+from gemini.mashup import load_multi
+from gemini.rwr_cache import cache_key, entry_bytes, rwr_params
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--org', type=str, default='yeast')
+    parser.add_argument('--net', type=str, default='GeneMANIA_ex')
+    parser.add_argument('--ndim', type=int, default=800)
+    parser.add_argument('--num_thread', type=int, default=4)
+    parser.add_argument('--torch_thread', type=int, default=5)
+    parser.add_argument('--truncations', type=str,
+                        default='topk:50,topk:200,mass:0.9,eps:1e-4',
+                        help='comma separated, compared with the dense cache')
+    parser.add_argument('--best_epoch', type=int, default=None)
+    parser.add_argument('--ratio', type=float, default=0.2)
+    parser.add_argument('--device', type=str, default='')
+    parser.add_argument('--num-nets', type=int,
+                        help='Number of networks to use.')
+    return parser.parse_args()
+
+
+args = get_args()
+
+
+def read_auprc(experiment_name, best_epoch):
+    with open(GEMINI_DIR + f'data/results/{experiment_name}' +
+              f'_{best_epoch}_result.txt', 'r') as f:
+        for line in f:
+            if line.startswith('AUPRC'):
+                return float(line.split()[1])
+
+
+def main():
+    torch.manual_seed(1)
+    random.seed(1)
+    np.random.seed(1)
+    org, net, ndim = args.org, args.net, args.ndim
+
+    network_files = out_network_files(net, org)[:args.num_nets]
+    gene_file = GEMINI_DIR + f'data/networks/{org}/{org}_{net}_genes.txt'
+    ngene = len(textread(gene_file))
+    device = None if args.device == '' else args.device
+
+    results = {}
+    for truncation in [None] + args.truncations.split(','):
+        print(f'[truncation {truncation}]')
+        x = load_multi(network_files, ngene, ndim, None, args.num_thread,
+                       args.torch_thread, truncation=truncation)
+
+        # the embedding filled the cache, time a second read of it
+        s = time.time()
+        for network_file in network_files:
+            Q = get_rwr(network_file, ngene, truncation=truncation)
+            del(Q)
+        load_time = time.time() - s
+        size = sum(entry_bytes(cache_key(
+            network_file, rwr_params(ngene, truncation=truncation)))
+            for network_file in network_files)
+
+        experiment_name = f'truncation_{org}_{net}_{ndim}_{truncation}'
+        load_anno_and_cross_validation('NN', org, net, experiment_name, x,
+                                       args.ratio, args.best_epoch,
+                                       device=device)
+        results[str(truncation)] = {
+            'cache (MiB)': size/2**20, 'load time (s)': load_time,
+            'AUPRC': read_auprc(experiment_name, args.best_epoch)}
+
+    dense = results['None']
+    print('_______________________________________________________________')
+    print('truncation\tcache (MiB)\tsmaller\tload (s)\tAUPRC\tchange')
+    for truncation, r in results.items():
+        print(f"{truncation}\t{r['cache (MiB)']:.1f}\t"
+              f"{dense['cache (MiB)']/max(r['cache (MiB)'], 1e-9):.1f}x\t"
+              f"{r['load time (s)']:.1f}\t{r['AUPRC']:.4f}\t"
+              f"{r['AUPRC'] - dense['AUPRC']:+.4f}")
+    print('_______________________________________________________________')
+
+    if not os.path.exists('monitoring_results/'):
+        os.makedirs('monitoring_results/')
+    with open(f'monitoring_results/truncation_{org}_{net}_{ndim}.txt',
+              'w') as f:
+        json.dump(results, f)
+
+
+if __name__ == '__main__':
+    main()